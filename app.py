@@ -1,15 +1,26 @@
 import time
+from concurrent.futures import Future, TimeoutError as FuturesTimeoutError
+from typing import Any, Optional
 import pandas as pd
 import streamlit as st
-from streamlit_ace import st_ace
 from sqlalchemy.engine import URL
-from langchain_community.utilities import SQLDatabase
-from pipeline.agent_pipeline import generate_sql_query
-from pipeline.db_executor import execute_sql_query
-from config import OPENAI_MODELS
+from pipeline.cost_guard import QueryCostError
+from pipeline.db_executor import stream_sql_query
+from pipeline.paginator import ResultPaginator, open_result_paginator
+from pipeline.sql_validator import SQLValidationError
+from pipeline.query_control import StatementHandle, discard_result, submit_query
+from pipeline.dashboard_executor import run_metrics_concurrently
+from pipeline.scheduler import initial_offset, scheduled_result_ttl
+from pipeline.result_cache import default_ttl, get_cached_result, get_result_cache_stats, record_bypass, store_result
+from pipeline.schema_catalog import get_schema_catalog, refresh_schema_catalog
+from pipeline.generation_cache import invalidate_generation_cache
+from config import OPENAI_MODELS, get_bool_config, get_int_config
+from strategies.llms.openai_llm import get_llm_client_stats
 from utils.storage import  *
 from utils.connection import get_connection_id
-from sql_formatter.core import format_sql
+from utils.result_store import SessionResultStore
+from utils.security import is_query_safe
+from utils.tracing import get_counter_totals, get_recent_traces, get_stage_summary, span, start_metrics_server, trace
 
 # --- Configuração da Página ---
 st.set_page_config(page_title="DataSpeak", page_icon="✨", layout="wide")
@@ -25,12 +36,21 @@ def initialize_session_state():
         "connection_configured": False,
         "db_uri": "", 
         "custom_metadata": "", 
-        "dashboard_results": {}
+        "dashboard_results": {},
+        "dashboard_timings": {},
+        "dashboard_refresh": set()
     }
     for key, value in defaults.items():
         if key not in st.session_state:
             st.session_state[key] = value
             
+    # Resultados do chat em formato colunar, com orçamento de memória e spill para disco
+    if "result_store" not in st.session_state:
+        st.session_state.result_store = SessionResultStore()
+    # Resultados paginados do chat: apenas as páginas visitadas ficam em memória
+    if "result_pages" not in st.session_state:
+        st.session_state.result_pages = {}
+
     # Carrega a chave da API do armazenamento UMA ÚNICA VEZ
     if "openai_api_key" not in st.session_state:
         st.session_state.openai_api_key = load_api_key()            
@@ -42,11 +62,18 @@ def reset_connection():
     st.session_state.db_uri = ""
     st.session_state.db_type = "SQLite" # Reseta para o padrão
     st.session_state.messages = [] # Limpa o histórico de chat da conexão anterior
+    st.session_state.result_store.clear() # Descarta os resultados (e arquivos de spill) do chat
+    st.session_state.result_pages = {}
     st.session_state.dashboard_results = {} # Limpa os resultados do dashboard
+    st.session_state.dashboard_timings = {}
+    st.session_state.dashboard_refresh = set()
     st.session_state.custom_metadata = "" # Limpa o contexto
 
 initialize_session_state()
 
+# Endpoint /metrics no formato do Prometheus (apenas se TRACING_PROMETHEUS_PORT estiver configurada)
+start_metrics_server()
+
 # --- Dicionário de Configurações ---
 DB_CONFIGS = {
     "SQLite": {"driver": "sqlite"},
@@ -130,6 +157,10 @@ def edit_metric_dialog(dashboard_name: str, metric_name: str, metric_data: dict,
 
     st.write("Query SQL (editável):")
 
+    # Editor e formatador só são carregados quando o diálogo é aberto
+    from sql_formatter.core import format_sql
+    from streamlit_ace import st_ace
+
     # 1. Pega a query SQL original (potencialmente mal formatada)
     original_sql = metric_data.get("sql_query", "")
     
@@ -149,6 +180,16 @@ def edit_metric_dialog(dashboard_name: str, metric_name: str, metric_data: dict,
         auto_update=True,       # Atualiza o valor em tempo real (opcional)        
     )
 
+    # Validade do resultado no cache compartilhado entre as sessões
+    current_ttl = metric_data.get("cache_ttl") or default_ttl()
+    cache_minutes = st.number_input(
+        "Validade do resultado em cache (minutos)",
+        min_value=0.0,
+        value=float(current_ttl) / 60,
+        step=5.0,
+        help="Por quanto tempo um resultado já calculado (por qualquer usuário) pode ser reutilizado. 0 desativa o cache."
+    )
+
     if st.button(btn_text):
         connection_id = st.session_state.connection_id
         
@@ -157,7 +198,8 @@ def edit_metric_dialog(dashboard_name: str, metric_name: str, metric_data: dict,
             delete_metric_from_dashboard(connection_id, dashboard_name, metric_name)
             
         # Salva a nova/editada métrica
-        save_metric_to_dashboard(connection_id, dashboard_name, new_metric_name, new_question, new_sql_query)
+        save_metric_to_dashboard(connection_id, dashboard_name, new_metric_name, new_question, new_sql_query,
+                                 cache_ttl=int(cache_minutes * 60))
         
         # Limpa o cache para forçar o recálculo
         cache_key = f"{connection_id}_{dashboard_name}_{new_metric_name}"
@@ -169,7 +211,88 @@ def edit_metric_dialog(dashboard_name: str, metric_name: str, metric_data: dict,
         st.rerun()            
             
 # --- Função de Renderização de Resultados ---
-def render_metric_result(result_df: pd.DataFrame):
+def wait_for_database(future: Future, handle: StatementHandle, status) -> Any:
+    """
+    Aguarda a execução no banco (numa thread do pool de queries) sem prender o script no driver.
+    Uma interação do usuário, como o botão "Cancelar", interrompe o script na próxima
+    atualização do status; nesse caso, a query é cancelada no servidor.
+    """
+    started_at = time.perf_counter()
+    while True:
+        try:
+            return future.result(timeout=0.25)
+        except FuturesTimeoutError:
+            pass
+        try:
+            status.caption(f"⏳ Consultando o banco de dados... {time.perf_counter() - started_at:.0f}s")
+        except BaseException:
+            handle.cancel()
+            discard_result(future)  # Se a abertura terminar mesmo assim, libera o cursor
+            raise
+
+def collect_stream(stream) -> pd.DataFrame:
+    with stream:
+        return stream.collect()
+
+def render_cost_verdict(verdict: Optional[dict], show_plan: bool = True):
+    """Exibe o aviso do guardrail de custo, o LIMIT automático e o plano estimado pelo banco."""
+    if not verdict:
+        return
+    if verdict.get("action") in ("warn", "reject"):
+        st.warning("⚠️ Consulta potencialmente cara: " + "; ".join(verdict.get("reasons", [])))
+    if not show_plan:
+        return
+    if verdict.get("limit_injected"):
+        st.caption(f"🔒 Limite de {verdict['limit_injected']:,} linhas aplicado automaticamente à consulta.")
+    if verdict.get("plan"):
+        with st.expander("📋 Plano de execução estimado"):
+            st.code(verdict["plan"])
+
+def _set_page(state_key: str, index: int):
+    st.session_state[state_key] = index
+
+def render_page_controls(key: str, index: int, has_more: bool, first_row: int, last_row: int, total: str):
+    """Botões de página anterior/próxima e a faixa de linhas exibida."""
+    state_key = f"page_{key}"
+    col_prev, col_info, col_next = st.columns([0.08, 0.84, 0.08])
+    with col_prev:
+        st.button("◀", key=f"prev_{key}", disabled=index == 0, on_click=_set_page, args=(state_key, index - 1))
+    with col_info:
+        st.caption(f"Página {index + 1} · linhas {first_row}–{last_row} de {total}")
+    with col_next:
+        st.button("▶", key=f"next_{key}", disabled=not has_more, on_click=_set_page, args=(state_key, index + 1))
+
+def remember_paginator(pages_id: str, paginator: ResultPaginator):
+    """
+    Guarda o paginador de uma resposta do chat. Só os RESULT_PAGINATORS_WARM mais recentes
+    mantêm o cache de páginas; os anteriores ficam apenas com a página exibida, e além de
+    RESULT_PAGINATORS_MAX o resultado da mensagem mais antiga expira.
+    """
+    result_pages = st.session_state.result_pages
+    result_pages[pages_id] = paginator
+    while len(result_pages) > get_int_config("RESULT_PAGINATORS_MAX", 50):
+        result_pages.pop(next(iter(result_pages)))
+    warm = get_int_config("RESULT_PAGINATORS_WARM", 3)
+    for old_paginator in list(result_pages.values())[:-warm or None]:
+        old_paginator.release_pages()
+
+def render_paginated_result(paginator: ResultPaginator, key: str):
+    """Exibe a página atual de um resultado do chat, buscada no banco sob demanda."""
+    index = st.session_state.get(f"page_{key}", 0)
+    try:
+        page = paginator.page(index)
+    except Exception as e:
+        st.warning(f"Não foi possível carregar a página {index + 1}: {e}")
+        return
+    st.dataframe(page.rows, use_container_width=True)
+    if index == 0 and page.rows.empty:
+        return
+    row_count = paginator.row_count()
+    first_row = index * paginator.page_size + 1
+    render_page_controls(key, index, page.has_more, first_row, first_row + len(page.rows) - 1,
+                         row_count.label() if row_count else "(contando...)")
+
+def render_metric_result(result_df: pd.DataFrame, key: Optional[str] = None):
     if result_df.empty:
         st.warning("A consulta não retornou resultados.")
     else:
@@ -182,7 +305,16 @@ def render_metric_result(result_df: pd.DataFrame):
             else:
                 st.metric(label="Resultado", value=str(value))
         else:
-            st.dataframe(result_df, height=210, use_container_width=True)
+            # Apenas a página atual vai para o navegador; sem `key` (ex: primeiro bloco), a primeira
+            page_size = get_int_config("RESULT_PAGE_SIZE", 100)
+            # O resultado pode ter encolhido desde a última navegação (ex: "Recalcular")
+            index = min(st.session_state.get(f"page_{key}", 0), (len(result_df) - 1) // page_size) if key else 0
+            page_df = result_df.iloc[index * page_size:(index + 1) * page_size]
+            st.dataframe(page_df, height=210, use_container_width=True)
+            if key and len(result_df) > page_size:
+                first_row = index * page_size + 1
+                render_page_controls(key, index, (index + 1) * page_size < len(result_df), first_row,
+                                     first_row + len(page_df) - 1, f"{len(result_df):,} linha(s)".replace(",", "."))
 
 # --- Formulário de Conexão na Sidebar ---
 with st.sidebar:
@@ -254,6 +386,15 @@ with st.sidebar:
             else:
                 st.markdown("Nenhuma tabela encontrada.")
 
+        if st.button("🔄 Atualizar Schema", help="Reflete novamente as tabelas e colunas do banco"):
+            refresh_schema_catalog(st.session_state.connection_id)
+            invalidate_generation_cache(st.session_state.connection_id)
+            catalog = get_schema_catalog(st.session_state.db_uri, connection_id=st.session_state.connection_id)
+            st.session_state.table_names = catalog.table_names
+            st.toast("Schema atualizado!", icon="🔄")
+            time.sleep(1)
+            st.rerun()
+
         st.header("🪄 Contexto de Negócio")
         if st.button("Editar Contexto / Dicionário de Dados"):
             context_editor_dialog()
@@ -342,13 +483,6 @@ with st.sidebar:
                             ).render_as_string(hide_password=False)
                         
                         st.session_state.db_uri = uri
-                        db = SQLDatabase.from_uri(uri)
-                        st.session_state.table_names = db.get_usable_table_names()
-                        st.session_state.connection_configured = True
-                        st.session_state.messages = [
-                            {"role": "assistant", "content": f"Conectado com sucesso! As tabelas `{', '.join(st.session_state.table_names)}` foram encontradas. Faça sua primeira pergunta."}
-                        ]
-                        
                         connection_id = get_connection_id(
                             db_type=st.session_state.db_type,
                             db_host=st.session_state.get('db_host'),
@@ -356,6 +490,14 @@ with st.sidebar:
                             db_name=st.session_state.get('db_name'),
                             db_path=st.session_state.get('db_path')
                         )
+                        # A reflexão feita aqui fica no catálogo em cache e é reaproveitada pela geração de SQL
+                        catalog = get_schema_catalog(uri, connection_id=connection_id)
+                        st.session_state.table_names = catalog.table_names
+                        st.session_state.connection_configured = True
+                        st.session_state.messages = [
+                            {"role": "assistant", "content": f"Conectado com sucesso! As tabelas `{', '.join(st.session_state.table_names)}` foram encontradas. Faça sua primeira pergunta."}
+                        ]
+                        
                         st.session_state.connection_id = connection_id
                         st.session_state.custom_metadata = load_custom_metadata(connection_id)
                         
@@ -364,6 +506,33 @@ with st.sidebar:
                     st.error(f"Falha na conexão: {e}")
                     reset_connection()
 
+# --- Painel de Latência (dados dos traces deste processo) ---
+if get_bool_config("TRACING_PANEL", True):
+    with st.sidebar.expander("⏱️ Latência por etapa"):
+        stage_summary = get_stage_summary()
+        if not stage_summary:
+            st.caption("Nenhuma interação medida ainda.")
+        else:
+            st.dataframe(pd.DataFrame(stage_summary).round(1), hide_index=True, use_container_width=True)
+            # Spans medidos fora de um trace alimentam o resumo, mas não geram uma "interação"
+            recent_traces = get_recent_traces(limit=1)
+            if recent_traces:
+                last_trace = recent_traces[0]
+                st.caption(f"Última interação ({last_trace.name}): {last_trace.duration * 1000:.0f}ms")
+                st.dataframe(
+                    pd.DataFrame([{"etapa": s.name, "ms": round(s.duration * 1000, 1)} for s in last_trace.spans]),
+                    hide_index=True, use_container_width=True
+                )
+        token_totals = get_counter_totals()
+        if token_totals.get("prompt_tokens"):
+            cached_share = token_totals.get("cached_tokens", 0) / token_totals["prompt_tokens"]
+            st.caption(f"🧠 Tokens do prompt em cache no provedor: {cached_share:.0%} "
+                       f"({token_totals.get('cached_tokens', 0):.0f} de {token_totals['prompt_tokens']:.0f})")
+        llm_stats = get_llm_client_stats()
+        if llm_stats["requests"]:
+            st.caption(f"🔌 Conexões com a OpenAI: {llm_stats['connection_reuse_rate']:.0%} reaproveitadas "
+                       f"({llm_stats['new_connections']} abertas em {llm_stats['requests']} chamadas)")
+
 # --- Lógica Principal com Tabs ---
 if not st.session_state.connection_configured:
     st.info("👈 Por favor, configure e conecte-se a um banco de dados na barra lateral para começar.")
@@ -394,7 +563,23 @@ with tab_chat:
                                 sql_query = st.session_state.messages[i+1]["query_info"]["query"]
                                 save_question_dialog(message["content"], sql_query)                                
                 else:  # Mensagens do assistente
-                    if "dataframe" in message and isinstance(message.get("dataframe"), list):
+                    if "pages_id" in message:
+                        paginator = st.session_state.result_pages.get(message["pages_id"])
+                        if paginator is not None:
+                            render_paginated_result(paginator, message["pages_id"])
+                        else:
+                            st.caption("⌛ Resultado expirado. Faça a pergunta novamente para consultá-lo.")
+                    elif "result_id" in message:
+                        # Carregado sob demanda (pode estar em memória ou em disco)
+                        try:
+                            df_to_show = st.session_state.result_store.get(message["result_id"])
+                        except Exception:
+                            df_to_show = None # Ex: o arquivo de spill foi removido do disco
+                        if df_to_show is not None:
+                            st.dataframe(df_to_show)
+                        else:
+                            st.caption("⌛ Resultado expirado. Faça a pergunta novamente para consultá-lo.")
+                    elif "dataframe" in message and isinstance(message.get("dataframe"), list):
                         try:
                             df_to_show = pd.DataFrame(message["dataframe"])
                             st.dataframe(df_to_show)
@@ -406,6 +591,7 @@ with tab_chat:
                         with st.expander("🔍 Ver Query SQL Executada"):
                             st.code(message["query_info"]["query"], language="sql")
                             st.caption(message["query_info"]["explanation"])
+                    render_cost_verdict(message.get("cost_verdict"))
 
     # 3. O chat_input fica FORA do container, renderizado no fluxo principal da página.
     if prompt := st.chat_input("Faça sua pergunta sobre o banco de dados..."):
@@ -413,31 +599,95 @@ with tab_chat:
         st.session_state.messages.append({"role": "user", "content": prompt})
 
         # Processa a pergunta e gera a resposta do assistente
-        with st.spinner("🤔 Pensando..."):
+        with st.spinner("🤔 Pensando..."), trace("chat", connection_id=st.session_state.connection_id) as chat_trace:
             assistant_response = {}
             try:
-                # ETAPA 1: Gerar a query SQL
+                # O pipeline de geração (LangChain + OpenAI) só é importado na primeira pergunta
+                from pipeline.agent_pipeline import start_sql_generation
+
+                # ETAPA 1: Gerar a query SQL (a resposta do LLM é consumida em streaming)
                 history = st.session_state.messages[:-1]
-                sql_result = generate_sql_query(
+                generation = start_sql_generation(
                     db_uri=st.session_state.db_uri,
                     openai_api_key=st.session_state.openai_api_key,
                     model_name=st.session_state.get("selected_model", "gpt-4.1-nano-2025-04-14"), # Adicionado fallback
                     question=prompt,
                     custom_metadata=st.session_state.custom_metadata,
-                    chat_history=history
+                    chat_history=history,
+                    connection_id=st.session_state.connection_id
                 )
-                assistant_response["query_info"] = {"query": sql_result.query, "explanation": sql_result.explanation}
-
-                # ETAPA 2: Executar a query
-                result_df = execute_sql_query(st.session_state.db_uri, sql_result.query)
+                try:
+                    # A query fica pronta antes da explicação: a execução começa enquanto o LLM termina
+                    query = generation.wait_for_query()
+                    assistant_response["query_info"] = {"query": query, "explanation": ""}
+
+                    # ETAPA 2: Executar a query. No modo paginado, apenas a primeira página é lida
+                    # agora; as demais são buscadas no banco conforme a navegação.
+                    # A execução roda numa thread do pool de queries e pode ser cancelada pela UI.
+                    handle = StatementHandle()
+                    with chat_container:
+                        status = st.empty()
+                        st.button("⏹️ Cancelar consulta", key="cancel_query",
+                                  help="Interrompe a execução da consulta no banco de dados")
+                    paginator = None
+                    if get_bool_config("RESULT_PAGINATION", True):
+                        paginator = wait_for_database(
+                            submit_query(open_result_paginator, st.session_state.db_uri, query, handle=handle),
+                            handle, status)
+                    if paginator is None:
+                        # Modo streaming (com limite de linhas/bytes)
+                        stream = wait_for_database(
+                            submit_query(stream_sql_query, st.session_state.db_uri, query, handle=handle),
+                            handle, status)
+                        try:
+                            # Exibe o primeiro bloco enquanto o restante do resultado é lido
+                            with chat_container, span("render", rows=len(stream.first_page)):
+                                with st.chat_message("assistant"):
+                                    st.dataframe(stream.first_page)
+                                    st.caption("Carregando o restante do resultado...")
+                        except BaseException:
+                            stream.close()
+                            raise
+                        # A thread fecha o stream ao terminar, inclusive se a leitura for cancelada
+                        result_df = wait_for_database(submit_query(collect_stream, stream), handle, status)
+                    status.empty()
+
+                    assistant_response["query_info"]["explanation"] = generation.result().explanation
+                except BaseException as e:
+                    # Erro ou execução interrompida (ex: nova interação do usuário): cancela a chamada ao LLM
+                    generation.cancel()
+                    if not isinstance(e, Exception):
+                        # Interrupção do script (ex: botão "Cancelar"): registra a resposta antes do rerun
+                        st.session_state.messages.append(
+                            {"role": "assistant", "content": "⏹️ Consulta cancelada.", **assistant_response})
+                    raise
                 
-                # Salva o dataframe no formato correto para re-renderização
-                assistant_response["dataframe"] = result_df.to_dict("records")
-                assistant_response["content"] = f"Consulta executada com sucesso! {len(result_df)} linha(s) encontrada(s)."
+                if paginator is not None:
+                    # A mensagem referencia o paginador; o total aparece abaixo da tabela
+                    pages_id = f"pages_{len(st.session_state.messages)}"
+                    remember_paginator(pages_id, paginator)
+                    assistant_response["pages_id"] = pages_id
+                    assistant_response["cost_verdict"] = paginator.cost_verdict.to_dict()
+                    assistant_response["content"] = "Consulta executada com sucesso!"
+                    chat_trace.set(rows=len(paginator.page(0).rows), pagination=paginator.mode)
+                else:
+                    # Guarda o resultado em formato colunar; a mensagem referencia apenas o id
+                    assistant_response["result_id"] = st.session_state.result_store.put(result_df)
+                    assistant_response["cost_verdict"] = result_df.attrs.get("cost_verdict")
+                    assistant_response["content"] = f"Consulta executada com sucesso! {len(result_df)} linha(s) encontrada(s)."
+                    chat_trace.set(rows=len(result_df), truncated=result_df.attrs.get("truncated"))
+                    if result_df.attrs.get("truncated"):
+                        assistant_response["content"] += f" O resultado foi limitado às primeiras {len(result_df)} linhas."
 
             except Exception as e:
                 error_message = f"Ocorreu um problema: {e}"
                 assistant_response["content"] = error_message
+                if isinstance(e, QueryCostError):
+                    assistant_response["cost_verdict"] = e.verdict.to_dict()
+                elif isinstance(e, SQLValidationError):
+                    # A query rejeitada pela validação do schema não chegou ao banco, mas fica visível
+                    assistant_response["query_info"] = {"query": e.query, "explanation": "Query não executada."}
+                chat_trace.error = str(e)[:300]
         
         # Adiciona a resposta completa do assistente ao estado
         st.session_state.messages.append({"role": "assistant", **assistant_response})
@@ -496,6 +746,8 @@ with tab_dashboard:
                     cache_key = f"{connection_id}_{selected_dashboard_name}_{metric}"
                     if cache_key in st.session_state.dashboard_results:
                         del st.session_state.dashboard_results[cache_key]
+                    # Ignora também o cache compartilhado: a query vai de fato ao banco
+                    st.session_state.dashboard_refresh.add(cache_key)
                 st.rerun()
             
     with col3:
@@ -517,6 +769,43 @@ with tab_dashboard:
             st.session_state.confirm_delete = False
             st.rerun()
 
+    # --- Agendamento (pré-cálculo em segundo plano pelo pipeline/scheduler.py) ---
+    if selected_dashboard_name:
+        schedule = load_dashboard_schedule(connection_id, selected_dashboard_name)
+        with st.expander("⏰ Atualização automática"):
+            st.caption("Com o agendador rodando (`python -m pipeline.scheduler`), as métricas deste dashboard "
+                       "são recalculadas periodicamente e aparecem prontas para todos os usuários.")
+            interval_minutes = st.number_input(
+                "Intervalo (minutos, 0 desativa)",
+                min_value=0,
+                value=int(schedule["interval_seconds"] // 60) if schedule else 0,
+                step=15,
+                key=f"schedule_interval_{selected_dashboard_name}"
+            )
+            if st.button("Salvar agendamento", key=f"schedule_save_{selected_dashboard_name}"):
+                if interval_minutes:
+                    interval_seconds = int(interval_minutes * 60)
+                    next_run_at = time.time() + initial_offset(connection_id, selected_dashboard_name, interval_seconds)
+                    save_dashboard_schedule(connection_id, selected_dashboard_name, interval_seconds,
+                                            st.session_state.db_uri, next_run_at=next_run_at)
+                    st.toast(f"Dashboard '{selected_dashboard_name}' agendado a cada {interval_minutes} min.", icon="⏰")
+                else:
+                    delete_dashboard_schedule(connection_id, selected_dashboard_name)
+                    st.toast("Agendamento removido.")
+                st.rerun()
+            if schedule:
+                last_run, next_run = (
+                    time.strftime('%d/%m %H:%M:%S', time.localtime(ts)) if ts else "—"
+                    for ts in (schedule["last_run_at"], schedule["next_run_at"])
+                )
+                st.caption(f"Última execução: {last_run} · Próxima: {next_run} · "
+                           "os resultados valem até a próxima execução, mesmo com TTL menor na métrica")
+                runs = load_schedule_runs(connection_id, selected_dashboard_name)
+                if runs:
+                    history_df = pd.DataFrame(runs)
+                    history_df["started_at"] = pd.to_datetime(history_df["started_at"], unit="s")
+                    st.dataframe(history_df, height=180, use_container_width=True, hide_index=True)
+
     #st.divider()
     st.markdown(
         """
@@ -533,12 +822,105 @@ with tab_dashboard:
     # --- Renderização dos Cards do Dashboard Selecionado ---
     if selected_dashboard_name:
         st.subheader(f"Métricas de: {selected_dashboard_name}")
+        timing_placeholder = st.empty()
         
         # Obtém as métricas do dashboard selecionado
         selected_dashboard_metrics = load_dashboard_metrics(connection_id, selected_dashboard_name)
         
         if not selected_dashboard_metrics:
             st.info("Este dashboard está vazio. Salve algumas métricas nele a partir da aba de Chat!")
+
+        # Valores da sessão capturados aqui: as threads de execução não têm acesso ao st.session_state
+        db_uri = st.session_state.db_uri
+        openai_api_key = st.session_state.openai_api_key
+        model_name = st.session_state.get("selected_model", "gpt-4.1-nano-2025-04-14")
+
+        # SQL efetivamente executado por métrica (inclusive o gerado nas métricas antigas), usado no cache compartilhado
+        executed_queries = {}
+
+        # Métricas antigas (salvas só com a pergunta): o SQL de todas é gerado em lote, com poucas
+        # chamadas ao LLM, e gravado na métrica. As que ficarem sem resposta usam a geração individual.
+        legacy_metrics = {name: data for name, data in selected_dashboard_metrics.items() if not data.get("sql_query")}
+        if legacy_metrics and openai_api_key:
+            with st.spinner(f"Gerando o SQL de {len(legacy_metrics)} métrica(s) salva(s) sem query..."):
+                try:
+                    from pipeline.agent_pipeline import generate_sql_queries_batch
+                    generated = generate_sql_queries_batch(
+                        db_uri=db_uri,
+                        openai_api_key=openai_api_key,
+                        model_name=model_name,
+                        questions=[data.get("question", "") for data in legacy_metrics.values()],
+                        custom_metadata=st.session_state.custom_metadata,
+                        connection_id=connection_id
+                    )
+                except Exception as e:
+                    generated = {}
+                    st.warning(f"Não foi possível gerar o SQL das métricas em lote: {e}")
+            for metric_name, data in legacy_metrics.items():
+                sql_result = generated.get(data.get("question"))
+                if sql_result and is_query_safe(sql_result.query):
+                    save_metric_to_dashboard(connection_id, selected_dashboard_name, metric_name, data["question"],
+                                             sql_result.query, cache_ttl=data.get("cache_ttl"))
+                    data["sql_query"] = sql_result.query
+
+        def build_metric_job(metric_name: str, question: str, saved_query: str, ttl: float, bypass_cache: bool):
+            def job() -> pd.DataFrame:
+                if saved_query:
+                    # Prioridade 1: Executa a query salva diretamente (o primeiro bloco aparece antes)
+                    executed_queries[metric_name] = saved_query
+                    return stream_sql_query(db_uri, saved_query)
+                # Fallback (compatibilidade): Gera a query a partir da pergunta
+                from pipeline.agent_pipeline import generate_sql_query
+                sql_result = generate_sql_query(
+                    db_uri=db_uri,
+                    openai_api_key=openai_api_key,
+                    model_name=model_name,
+                    question=question,
+                    connection_id=connection_id
+                )
+                executed_queries[metric_name] = sql_result.query
+                cached = None if bypass_cache else get_cached_result(connection_id, sql_result.query, ttl)
+                if cached is not None:
+                    return cached.result_df
+                return stream_sql_query(db_uri, sql_result.query)
+            return job
+
+        def show_metric_result(placeholder, cache_key: str):
+            result_df = st.session_state.dashboard_results[cache_key]
+            if "erro" in result_df.columns:
+                placeholder.error(f"Erro ao calcular: {result_df['erro'][0]}")
+            else:
+                with placeholder.container(), span("render", rows=len(result_df)):
+                    render_metric_result(result_df, key=cache_key)
+                    if result_df.attrs.get("truncated"):
+                        st.caption(f"Resultado limitado às primeiras {len(result_df)} linhas.")
+                    render_cost_verdict(result_df.attrs.get("cost_verdict"), show_plan=False)
+                    details = []
+                    computed_at = result_df.attrs.get("computed_at")
+                    if computed_at:
+                        details.append(f"📅 Dados de {time.strftime('%d/%m %H:%M:%S', time.localtime(computed_at))}")
+                    if result_df.attrs.get("from_cache"):
+                        details.append("💾 cache compartilhado")
+                    else:
+                        elapsed = st.session_state.dashboard_timings.get(cache_key)
+                        if elapsed is not None:
+                            details.append(f"⏱️ {elapsed:.2f}s")
+                    if details:
+                        st.caption(" · ".join(details))
+
+        def is_expired(result_df: pd.DataFrame, ttl: float) -> bool:
+            computed_at = result_df.attrs.get("computed_at")
+            # TTL 0 desativa apenas o cache compartilhado; a sessão mantém o último resultado
+            return bool(ttl) and computed_at is not None and time.time() - computed_at > ttl
+
+        # Métricas sem resultado em cache: são executadas juntas depois que todos os cards existirem
+        pending_jobs, pending_placeholders = {}, {}
+
+        # Num dashboard agendado, o resultado pré-calculado vale até a próxima execução do agendador,
+        # mesmo que o TTL da métrica seja menor (senão cada visitante executaria as queries de novo)
+        dashboard_schedule = load_dashboard_schedule(connection_id, selected_dashboard_name)
+        min_ttl = scheduled_result_ttl(dashboard_schedule["interval_seconds"]) \
+            if dashboard_schedule and dashboard_schedule["enabled"] else 0
         
         # Layout em colunas para os cards
         cols = st.columns(3)
@@ -547,6 +929,11 @@ with tab_dashboard:
             question = data.get("question", "Pergunta não encontrada.")
             saved_query = data.get("sql_query")            
             cache_key = f"{connection_id}_{selected_dashboard_name}_{metric_name}"
+            ttl = data.get("cache_ttl")
+            ttl = default_ttl() if ttl is None else ttl
+            if ttl:  # TTL 0 (cache compartilhado desativado) é respeitado
+                ttl = max(ttl, min_ttl)
+            bypass_cache = cache_key in st.session_state.dashboard_refresh
             
             with cols[col_idx % len(cols)]:
                 with st.container(border=True):
@@ -564,42 +951,31 @@ with tab_dashboard:
                     st.caption(f"Pergunta: *{question}*")
                     result_placeholder = st.empty()
                     
-                    # Lógica de Execução e Exibição
-                    if cache_key not in st.session_state.dashboard_results:
-                        with result_placeholder, st.spinner("Executando..."):
-                            try:
-                                if saved_query:
-                                    # Prioridade 1: Executa a query salva diretamente
-                                    result_df = execute_sql_query(st.session_state.db_uri, saved_query)                                                                
-                                else:
-                                    # Fallback (compatibilidade): Gera a query a partir da pergunta                                
-                                    sql_result = generate_sql_query(
-                                        db_uri=st.session_state.db_uri,
-                                        openai_api_key=st.session_state.openai_api_key,
-                                        model_name=st.session_state.get("selected_model", "gpt-4.1-nano-2025-04-14"),
-                                        question=question
-                                    )
-                                    result_df = execute_sql_query(st.session_state.db_uri, sql_result.query)
-                                    
-                                st.session_state.dashboard_results[cache_key] = result_df
-                                st.rerun()
-                            except Exception as e:
-                                st.session_state.dashboard_results[cache_key] = pd.DataFrame([{"erro": str(e)}])
-                                st.rerun()
-                    
-                    if cache_key in st.session_state.dashboard_results:
-                        result_df = st.session_state.dashboard_results[cache_key]
-                        if "erro" in result_df.columns:
-                            result_placeholder.error(f"Erro ao calcular: {result_df['erro'][0]}")
-                        else:
-                            with result_placeholder:
-                                render_metric_result(result_df)
+                    # Lógica de Execução e Exibição: resultado da sessão -> cache compartilhado -> banco
+                    session_result = st.session_state.dashboard_results.get(cache_key)
+                    if session_result is not None and is_expired(session_result, ttl):
+                        session_result = None
+                    if session_result is None and saved_query and not bypass_cache:
+                        cached = get_cached_result(connection_id, saved_query, ttl)
+                        if cached is not None:
+                            session_result = st.session_state.dashboard_results[cache_key] = cached.result_df
+
+                    if session_result is not None:
+                        with trace("dashboard", dashboard=selected_dashboard_name, metric=metric_name, cached=True):
+                            show_metric_result(result_placeholder, cache_key)
+                    else:
+                        result_placeholder.info("⏳ Executando...")
+                        if bypass_cache:
+                            record_bypass()
+                        pending_jobs[metric_name] = build_metric_job(metric_name, question, saved_query, ttl, bypass_cache)
+                        pending_placeholders[metric_name] = (result_placeholder, cache_key)
                     
                     st.markdown("---")
                     col_b1, col_b2 = st.columns([0.7, 0.3])
                     if col_b1.button("Recalcular", key=f"run_{metric_name}"):
                         if cache_key in st.session_state.dashboard_results:
                             del st.session_state.dashboard_results[cache_key]
+                        st.session_state.dashboard_refresh.add(cache_key)
                         st.rerun()
                     if col_b2.button("🗑️", key=f"del_{metric_name}", help="Deletar métrica"):
                         delete_metric_from_dashboard(connection_id, selected_dashboard_name, metric_name)
@@ -608,4 +984,39 @@ with tab_dashboard:
                         st.toast(f"Métrica '{metric_name}' deletada.")
                         time.sleep(1)
                         st.rerun()
-            col_idx += 1
\ No newline at end of file
+            col_idx += 1
+
+        # Executa as métricas pendentes em paralelo, preenchendo cada card conforme o resultado chega
+        if pending_jobs:
+            with trace("dashboard", dashboard=selected_dashboard_name, metrics=len(pending_jobs)):
+                started_at = time.perf_counter()
+                total_elapsed = 0.0
+                for metric_run in run_metrics_concurrently(connection_id, pending_jobs):
+                    result_placeholder, cache_key = pending_placeholders[metric_run.metric_name]
+                    if metric_run.partial:
+                        # Primeiro bloco: exibe já, o card é atualizado quando o resultado completo chegar
+                        with result_placeholder.container():
+                            render_metric_result(metric_run.result_df)
+                            st.caption("Carregando o restante do resultado...")
+                        continue
+                    if metric_run.error is not None:
+                        st.session_state.dashboard_results[cache_key] = pd.DataFrame([{"erro": metric_run.error}])
+                    else:
+                        result_df = metric_run.result_df
+                        executed_query = executed_queries.get(metric_run.metric_name)
+                        if executed_query and not result_df.attrs.get("from_cache"):
+                            # Disponibiliza o resultado para as demais sessões
+                            store_result(connection_id, executed_query, result_df)
+                        st.session_state.dashboard_results[cache_key] = result_df
+                    st.session_state.dashboard_timings[cache_key] = metric_run.elapsed
+                    st.session_state.dashboard_refresh.discard(cache_key)
+                    total_elapsed += metric_run.elapsed
+                    show_metric_result(result_placeholder, cache_key)
+                wall_time = time.perf_counter() - started_at
+                cache_stats = get_result_cache_stats()
+                timing_placeholder.caption(
+                    f"⏱️ {len(pending_jobs)} métrica(s) executada(s) em {wall_time:.2f}s "
+                    f"(soma dos tempos individuais: {total_elapsed:.2f}s) · "
+                    f"💾 cache compartilhado: {cache_stats['hits'] + cache_stats['disk_hits']} acerto(s), "
+                    f"{cache_stats['misses'] + cache_stats['expired']} falha(s)"
+                )
@@ -0,0 +1,217 @@
+# benchmarks/bench_pipeline.py
+"""
+Benchmark de ponta a ponta do ciclo pergunta → SQL → guardrail → resultado.
+
+Usa o FakeSQLChatModel (sem rede, latência configurável) sobre o corpus de perguntas
+em benchmarks/questions.json e o banco SQLite de exemplo. Mede p50/p95/p99 por etapa,
+vazão com N chamadores concorrentes, tokens do prompt e pico de memória.
+
+Uso:
+    python -m benchmarks.bench_pipeline
+    python -m benchmarks.bench_pipeline --db data/big.db --concurrency 1 4 16 --latency 0.3
+    python -m benchmarks.bench_pipeline --save-baseline            # grava benchmarks/baselines/pipeline.json
+    python -m benchmarks.bench_pipeline --compare                  # compara com a baseline (código 1 se regredir)
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+import numpy as np
+
+from benchmarks.fake_llm import FakeSQLChatModel
+from pipeline.agent_pipeline import generate_sql_query
+from pipeline.db_executor import execute_sql_query
+from utils.security import is_query_safe
+
+STAGES = ("generate", "guardrail", "execute", "total")
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), "questions.json")
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baselines", "pipeline.json")
+
+def load_corpus(path: str = CORPUS_PATH) -> List[Dict[str, str]]:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def run_request(db_uri: str, llm: FakeSQLChatModel, question: str, use_cache: bool) -> Dict[str, float]:
+    """Executa um ciclo completo e retorna o tempo (s) de cada etapa."""
+    started_at = time.perf_counter()
+    result = generate_sql_query(
+        db_uri=db_uri, openai_api_key="offline", model_name="fake-sql",
+        question=question, use_cache=use_cache, llm=llm,
+    )
+    generated_at = time.perf_counter()
+    if not is_query_safe(result.query):
+        raise RuntimeError(f"Query bloqueada pelo guardrail: {result.query}")
+    checked_at = time.perf_counter()
+    execute_sql_query(db_uri, result.query)
+    finished_at = time.perf_counter()
+    return {
+        "generate": generated_at - started_at,
+        "guardrail": checked_at - generated_at,
+        "execute": finished_at - checked_at,
+        "total": finished_at - started_at,
+    }
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    return {"p50": float(p50), "p95": float(p95), "p99": float(p99),
+            "mean": float(np.mean(samples)), "max": float(np.max(samples))}
+
+def run_level(db_uri: str, llm: FakeSQLChatModel, questions: List[str], concurrency: int,
+              use_cache: bool) -> Dict[str, Any]:
+    """Executa todas as perguntas com `concurrency` chamadores simultâneos."""
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        timings = list(pool.map(lambda q: run_request(db_uri, llm, q, use_cache), questions))
+    wall_time = time.perf_counter() - started_at
+    return {
+        "requests": len(questions),
+        "wall_time": wall_time,
+        "throughput": len(questions) / wall_time,
+        "stages": {stage: summarize([t[stage] for t in timings]) for stage in STAGES},
+    }
+
+def measure_memory(db_uri: str, llm: FakeSQLChatModel, questions: List[str], use_cache: bool) -> Dict[str, float]:
+    """Pico de memória alocada pelo Python (tracemalloc) num ciclo sequencial do corpus."""
+    tracemalloc.start()
+    try:
+        for question in questions:
+            run_request(db_uri, llm, question, use_cache)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    memory = {"python_peak_mb": peak / 1024 / 1024}
+    try:
+        import resource
+        # ru_maxrss é em KB no Linux e em bytes no macOS
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        memory["process_max_rss_mb"] = max_rss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    except ImportError:
+        pass
+    return memory
+
+def run_benchmark(args) -> Dict[str, Any]:
+    corpus = load_corpus(args.corpus)
+    responses = {item["question"]: item["sql"] for item in corpus}
+    llm = FakeSQLChatModel(responses=responses, latency=args.latency, jitter=args.jitter, seed=args.seed)
+    db_uri = f"sqlite:///{args.db}"
+    questions = [item["question"] for item in corpus] * args.iterations
+
+    # Aquecimento: reflexão do schema, índice BM25, pool de conexões e imports preguiçosos
+    cold_start = run_request(db_uri, llm, questions[0], args.use_cache)["total"]
+    for question in questions[1:len(corpus)]:
+        run_request(db_uri, llm, question, args.use_cache)
+
+    results = {
+        "meta": {
+            "db": args.db, "corpus_size": len(corpus), "iterations": args.iterations,
+            "latency": args.latency, "jitter": args.jitter, "use_cache": args.use_cache,
+            "python": platform.python_version(), "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "cold_start": cold_start,
+        "levels": {},
+    }
+    for concurrency in args.concurrency:
+        results["levels"][str(concurrency)] = run_level(db_uri, llm, questions, concurrency, args.use_cache)
+
+    prompt_tokens = llm.prompt_tokens
+    results["prompt_tokens"] = summarize(prompt_tokens) if prompt_tokens else {}
+    results["memory"] = measure_memory(db_uri, llm, questions[:len(corpus)], args.use_cache)
+    return results
+
+def compare_with_baseline(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float,
+                          min_delta: float) -> List[str]:
+    """
+    Lista as regressões: percentis que pioraram mais que `tolerance` (relativo) e mais que
+    `min_delta` segundos (absoluto, para ignorar ruído), e vazão que caiu mais que `tolerance`.
+    """
+    regressions = []
+    for level, current in results["levels"].items():
+        previous = baseline.get("levels", {}).get(level)
+        if not previous:
+            continue
+        for stage in STAGES:
+            for percentile in ("p50", "p95", "p99"):
+                now = current["stages"][stage][percentile]
+                before = previous["stages"][stage][percentile]
+                if now > before * (1 + tolerance) and now - before > min_delta:
+                    regressions.append(f"[{level} chamador(es)] {stage} {percentile}: "
+                                       f"{before * 1000:.1f}ms → {now * 1000:.1f}ms")
+        if current["throughput"] < previous["throughput"] * (1 - tolerance):
+            regressions.append(f"[{level} chamador(es)] vazão: "
+                               f"{previous['throughput']:.1f} → {current['throughput']:.1f} req/s")
+    before_tokens = baseline.get("prompt_tokens", {}).get("mean")
+    now_tokens = results.get("prompt_tokens", {}).get("mean")
+    if before_tokens and now_tokens and now_tokens > before_tokens * (1 + tolerance):
+        regressions.append(f"tokens do prompt (média): {before_tokens:.0f} → {now_tokens:.0f}")
+    before_memory = baseline.get("memory", {}).get("python_peak_mb")
+    now_memory = results.get("memory", {}).get("python_peak_mb")
+    if before_memory and now_memory and now_memory > before_memory * (1 + tolerance):
+        regressions.append(f"pico de memória: {before_memory:.1f}MB → {now_memory:.1f}MB")
+    return regressions
+
+def print_report(results: Dict[str, Any]):
+    meta = results["meta"]
+    print(f"Banco: {meta['db']} · {meta['corpus_size']} perguntas x {meta['iterations']} · "
+          f"latência do LLM: {meta['latency'] * 1000:.0f}±{meta['jitter'] * 1000:.0f}ms")
+    print(f"Primeira requisição (fria): {results['cold_start'] * 1000:.1f}ms\n")
+    for level, data in results["levels"].items():
+        print(f"== {level} chamador(es): {data['throughput']:.1f} req/s ({data['requests']} em {data['wall_time']:.2f}s) ==")
+        print(f"{'etapa':<12}{'p50 (ms)':>12}{'p95 (ms)':>12}{'p99 (ms)':>12}")
+        for stage in STAGES:
+            stats = data["stages"][stage]
+            print(f"{stage:<12}{stats['p50'] * 1000:>12.2f}{stats['p95'] * 1000:>12.2f}{stats['p99'] * 1000:>12.2f}")
+        print()
+    tokens = results.get("prompt_tokens")
+    if tokens:
+        print(f"Tokens do prompt: p50 {tokens['p50']:.0f} · p95 {tokens['p95']:.0f} · máx {tokens['max']:.0f}")
+    memory = results["memory"]
+    print("Memória: pico Python {:.1f}MB{}".format(
+        memory["python_peak_mb"],
+        f" · RSS máximo {memory['process_max_rss_mb']:.0f}MB" if "process_max_rss_mb" in memory else ""))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do pipeline NL→SQL com um LLM falso determinístico.")
+    parser.add_argument("--db", default="data/example.db", help="Banco SQLite usado nas consultas.")
+    parser.add_argument("--corpus", default=CORPUS_PATH, help="Arquivo JSON com perguntas e o SQL de cada uma.")
+    parser.add_argument("--iterations", type=int, default=5, help="Repetições do corpus por nível de concorrência.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8], help="Números de chamadores simultâneos.")
+    parser.add_argument("--latency", type=float, default=0.05, help="Latência simulada do LLM (s).")
+    parser.add_argument("--jitter", type=float, default=0.01, help="Variação da latência simulada (s).")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--use-cache", action="store_true", help="Mantém o cache de geração ligado (mede os hits).")
+    parser.add_argument("--output", help="Grava os resultados em JSON neste caminho.")
+    parser.add_argument("--save-baseline", nargs="?", const=BASELINE_PATH, help="Grava os resultados como baseline.")
+    parser.add_argument("--compare", nargs="?", const=BASELINE_PATH, help="Compara com a baseline indicada.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Piora relativa tolerada (0.2 = 20%%).")
+    parser.add_argument("--min-delta", type=float, default=0.002, help="Piora absoluta mínima (s) para acusar regressão.")
+    args = parser.parse_args()
+
+    results = run_benchmark(args)
+    print_report(results)
+
+    for path in filter(None, (args.output, args.save_baseline)):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"\nResultados gravados em {path}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(results, baseline, args.tolerance, args.min_delta)
+        if regressions:
+            print("\n⚠️ Regressões em relação à baseline:")
+            for regression in regressions:
+                print(f"  - {regression}")
+            sys.exit(1)
+        print("\n✅ Nenhuma regressão em relação à baseline.")
+
+if __name__ == "__main__":
+    main()
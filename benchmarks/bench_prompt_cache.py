@@ -0,0 +1,79 @@
+# benchmarks/bench_prompt_cache.py
+"""
+Compara os layouts do prompt (PROMPT_LAYOUT=legacy x prefix) contra a API falsa de
+benchmarks/mock_openai.py, que simula o cache de prompt do provedor. Para cada layout,
+mede a fração dos tokens do prompt servida pelo cache e a latência da geração, passando
+pelo ChatOpenAI de verdade (mesmo cliente HTTP, parsing e instrumentação do app).
+
+Uso:
+    python -m benchmarks.bench_prompt_cache
+    python -m benchmarks.bench_prompt_cache --iterations 3 --min-cached-tokens 1024
+"""
+import argparse
+import os
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+
+from benchmarks.bench_pipeline import CORPUS_PATH, load_corpus
+from benchmarks.mock_openai import MockOpenAIServer, start_mock_server
+from pipeline.agent_pipeline import generate_sql_query
+
+METADATA_PATH = os.path.join(os.path.dirname(__file__), "data_dictionary.md")
+LAYOUTS = ("legacy", "prefix")
+
+def run_layout(server: MockOpenAIServer, layout: str, db_uri: str, questions: List[str],
+               custom_metadata: str) -> Dict[str, Any]:
+    os.environ["PROMPT_LAYOUT"] = layout
+    server.reset()
+    latencies = []
+    for question in questions:
+        started_at = time.perf_counter()
+        generate_sql_query(
+            db_uri=db_uri, openai_api_key="mock-key", model_name="mock-model", question=question,
+            custom_metadata=custom_metadata, use_cache=False,
+        )
+        latencies.append(time.perf_counter() - started_at)
+    prompt_tokens = sum(r["prompt_tokens"] for r in server.requests)
+    cached_tokens = sum(r["cached_tokens"] for r in server.requests)
+    return {
+        "requests": len(server.requests),
+        "prompt_tokens_mean": prompt_tokens / len(server.requests),
+        "cached_share": cached_tokens / prompt_tokens if prompt_tokens else 0.0,
+        "p50": float(np.percentile(latencies, 50)),
+        "p95": float(np.percentile(latencies, 95)),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Cache de prompt por layout do prompt, contra uma API falsa local.")
+    parser.add_argument("--db", default="data/example.db", help="Banco SQLite cujo schema vai no prompt.")
+    parser.add_argument("--corpus", default=CORPUS_PATH)
+    parser.add_argument("--metadata", default=METADATA_PATH, help="Dicionário de dados enviado no prompt.")
+    parser.add_argument("--iterations", type=int, default=2, help="Repetições do corpus por layout.")
+    parser.add_argument("--min-cached-tokens", type=int, default=1024, help="Tamanho mínimo do prefixo cacheável.")
+    parser.add_argument("--prefill-ms-per-1k", type=float, default=100.0, help="Tempo simulado de prefill por 1000 tokens não cacheados.")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    with open(args.metadata, encoding="utf-8") as f:
+        custom_metadata = f.read()
+    server = start_mock_server(
+        responses={item["question"]: item["sql"] for item in corpus},
+        min_cached_tokens=args.min_cached_tokens,
+        prefill_seconds_per_token=args.prefill_ms_per_1k / 1000 / 1000,
+    )
+    # O ChatOpenAI do registro lê o endereço da API desta variável ao ser criado
+    os.environ["OPENAI_BASE_URL"] = server.base_url
+    questions = [item["question"] for item in corpus] * args.iterations
+
+    print(f"{len(questions)} perguntas por layout · prefixo mínimo cacheável: {args.min_cached_tokens} tokens\n")
+    print(f"{'layout':<10}{'tokens/prompt':>15}{'em cache':>10}{'p50 (ms)':>11}{'p95 (ms)':>11}")
+    for layout in LAYOUTS:
+        result = run_layout(server, layout, f"sqlite:///{args.db}", questions, custom_metadata)
+        print(f"{layout:<10}{result['prompt_tokens_mean']:>15.0f}{result['cached_share']:>10.0%}"
+              f"{result['p50'] * 1000:>11.1f}{result['p95'] * 1000:>11.1f}")
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
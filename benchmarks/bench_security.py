@@ -0,0 +1,83 @@
+# benchmarks/bench_security.py
+"""
+Compara o guardrail atual (tokenizador de passada única + cache de veredictos) com a
+implementação antiga baseada em regex sobre a query inteira em maiúsculas.
+
+Uso:
+    python -m benchmarks.bench_security [--sizes 1 3 7] [--repeat 5]
+"""
+import argparse
+import re
+import timeit
+
+from utils import security
+
+# --- Implementação antiga (cópia para comparação) ---
+_LEGACY_PATTERN = re.compile(
+    r'\bDROP\b|\bDELETE\b|\bTRUNCATE\b|\bUPDATE\b|\bGRANT\b|\bREVOKE\b|\bALTER\b|\bINSERT\b',
+    re.IGNORECASE,
+)
+
+def legacy_is_query_safe(query: str) -> bool:
+    if not query:
+        return False
+    stripped_query = query.strip().upper()
+    if _LEGACY_PATTERN.search(stripped_query):
+        return False
+    return any(stripped_query.startswith(keyword) for keyword in ('SELECT', 'WITH'))
+
+# --- Casos de correção ---
+CORRECTNESS_CASES = [
+    ("Literal com palavra proibida", "SELECT * FROM pedidos WHERE status = 'DELETE'", True),
+    ("Comentário com palavra proibida", "SELECT id FROM clientes -- update manual em 2024", True),
+    ("Identificador entre aspas", 'SELECT "update" FROM auditoria', True),
+    ("Múltiplos comandos (CREATE)", "SELECT 1; CREATE TABLE x (a INT)", False),
+    ("Múltiplos comandos (VACUUM)", "SELECT 1; VACUUM", False),
+    ("SELECT ... INTO", "SELECT * INTO copia FROM clientes", False),
+    ("Escape com barra invertida", "SELECT '\\''; DROP TABLE t; -- '", False),
+]
+
+def generate_query(target_mb: float) -> str:
+    """Gera uma query de leitura grande, com literais e comentários, de ~target_mb MB."""
+    target = int(target_mb * 1024 * 1024)
+    parts, size, i = [], 0, 0
+    while size < target:
+        part = (f"SUM(CASE WHEN p.status = 'status_{i % 50}' THEN p.valor_{i % 7} ELSE 0 END) "
+                f"AS \"total {i}\" /* coluna {i} */")
+        parts.append(part)
+        size += len(part) + 2
+        i += 1
+    return "SELECT " + ",\n".join(parts) + "\nFROM pedidos p WHERE p.id > 0"
+
+def _best(statement, repeat: int) -> float:
+    return min(timeit.repeat(statement, number=1, repeat=repeat))
+
+def run(sizes, repeat: int):
+    print("== Correção ==")
+    print(f"{'caso':<34}{'esperado':>10}{'antigo':>10}{'novo':>10}")
+    for name, query, expected in CORRECTNESS_CASES:
+        legacy = legacy_is_query_safe(query)
+        current = security.check_query(query)[0]
+        print(f"{name:<34}{str(expected):>10}{str(legacy):>10}{str(current):>10}")
+
+    print("\n== Desempenho (melhor de %d execuções) ==" % repeat)
+    print(f"{'tamanho':>10}{'antigo (s)':>14}{'novo (s)':>12}{'novo c/ cache (s)':>20}{'MB/s (novo)':>14}")
+    for size_mb in sizes:
+        query = generate_query(size_mb)
+        actual_mb = len(query) / (1024 * 1024)
+        legacy_time = _best(lambda: legacy_is_query_safe(query), repeat)
+        uncached_time = _best(lambda: security.check_query(query), repeat)
+        security.is_query_safe(query)  # aquece o cache de veredictos
+        cached_time = _best(lambda: security.is_query_safe(query), repeat)
+        print(f"{actual_mb:>8.1f}MB{legacy_time:>14.3f}{uncached_time:>12.3f}{cached_time:>20.4f}"
+              f"{actual_mb / uncached_time:>14.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do guardrail de segurança SQL.")
+    parser.add_argument("--sizes", type=float, nargs="+", default=[1, 3, 7], help="Tamanhos das queries em MB.")
+    parser.add_argument("--repeat", type=int, default=5, help="Repetições por medição.")
+    args = parser.parse_args()
+    run(args.sizes, args.repeat)
+
+if __name__ == "__main__":
+    main()
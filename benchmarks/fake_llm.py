@@ -0,0 +1,76 @@
+# benchmarks/fake_llm.py
+"""
+Chat model local e determinístico para benchmarks: responde com SQL pré-definido para
+cada pergunta conhecida, simulando a latência de uma API, sem acesso à rede.
+"""
+import asyncio
+import json
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from pydantic import Field, PrivateAttr
+
+from pipeline.schema_retriever import estimate_tokens
+
+class FakeSQLChatModel(BaseChatModel):
+    """
+    Procura no prompt a pergunta de `responses` (a mais longa que aparecer) e devolve o
+    JSON {"query", "explanation"} esperado pelo pipeline. A latência de cada chamada é
+    `latency` ± `jitter` segundos (sorteada com `seed`, portanto reprodutível).
+    """
+
+    responses: Dict[str, str] = Field(default_factory=dict)
+    default_sql: str = "SELECT 1"
+    latency: float = 0.0
+    jitter: float = 0.0
+    seed: int = 0
+
+    _random: random.Random = PrivateAttr()
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _prompt_tokens: List[int] = PrivateAttr(default_factory=list)
+
+    def model_post_init(self, __context: Any):
+        self._random = random.Random(self.seed)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-sql"
+
+    @property
+    def prompt_tokens(self) -> List[int]:
+        """Tokens estimados do prompt de cada chamada feita até agora."""
+        with self._lock:
+            return list(self._prompt_tokens)
+
+    def _respond(self, messages: List[BaseMessage]) -> tuple:
+        prompt = "\n".join(str(message.content) for message in messages)
+        question = max((q for q in self.responses if q in prompt), key=len, default=None)
+        query = self.responses[question] if question else self.default_sql
+        content = json.dumps({"query": query, "explanation": f"Consulta gerada para: {question or 'pergunta desconhecida'}"},
+                             ensure_ascii=False)
+        input_tokens = estimate_tokens(prompt)
+        output_tokens = estimate_tokens(content)
+        with self._lock:
+            self._prompt_tokens.append(input_tokens)
+            delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+        message = AIMessage(content=content, usage_metadata={
+            "input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens,
+        })
+        return ChatResult(generations=[ChatGeneration(message=message)]), delay
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None,
+                  **kwargs: Any) -> ChatResult:
+        result, delay = self._respond(messages)
+        time.sleep(delay)
+        return result
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None,
+                         **kwargs: Any) -> ChatResult:
+        result, delay = self._respond(messages)
+        await asyncio.sleep(delay)
+        return result
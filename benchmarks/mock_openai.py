@@ -0,0 +1,183 @@
+# benchmarks/mock_openai.py
+"""
+Servidor local compatível com a API de Chat Completions da OpenAI que simula o cache de
+prompt do provedor: prefixos já vistos (a partir de `min_cached_tokens`, em blocos de
+`block_tokens`) são informados em usage.prompt_tokens_details.cached_tokens e não pagam
+o tempo de "prefill". Responde com o SQL pré-definido de cada pergunta conhecida.
+
+Uso:
+    python -m benchmarks.mock_openai --port 8787
+    OPENAI_BASE_URL=http://127.0.0.1:8787/v1 streamlit run app.py
+"""
+import argparse
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:  # sem tiktoken (ou sem o arquivo do encoding): ~4 caracteres por token
+    _encoding = None
+
+def tokenize(text: str) -> List[Any]:
+    if _encoding is not None:
+        return _encoding.encode(text)
+    return [text[start:start + 4] for start in range(0, len(text), 4)]
+
+class PrefixCache:
+    """Prefixos (em blocos de tokens) vistos recentemente, como no cache de prompt da OpenAI."""
+
+    def __init__(self, min_tokens: int = 1024, block_tokens: int = 128, max_entries: int = 100_000):
+        self.min_tokens = min_tokens
+        self.block_tokens = block_tokens
+        self.max_entries = max_entries
+        self._seen: "OrderedDict[bytes, None]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup_and_store(self, tokens: List[Any]) -> int:
+        """Retorna quantos tokens iniciais já estavam em cache e registra os prefixos desta requisição."""
+        digest = hashlib.blake2b(digest_size=16)
+        boundaries = []
+        for end in range(self.min_tokens, len(tokens) + 1, self.block_tokens):
+            start = boundaries[-1][0] if boundaries else 0
+            digest.update(repr(tokens[start:end]).encode())
+            boundaries.append((end, digest.copy().digest()))
+        cached = 0
+        with self._lock:
+            for end, key in boundaries:
+                if key in self._seen:
+                    self._seen.move_to_end(key)
+                    cached = end
+                else:
+                    self._seen[key] = None
+            while len(self._seen) > self.max_entries:
+                self._seen.popitem(last=False)
+        return cached
+
+    def clear(self):
+        with self._lock:
+            self._seen.clear()
+
+class MockOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], responses: Optional[Dict[str, str]] = None,
+                 default_sql: str = "SELECT 1", min_cached_tokens: int = 1024, base_latency: float = 0.05,
+                 prefill_seconds_per_token: float = 0.0001, decode_seconds_per_token: float = 0.002):
+        super().__init__(address, _Handler)
+        self.responses = responses or {}
+        self.default_sql = default_sql
+        self.cache = PrefixCache(min_tokens=min_cached_tokens)
+        self.base_latency = base_latency
+        self.prefill_seconds_per_token = prefill_seconds_per_token
+        self.decode_seconds_per_token = decode_seconds_per_token
+        self.requests: List[Dict[str, float]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def reset(self):
+        """Esvazia o cache de prefixos e as estatísticas."""
+        self.cache.clear()
+        with self._lock:
+            self.requests.clear()
+
+    def complete(self, messages: List[Dict[str, Any]]) -> Tuple[str, Dict[str, Any], float]:
+        """Monta a resposta, o `usage` e a latência simulada de uma requisição."""
+        prompt = "".join(f"<|{m.get('role')}|>{m.get('content') or ''}" for m in messages)
+        tokens = tokenize(prompt)
+        cached_tokens = self.cache.lookup_and_store(tokens)
+        question = max((q for q in self.responses if q in prompt), key=len, default=None)
+        content = json.dumps({
+            "query": self.responses[question] if question else self.default_sql,
+            "explanation": f"Consulta gerada para: {question or 'pergunta desconhecida'}",
+        }, ensure_ascii=False)
+        completion_tokens = len(tokenize(content))
+        latency = (self.base_latency + (len(tokens) - cached_tokens) * self.prefill_seconds_per_token
+                   + completion_tokens * self.decode_seconds_per_token)
+        usage = {
+            "prompt_tokens": len(tokens),
+            "completion_tokens": completion_tokens,
+            "total_tokens": len(tokens) + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached_tokens},
+        }
+        with self._lock:
+            self.requests.append({"prompt_tokens": len(tokens), "cached_tokens": cached_tokens, "latency": latency})
+        return content, usage, latency
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # mantém a conexão aberta (keep-alive), como a API real
+    server: MockOpenAIServer
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_error(404)
+            return
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        content, usage, latency = self.server.complete(body.get("messages", []))
+        time.sleep(latency)
+        base = {"id": f"chatcmpl-{time.time_ns()}", "created": int(time.time()), "model": body.get("model", "mock")}
+        if not body.get("stream"):
+            self._send_json({**base, "object": "chat.completion", "usage": usage, "choices": [
+                {"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}]})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        chunk = {**base, "object": "chat.completion.chunk"}
+        for start in range(0, len(content), 16):
+            self._send_event({**chunk, "choices": [
+                {"index": 0, "delta": {"role": "assistant", "content": content[start:start + 16]}, "finish_reason": None}]})
+        self._send_event({**chunk, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        if (body.get("stream_options") or {}).get("include_usage"):
+            self._send_event({**chunk, "choices": [], "usage": usage})
+        self._send_event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _send_json(self, payload: Dict[str, Any]):
+        data = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_event(self, payload: Any):
+        data = f"data: {payload if isinstance(payload, str) else json.dumps(payload)}\n\n".encode()
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+
+    def log_message(self, format, *args):
+        pass
+
+def start_mock_server(port: int = 0, **kwargs) -> MockOpenAIServer:
+    """Inicia o servidor numa thread daemon (porta 0 = porta livre qualquer)."""
+    server = MockOpenAIServer(("127.0.0.1", port), **kwargs)
+    threading.Thread(target=server.serve_forever, name="mock-openai", daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="API de Chat Completions falsa, com cache de prompt simulado.")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--corpus", default=None, help="JSON com perguntas e o SQL de cada uma (padrão: benchmarks/questions.json).")
+    parser.add_argument("--min-cached-tokens", type=int, default=1024, help="Tamanho mínimo do prefixo cacheável.")
+    args = parser.parse_args()
+
+    from benchmarks.bench_pipeline import CORPUS_PATH, load_corpus
+    corpus = load_corpus(args.corpus or CORPUS_PATH)
+    server = MockOpenAIServer(("127.0.0.1", args.port), responses={item["question"]: item["sql"] for item in corpus},
+                              min_cached_tokens=args.min_cached_tokens)
+    print(f"API falsa da OpenAI em {server.base_url}")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# benchmarks/profile_startup.py
+"""
+Perfil do início a frio da aplicação: tempo de import de cada módulo (python -X importtime)
+e tempo até a primeira renderização do app.py (execução completa do script, como num
+servidor Streamlit recém-iniciado). Também confere se os módulos pesados que devem ser
+carregados sob demanda (LangChain, OpenAI, matplotlib...) ficaram fora do início.
+
+Cada medição roda num processo novo, para não aproveitar imports já feitos.
+
+Uso:
+    python -m benchmarks.profile_startup
+    python -m benchmarks.profile_startup --budget-ms 1500 --runs 5   # código 1 se estourar o orçamento
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Módulos que só devem ser importados quando a funcionalidade correspondente é usada
+DEFERRED_MODULES = (
+    "langchain_openai", "langchain_community", "openai", "httpx", "matplotlib",
+    "streamlit_ace", "sql_formatter", "pipeline.agent_pipeline",
+)
+
+# Executado num processo novo: o streamlit já está importado num servidor real antes do
+# primeiro script, então só a execução do app.py entra na medição.
+_FIRST_RENDER_SCRIPT = """
+import json, sys, time
+from streamlit.testing.v1 import AppTest
+started = time.perf_counter()
+at = AppTest.from_file("app.py", default_timeout=120)
+at.run()
+elapsed = time.perf_counter() - started
+print(json.dumps({"seconds": elapsed, "exceptions": [str(e.value) for e in at.exception],
+                  "modules": sorted(sys.modules)}))
+"""
+
+def _run_python(args: List[str]) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, *args], cwd=ROOT, capture_output=True, text=True, check=False)
+
+def profile_imports(top: int) -> List[Tuple[str, float, float]]:
+    """Módulos com maior tempo de import acumulado ao importar o app.py: (módulo, própria ms, acumulado ms)."""
+    result = _run_python(["-X", "importtime", "-c", "import app"])
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        modules.append((name.rstrip(), int(self_us) / 1000, int(cumulative_us) / 1000))
+    # Apenas os imports de primeiro nível, que são os que o app.py realmente dispara
+    top_level = [(name.strip(), own, cumulative) for name, own, cumulative in modules
+                 if len(name) - len(name.lstrip()) <= 3]
+    return sorted(top_level, key=lambda item: item[2], reverse=True)[:top]
+
+def measure_first_render() -> Dict:
+    result = _run_python(["-c", _FIRST_RENDER_SCRIPT])
+    if result.returncode != 0:
+        raise RuntimeError(f"Falha ao executar o app.py:\n{result.stderr[-2000:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description="Tempo de import e de primeira renderização do app.py.")
+    parser.add_argument("--budget-ms", type=float, default=2500, help="Orçamento para a primeira renderização (p50).")
+    parser.add_argument("--runs", type=int, default=3, help="Execuções a frio medidas.")
+    parser.add_argument("--top", type=int, default=15, help="Quantidade de módulos no relatório de imports.")
+    args = parser.parse_args()
+    os.environ.setdefault("TRACING_PROMETHEUS_PORT", "0")
+
+    print(f"{'módulo':<40}{'próprio (ms)':>14}{'acumulado (ms)':>16}")
+    for name, own, cumulative in profile_imports(args.top):
+        print(f"{name:<40}{own:>14.1f}{cumulative:>16.1f}")
+
+    runs = [measure_first_render() for _ in range(args.runs)]
+    if runs[0]["exceptions"]:
+        print(f"\n⚠️ O app.py gerou exceções: {runs[0]['exceptions']}")
+    p50 = float(np.percentile([run["seconds"] for run in runs], 50)) * 1000
+    print(f"\nPrimeira renderização (p50 de {args.runs} execuções a frio): {p50:.0f}ms · orçamento: {args.budget_ms:.0f}ms")
+
+    loaded = set(runs[0]["modules"])
+    eager = [module for module in DEFERRED_MODULES if module in loaded]
+    if eager:
+        print(f"⚠️ Módulos que deveriam ser carregados sob demanda foram importados no início: {', '.join(eager)}")
+    if p50 > args.budget_ms or eager or runs[0]["exceptions"]:
+        sys.exit(1)
+    print("✅ Dentro do orçamento.")
+
+if __name__ == "__main__":
+    main()
@@ -45,4 +45,22 @@ def get_config_value(key: str, default: any = None):
 def get_openai_temperature():
     """Retorna a temperatura do modelo da OpenAI."""
     # Garante que o valor retornado seja float.
-    return float(get_config_value("OPENAI_TEMPERATURE", 0.1))
\ No newline at end of file
+    return float(get_config_value("OPENAI_TEMPERATURE", 0.1))
+
+def get_int_config(key: str, default: int) -> int:
+    """Retorna um valor de configuração convertido para int."""
+    return int(get_config_value(key, default))
+
+def get_float_config(key: str, default: float) -> float:
+    """Retorna um valor de configuração convertido para float."""
+    return float(get_config_value(key, default))
+
+def get_bool_config(key: str, default: bool) -> bool:
+    """
+    Retorna um valor de configuração booleano.
+    Aceita 'true', '1', 'yes', 'sim' e 'on' (sem diferenciar maiúsculas) como verdadeiro.
+    """
+    value = get_config_value(key, default)
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ("true", "1", "yes", "sim", "on")
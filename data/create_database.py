@@ -1,31 +1,56 @@
+"""
+Gera o banco SQLite de exemplo (clientes, produtos, pedidos e itens_pedido).
+
+Sem argumentos, cria o banco pequeno de demonstração em data/example.db. Com --scale,
+gera volumes próximos aos de produção para medir as otimizações do projeto:
+
+    python data/create_database.py                         # ~20 clientes, 50 pedidos
+    python data/create_database.py --scale 1 --seed 7      # 100 mil clientes, 1 milhão de pedidos, ~2,5 milhões de itens
+    python data/create_database.py --scale 4 -o data/big.db  # ~14 milhões de linhas no total
+
+Os valores são gerados em blocos com NumPy (nomes vêm de um pool do Faker) e inseridos
+com executemany dentro de uma única transação por tabela, com PRAGMAs de carga em massa.
+A distribuição é assimétrica como em dados reais: poucos clientes e produtos concentram
+boa parte dos pedidos, a maioria dos pedidos está entregue e o volume cresce com o tempo.
+"""
+import argparse
+import os
 import sqlite3
-import random
-from datetime import datetime, timedelta
+import time
+import unicodedata
+from datetime import date
+
+import numpy as np
 from faker import Faker
 
-# Inicializa o Faker
-fake = Faker('pt_BR')
+# Volumes para --scale 1 (o banco de demonstração usa os mínimos abaixo)
+CLIENTES_POR_ESCALA = 100_000
+PEDIDOS_POR_ESCALA = 1_000_000
+PRODUTOS_POR_ESCALA = 2_000
+MIN_CLIENTES, MIN_PEDIDOS = 20, 50
 
-# Conecta ao banco de dados (ou cria se não existir)
-conn = sqlite3.connect('data/example.db')
-cursor = conn.cursor()
+BATCH_SIZE = 200_000
+
+PRODUTOS_BASE = [
+    ('Laptop', 'Eletrônicos', 4500.00), ('Mouse', 'Eletrônicos', 150.00),
+    ('Teclado', 'Eletrônicos', 250.00), ('Monitor', 'Eletrônicos', 1200.00),
+    ('Cadeira Gamer', 'Móveis', 1500.00), ('Mesa de Escritório', 'Móveis', 800.00),
+    ('Livro de Ficção', 'Livros', 45.00), ('Livro Técnico', 'Livros', 120.00)
+]
+# Categorias extras dos produtos gerados, com a faixa de preço típica de cada uma
+CATEGORIAS = {
+    'Eletrônicos': (80.0, 6000.0), 'Móveis': (150.0, 3000.0), 'Livros': (20.0, 250.0),
+    'Casa': (30.0, 900.0), 'Esportes': (40.0, 1500.0), 'Beleza': (15.0, 400.0),
+}
+STATUS = ['Entregue', 'Pendente', 'Cancelado']
+STATUS_PESOS = [0.80, 0.15, 0.05]
 
-# --- Criação das Tabelas ---
-print("Criando tabelas...")
-cursor.execute('''
+SCHEMA = '''
 DROP TABLE IF EXISTS itens_pedido;
-''')
-cursor.execute('''
 DROP TABLE IF EXISTS pedidos;
-''')
-cursor.execute('''
 DROP TABLE IF EXISTS produtos;
-''')
-cursor.execute('''
 DROP TABLE IF EXISTS clientes;
-''')
 
-cursor.execute('''
 CREATE TABLE clientes (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     nome TEXT NOT NULL,
@@ -33,18 +58,14 @@ CREATE TABLE clientes (
     idade INTEGER,
     data_cadastro DATE
 );
-''')
 
-cursor.execute('''
 CREATE TABLE produtos (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     nome TEXT NOT NULL,
     categoria TEXT NOT NULL,
     preco REAL NOT NULL
 );
-''')
 
-cursor.execute('''
 CREATE TABLE pedidos (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     cliente_id INTEGER,
@@ -52,9 +73,7 @@ CREATE TABLE pedidos (
     status TEXT,
     FOREIGN KEY (cliente_id) REFERENCES clientes (id)
 );
-''')
 
-cursor.execute('''
 CREATE TABLE itens_pedido (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     pedido_id INTEGER,
@@ -64,50 +83,157 @@ CREATE TABLE itens_pedido (
     FOREIGN KEY (pedido_id) REFERENCES pedidos (id),
     FOREIGN KEY (produto_id) REFERENCES produtos (id)
 );
-''')
-print("Tabelas criadas com sucesso!")
+'''
 
-# --- Inserção de Dados Falsos ---
-print("Inserindo dados falsos...")
+# Criados depois da carga (mais rápido do que manter os índices durante os inserts)
+INDEXES = '''
+CREATE INDEX idx_pedidos_cliente ON pedidos (cliente_id);
+CREATE INDEX idx_pedidos_data ON pedidos (data_pedido);
+CREATE INDEX idx_pedidos_status_data ON pedidos (status, data_pedido);
+CREATE INDEX idx_itens_pedido_pedido ON itens_pedido (pedido_id);
+CREATE INDEX idx_itens_pedido_produto ON itens_pedido (produto_id);
+CREATE INDEX idx_produtos_categoria ON produtos (categoria);
+CREATE INDEX idx_clientes_data_cadastro ON clientes (data_cadastro);
+'''
 
-# Clientes
-clientes_ids = []
-for _ in range(20):
-    cursor.execute("INSERT INTO clientes (nome, email, idade, data_cadastro) VALUES (?, ?, ?, ?)",
-                   (fake.name(), fake.email(), random.randint(18, 70), fake.date_between(start_date='-2y', end_date='today')))
-    clientes_ids.append(cursor.lastrowid)
+def zipf_weights(n: int, exponent: float) -> np.ndarray:
+    """Pesos de popularidade em lei de potência: o item de posição k tem peso 1/k^exponent."""
+    weights = 1.0 / np.arange(1, n + 1) ** exponent
+    return weights / weights.sum()
 
-# Produtos
-produtos = [
-    ('Laptop', 'Eletrônicos', 4500.00), ('Mouse', 'Eletrônicos', 150.00),
-    ('Teclado', 'Eletrônicos', 250.00), ('Monitor', 'Eletrônicos', 1200.00),
-    ('Cadeira Gamer', 'Móveis', 1500.00), ('Mesa de Escritório', 'Móveis', 800.00),
-    ('Livro de Ficção', 'Livros', 45.00), ('Livro Técnico', 'Livros', 120.00)
-]
-produtos_ids = []
-for produto in produtos:
-    cursor.execute("INSERT INTO produtos (nome, categoria, preco) VALUES (?, ?, ?)", produto)
-    produtos_ids.append(cursor.lastrowid)
-
-# Pedidos e Itens de Pedido
-for i in range(50):
-    cliente_id = random.choice(clientes_ids)
-    data_pedido = fake.date_between(start_date='-1y', end_date='today')
-    status = random.choice(['Entregue', 'Pendente', 'Cancelado'])
-    cursor.execute("INSERT INTO pedidos (cliente_id, data_pedido, status) VALUES (?, ?, ?)",
-                   (cliente_id, data_pedido, status))
-    pedido_id = cursor.lastrowid
-
-    # Adiciona itens ao pedido
-    for _ in range(random.randint(1, 4)):
-        produto_info = random.choice(list(zip(produtos_ids, produtos)))
-        produto_id = produto_info[0]
-        preco_unitario = produto_info[1][2]
-        quantidade = random.randint(1, 3)
-        cursor.execute("INSERT INTO itens_pedido (pedido_id, produto_id, quantidade, preco_unitario) VALUES (?, ?, ?, ?)",
-                       (pedido_id, produto_id, quantidade, preco_unitario))
-
-conn.commit()
-conn.close()
-
-print("Banco de dados 'example.db' criado e populado com sucesso!")
\ No newline at end of file
+def random_dates(rng: np.random.Generator, n: int, days_back: int) -> np.ndarray:
+    """Datas ISO (YYYY-MM-DD) nos últimos `days_back` dias, mais frequentes perto de hoje."""
+    # Distribuição triangular com moda em hoje: o volume cresce ao longo do período
+    offsets = rng.triangular(0, days_back, days_back, n).astype(np.int64)
+    start = np.datetime64(date.today(), 'D') - np.timedelta64(days_back, 'D')
+    return (start + offsets.astype('timedelta64[D]')).astype(str)
+
+def _ascii(text: str) -> str:
+    normalized = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(ch for ch in normalized if ch.isalnum() and not unicodedata.combining(ch))
+
+def configure_bulk_load(conn: sqlite3.Connection):
+    # Sem journal e sem fsync: o arquivo é temporário até a carga terminar.
+    conn.execute('PRAGMA journal_mode = OFF')
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute('PRAGMA locking_mode = EXCLUSIVE')
+    conn.execute('PRAGMA temp_store = MEMORY')
+    conn.execute('PRAGMA cache_size = -262144')  # 256 MB
+
+def insert_clientes(conn, rng, fake, count):
+    first_names = [fake.first_name() for _ in range(500)]
+    last_names = [fake.last_name() for _ in range(500)]
+    domains = ['gmail.com', 'hotmail.com', 'outlook.com', 'yahoo.com.br', 'uol.com.br', 'empresa.com.br']
+    ascii_first = [_ascii(name) for name in first_names]
+    ascii_last = [_ascii(name) for name in last_names]
+
+    for start in range(0, count, BATCH_SIZE):
+        size = min(BATCH_SIZE, count - start)
+        first = rng.integers(0, len(first_names), size)
+        last = rng.integers(0, len(last_names), size)
+        domain = rng.integers(0, len(domains), size)
+        # Idade concentrada entre 25 e 45 anos, limitada a 18-80
+        ages = np.clip(rng.normal(36, 11, size), 18, 80).astype(int)
+        signup_dates = random_dates(rng, size, 2 * 365)
+        columns = zip(range(start + 1, start + size + 1), first.tolist(), last.tolist(), domain.tolist(),
+                      ages.tolist(), signup_dates.tolist())
+        # O id entra no e-mail para garantir a unicidade exigida pela tabela
+        rows = (
+            (i, f'{first_names[f]} {last_names[l]}', f'{ascii_first[f]}.{ascii_last[l]}{i}@{domains[d]}', age, signup)
+            for i, f, l, d, age, signup in columns
+        )
+        conn.executemany('INSERT INTO clientes (id, nome, email, idade, data_cadastro) VALUES (?, ?, ?, ?, ?)', rows)
+
+def insert_produtos(conn, rng, count) -> np.ndarray:
+    """Insere os produtos e retorna o array de preços indexado por (id - 1)."""
+    produtos = list(PRODUTOS_BASE)
+    categorias = list(CATEGORIAS)
+    for i in range(len(produtos), count):
+        categoria = categorias[int(rng.integers(0, len(categorias)))]
+        low, high = CATEGORIAS[categoria]
+        # Preços log-uniformes: muitos itens baratos, poucos caros
+        preco = round(float(np.exp(rng.uniform(np.log(low), np.log(high)))), 2)
+        produtos.append((f'{categoria} - Modelo {i + 1:05d}', categoria, preco))
+    conn.executemany('INSERT INTO produtos (nome, categoria, preco) VALUES (?, ?, ?)', produtos)
+    return np.array([preco for _, _, preco in produtos])
+
+def insert_pedidos_e_itens(conn, rng, pedidos, clientes, precos) -> int:
+    # Poucos clientes compram muito e poucos produtos vendem muito
+    cliente_pesos = zipf_weights(clientes, 0.8)
+    produto_pesos = zipf_weights(len(precos), 1.1)
+    total_itens = 0
+
+    for start in range(0, pedidos, BATCH_SIZE):
+        size = min(BATCH_SIZE, pedidos - start)
+        pedido_ids = np.arange(start + 1, start + size + 1)
+        cliente_ids = rng.choice(clientes, size, p=cliente_pesos) + 1
+        status = np.array(STATUS)[rng.choice(len(STATUS), size, p=STATUS_PESOS)]
+        datas = random_dates(rng, size, 365)
+        conn.executemany(
+            'INSERT INTO pedidos (id, cliente_id, data_pedido, status) VALUES (?, ?, ?, ?)',
+            zip(pedido_ids.tolist(), cliente_ids.tolist(), datas.tolist(), status.tolist()))
+
+        # 1 a 4 itens por pedido (média ~2,5)
+        itens_por_pedido = rng.integers(1, 5, size)
+        item_pedidos = np.repeat(pedido_ids, itens_por_pedido)
+        n_itens = len(item_pedidos)
+        produto_ids = rng.choice(len(precos), n_itens, p=produto_pesos) + 1
+        quantidades = rng.choice([1, 2, 3], n_itens, p=[0.7, 0.2, 0.1])
+        conn.executemany(
+            'INSERT INTO itens_pedido (pedido_id, produto_id, quantidade, preco_unitario) VALUES (?, ?, ?, ?)',
+            zip(item_pedidos.tolist(), produto_ids.tolist(), quantidades.tolist(), precos[produto_ids - 1].tolist()))
+        total_itens += n_itens
+        print(f'  {start + size:,} pedidos / {total_itens:,} itens...')
+    return total_itens
+
+def build_database(output: str, scale: float, seed: int):
+    clientes = max(MIN_CLIENTES, int(CLIENTES_POR_ESCALA * scale))
+    pedidos = max(MIN_PEDIDOS, int(PEDIDOS_POR_ESCALA * scale))
+    produtos = max(len(PRODUTOS_BASE), int(PRODUTOS_POR_ESCALA * scale))
+
+    rng = np.random.default_rng(seed)
+    Faker.seed(seed)
+    fake = Faker('pt_BR')
+
+    # Monta num arquivo temporário e só substitui o destino no final:
+    # a aplicação nunca enxerga um banco pela metade.
+    tmp_output = f'{output}.tmp'
+    if os.path.exists(tmp_output):
+        os.remove(tmp_output)
+    started_at = time.perf_counter()
+    conn = sqlite3.connect(tmp_output, isolation_level=None)
+    try:
+        configure_bulk_load(conn)
+        print("Criando tabelas...")
+        conn.executescript(SCHEMA)
+
+        print(f"Inserindo {clientes:,} clientes, {produtos:,} produtos e {pedidos:,} pedidos...")
+        conn.execute('BEGIN')
+        insert_clientes(conn, rng, fake, clientes)
+        precos = insert_produtos(conn, rng, produtos)
+        total_itens = insert_pedidos_e_itens(conn, rng, pedidos, clientes, precos)
+        conn.execute('COMMIT')
+
+        print("Criando índices e estatísticas...")
+        conn.executescript(INDEXES)
+        conn.execute('ANALYZE')
+        conn.execute('PRAGMA journal_mode = DELETE')
+    finally:
+        conn.close()
+    os.replace(tmp_output, output)
+
+    total = clientes + produtos + pedidos + total_itens
+    print(f"Banco de dados '{output}' criado com {total:,} linhas em {time.perf_counter() - started_at:.1f}s!")
+
+def main():
+    parser = argparse.ArgumentParser(description="Gera o banco SQLite de exemplo do DataSpeak.")
+    parser.add_argument('--scale', type=float, default=0.0,
+                        help=f"Fator de escala (1 = {CLIENTES_POR_ESCALA:,} clientes e {PEDIDOS_POR_ESCALA:,} pedidos). "
+                             "0 gera o banco pequeno de demonstração.")
+    parser.add_argument('--seed', type=int, default=42, help="Semente dos dados aleatórios (reprodutível).")
+    parser.add_argument('-o', '--output', default='data/example.db', help="Caminho do arquivo SQLite gerado.")
+    args = parser.parse_args()
+    build_database(args.output, args.scale, args.seed)
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,40 @@
 # pipeline/agent_pipeline.py
-from langchain_community.utilities import SQLDatabase
+import asyncio
+import contextvars
+import json
+import logging
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import lru_cache
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import PydanticOutputParser
 from pydantic import BaseModel, Field 
-from typing import List
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
-from strategies.llms.openai_llm import get_openai_llm
+from strategies.llms.openai_llm import allm_request_slot, get_openai_llm, llm_request_slot
+from pipeline.schema_catalog import SchemaCatalog, get_schema_catalog
+from pipeline.sql_validator import SQLValidationError, check_generated_sql
+from config import get_bool_config, get_config_value, get_int_config
+from pipeline.schema_retriever import schema_tokens, select_relevant_schema, select_schema_for_questions
+from pipeline import generation_cache
+from utils.tracing import current_trace, run_in_trace, span
+
+logger = logging.getLogger(__name__)
 
 # --- Modelo de Saída Estruturada ---
 class SQLQuery(BaseModel):
     query: str = Field(description="A query SQL completa e sintaticamente correta.")
     explanation: str = Field(description="Uma breve explicação em linguagem natural do que a query SQL faz e por que ela responde à pergunta do usuário.")
 
+class NumberedSQLQuery(SQLQuery):
+    id: int = Field(description="O número da pergunta respondida por esta query.")
+
+class SQLQueryBatch(BaseModel):
+    queries: List[NumberedSQLQuery] = Field(description="Uma query para cada pergunta numerada, na mesma ordem.")
+
 # --- Novo Prompt Focado em Geração de SQL ---
 SQL_GENERATION_PROMPT = """
 Você é um especialista em SQL de classe mundial. Sua tarefa é analisar o schema de um banco de dados, o contexto de negócio e a pergunta de um usuário para gerar uma query SQL precisa e otimizada.
@@ -40,24 +63,87 @@ Você é um especialista em SQL de classe mundial. Sua tarefa é analisar o sche
 {format_instructions}
 """
 
-def generate_sql_query(
-    db_uri: str,
-    openai_api_key: str,
-    model_name: str,
-    question: str,
-    custom_metadata: str = "",
-    chat_history: List[tuple] = None
-) -> SQLQuery:
-    """
-    Gera uma query SQL a partir de uma pergunta em linguagem natural.
-    Não executa a query, apenas a gera.
-    """
-    llm = get_openai_llm(api_key=openai_api_key, model_name=model_name)
-    db = SQLDatabase.from_uri(db_uri)
-    
-    dialect = db.dialect # Obtém o dialeto do banco de dados
-    schema_info = db.get_table_info()
+# --- Prompt com Prefixo Estável (PROMPT_LAYOUT=prefix) ---
+# O conteúdo vai do mais estável ao mais variável: instruções e formato de saída (fixos), depois
+# dialeto, schema e dicionário (fixos por conexão) e, por último, histórico e pergunta. Assim o
+# início da requisição é idêntico, byte a byte, entre as perguntas de uma mesma conexão, e o
+# cache de prompt do provedor (ex: OpenAI, a partir de 1024 tokens) reaproveita esse prefixo.
+SQL_GENERATION_PROMPT_PREFIX = """
+Você é um especialista em SQL de classe mundial. Sua tarefa é analisar o schema de um banco de dados, o contexto de negócio e a pergunta de um usuário para gerar uma query SQL precisa e otimizada.
+
+**Regras Importantes:**
+1.  Gere APENAS queries de LEITURA (SELECT). NUNCA gere queries de escrita (INSERT, UPDATE, DELETE, DROP, etc.).
+2.  Use o Dicionário de Dados Customizado para entender a semântica de nomes de tabelas e colunas (ex: tbl_cli significa tabela de clientes).
+3.  Analise o histórico da conversa para entender perguntas de acompanhamento e usar o contexto.
+4.  Retorne a query SQL e uma breve explicação no formato JSON solicitado.
+
+{format_instructions}
 
+**Dialeto SQL do Banco de Dados Alvo:**
+`{dialect}`
+
+**Schema do Banco de Dados:**
+{schema}
+
+**Dicionário de Dados Customizado:**
+{custom_metadata}
+
+**Histórico da Conversa:**
+{chat_history}
+
+**Pergunta do Usuário:**
+{question}
+"""
+
+# --- Nova Tentativa Após a Validação do Schema ---
+# Substitui a pergunta no prompt quando a query gerada é rejeitada pela validação local.
+SQL_VALIDATION_FEEDBACK = """{question}
+
+**Atenção:** a query abaixo, gerada anteriormente para esta pergunta, foi rejeitada porque não confere com o schema do banco de dados:
+{query}
+Problemas encontrados: {problems}
+Gere uma nova query usando apenas tabelas, colunas e funções que existem no schema e no dialeto informados."""
+
+# --- Prompt para Gerar o SQL de Várias Perguntas numa Única Chamada ---
+SQL_BATCH_GENERATION_PROMPT = """
+Você é um especialista em SQL de classe mundial. Sua tarefa é analisar o schema de um banco de dados, o contexto de negócio e uma lista numerada de perguntas de usuários para gerar, para CADA pergunta, uma query SQL precisa e otimizada.
+
+**Regras Importantes:**
+1.  Gere APENAS queries de LEITURA (SELECT). NUNCA gere queries de escrita (INSERT, UPDATE, DELETE, DROP, etc.).
+2.  Use o Dicionário de Dados Customizado para entender a semântica de nomes de tabelas e colunas (ex: tbl_cli significa tabela de clientes).
+3.  As perguntas são independentes: cada query deve responder sozinha à sua pergunta.
+4.  Retorne uma query e uma breve explicação por pergunta, com o número (id) da pergunta, no formato JSON solicitado.
+
+{format_instructions}
+
+**Dialeto SQL do Banco de Dados Alvo:**
+`{dialect}`
+
+**Schema do Banco de Dados:**
+{schema}
+
+**Dicionário de Dados Customizado:**
+{custom_metadata}
+
+**Perguntas:**
+{questions}
+"""
+
+@dataclass
+class _GenerationRequest:
+    """Tudo o que a geração precisa, montado uma vez e usado pelos caminhos síncrono e assíncrono."""
+    question: str
+    model_name: str
+    cached: Optional[SQLQuery] = None
+    chain_inputs: Dict[str, Any] = field(default_factory=dict)
+    llm: Any = None
+    cache_info: Optional[Dict[str, str]] = None
+    catalog: Optional[SchemaCatalog] = None
+    # Texto e opções da seleção de tabelas, reaproveitados na nova tentativa após a validação
+    schema_query: str = ""
+    schema_options: Dict[str, Any] = field(default_factory=dict)
+
+def _format_chat_history(chat_history: Optional[List]) -> List[str]:
     # Adaptação para o histórico do Streamlit
     # Assume que chat_history vem como lista de dicionários (roles e content)
     formatted_chat_history = []
@@ -67,28 +153,505 @@ def generate_sql_query(
                 formatted_chat_history.append(f"{msg['role']}: {msg['content']}")
             elif isinstance(msg, tuple) and len(msg) == 2: # Compatibilidade com (role, content)
                 formatted_chat_history.append(f"{msg[0]}: {msg[1]}")
+    return formatted_chat_history
+
+def _prepare_generation(
+    db_uri: str,
+    openai_api_key: str,
+    model_name: str,
+    question: str,
+    custom_metadata: str,
+    chat_history: Optional[List],
+    connection_id: Optional[str],
+    use_cache: bool,
+    llm: Any = None,
+) -> _GenerationRequest:
+    """Obtém o schema, consulta o cache de geração e monta as entradas do prompt."""
+    with span("schema") as schema_span:
+        catalog = get_schema_catalog(db_uri, connection_id=connection_id)
+        schema_span.set(tables=len(catalog.table_names))
+    
+    dialect = catalog.dialect # Obtém o dialeto do banco de dados
+
+    formatted_chat_history = _format_chat_history(chat_history)
     history_str = "\n".join(formatted_chat_history)
 
-    parser = PydanticOutputParser(pydantic_object=SQLQuery)
+    # As últimas perguntas do usuário são o contexto relevante para perguntas de acompanhamento.
+    recent_user_questions = [line[len("user: "):] for line in formatted_chat_history if line.startswith("user: ")][-2:]
+
+    request = _GenerationRequest(question=question, model_name=model_name, catalog=catalog)
+
+    # Cache de geração: a mesma pergunta, no mesmo contexto, dispensa a chamada ao LLM.
+    if use_cache and generation_cache.is_generation_cache_enabled():
+        cache_connection_id = connection_id or generation_cache.hash_text(db_uri)
+        metadata_hash = generation_cache.hash_text(custom_metadata)
+        cache_key = generation_cache.build_cache_key(
+            cache_connection_id, question, catalog.fingerprint, metadata_hash, model_name, recent_user_questions
+        )
+        request.cache_info = {
+            "cache_key": cache_key,
+            "connection_id": cache_connection_id,
+            "schema_fingerprint": catalog.fingerprint,
+            "metadata_hash": metadata_hash,
+        }
+        with span("generation_cache") as cache_span:
+            cached = generation_cache.get_cached_generation(cache_key)
+            cache_span.set(hit=bool(cached))
+        if cached:
+            request.cached = SQLQuery(**cached)
+            return request
+
+    # Um modelo injetado (ex: o modelo falso dos benchmarks) substitui o da OpenAI
+    request.llm = llm or get_openai_llm(api_key=openai_api_key, model_name=model_name)
+
+    # Envia apenas as tabelas relevantes para a pergunta (e as perguntas anteriores do usuário,
+    # para que perguntas de acompanhamento mantenham as tabelas do contexto).
+    # No layout de prefixo estável, schemas de até PROMPT_CACHE_MAX_SCHEMA_TOKENS vão completos:
+    # a poda muda o schema a cada pergunta e impediria o cache de prompt do provedor.
+    top_k = None
+    if get_prompt_layout() == "prefix" and \
+            schema_tokens(catalog) <= get_int_config("PROMPT_CACHE_MAX_SCHEMA_TOKENS", 4000):
+        top_k = len(catalog.table_infos)
+    request.schema_query = " ".join(recent_user_questions + [question])
+    request.schema_options = {"custom_metadata": custom_metadata, "cache_key": connection_id or db_uri, "top_k": top_k}
+    with span("schema_pruning") as pruning_span:
+        schema_info, pruning_stats = select_relevant_schema(catalog, request.schema_query, **request.schema_options)
+        pruning_span.set(tables_sent=pruning_stats["tables_sent"], tokens_saved=pruning_stats["tokens_saved"])
+    logger.info(
+        "Schema enviado: %s/%s tabelas, %s tokens economizados",
+        pruning_stats["tables_sent"], pruning_stats["tables_total"], pruning_stats["tokens_saved"],
+    )
+
+    request.chain_inputs = {
+        "dialect": dialect,
+        "schema": schema_info,
+        "custom_metadata": custom_metadata if custom_metadata else "Nenhum.",
+        "chat_history": history_str if history_str else "Nenhum.",
+        "question": question
+    }
+    return request
+
+def get_prompt_layout() -> str:
+    """"prefix" (padrão): prompt com prefixo estável, aproveitando o cache de prompt do provedor; "legacy": layout original."""
+    return "legacy" if str(get_config_value("PROMPT_LAYOUT", "prefix")).lower() == "legacy" else "prefix"
 
+@lru_cache(maxsize=None)
+def _get_chain_parts(batch: bool = False, layout: str = "prefix") -> Tuple[ChatPromptTemplate, PydanticOutputParser]:
+    """Prompt e parser montados uma única vez por processo (não dependem do modelo nem da pergunta)."""
+    parser = PydanticOutputParser(pydantic_object=SQLQueryBatch if batch else SQLQuery)
+    if batch:
+        template = SQL_BATCH_GENERATION_PROMPT
+    else:
+        template = SQL_GENERATION_PROMPT_PREFIX if layout == "prefix" else SQL_GENERATION_PROMPT
     prompt = ChatPromptTemplate.from_template(
-        template=SQL_GENERATION_PROMPT,
+        template=template,
         partial_variables={"format_instructions": parser.get_format_instructions()}
     )
+    return prompt, parser
 
-    # Cria a cadeia LCEL
-    chain = prompt | llm | parser
+def _usage_attributes(message: Any) -> Dict[str, Any]:
+    """Tokens consumidos segundo a resposta do modelo (usage_metadata do LangChain), quando informados."""
+    usage = getattr(message, "usage_metadata", None) or {}
+    return {
+        "prompt_tokens": usage.get("input_tokens"),
+        "completion_tokens": usage.get("output_tokens"),
+        "cached_tokens": (usage.get("input_token_details") or {}).get("cache_read"),
+    }
+
+def _store_result(request: _GenerationRequest, result: SQLQuery):
+    if request.cache_info:
+        generation_cache.store_generation(
+            request.cache_info["cache_key"], request.cache_info["connection_id"],
+            request.cache_info["schema_fingerprint"], request.cache_info["metadata_hash"],
+            request.model_name, request.question, result.query, result.explanation
+        )
+
+def _validation_error(catalog: SchemaCatalog, query: str) -> Optional[SQLValidationError]:
+    """Confere a query gerada contra o catálogo; o erro é retornado (e não levantado) para permitir uma nova tentativa."""
+    with span("sql_validation") as validation_span:
+        try:
+            validation = check_generated_sql(query, catalog)
+        except SQLValidationError as e:
+            validation_span.set(problems=len(e.validation.problems))
+            return e
+        validation_span.set(problems=len(validation.problems))
+    return None
+
+def _retry_inputs(request: _GenerationRequest, error: SQLValidationError) -> Optional[Dict[str, Any]]:
+    """
+    Entradas do prompt para a única nova tentativa (SQL_VALIDATION_RETRY): a pergunta ganha a query
+    rejeitada e os problemas encontrados, e o schema inclui as tabelas sugeridas pela validação.
+    Retorna None se a nova tentativa estiver desligada.
+    """
+    if not get_bool_config("SQL_VALIDATION_RETRY", True):
+        return None
+    logger.info("Query rejeitada pela validação do schema; gerando novamente: %s", "; ".join(error.validation.problems))
+    tables = error.validation.tables + error.validation.suggested_tables
+    with span("schema_pruning", retry=True) as pruning_span:
+        schema_info, pruning_stats = select_relevant_schema(
+            request.catalog, " ".join([request.schema_query] + tables), **request.schema_options
+        )
+        pruning_span.set(tables_sent=pruning_stats["tables_sent"], tokens_saved=pruning_stats["tokens_saved"])
+    return dict(
+        request.chain_inputs,
+        schema=schema_info,
+        question=SQL_VALIDATION_FEEDBACK.format(
+            question=request.question, query=error.query, problems="; ".join(error.validation.problems)
+        ),
+    )
+
+def _raise_friendly(e: Exception):
+    if "Failed to parse" in str(e):
+        raise RuntimeError(f"A IA não conseguiu gerar uma query válida. Por favor, tente reformular sua pergunta. Detalhes: {e}")
+    raise e
+
+def generate_sql_query(
+    db_uri: str,
+    openai_api_key: str,
+    model_name: str,
+    question: str,
+    custom_metadata: str = "",
+    chat_history: List[tuple] = None,
+    connection_id: str = None,
+    use_cache: bool = True,
+    llm: Any = None
+) -> SQLQuery:
+    """
+    Gera uma query SQL a partir de uma pergunta em linguagem natural.
+    Não executa a query, apenas a gera.
+    O schema vem do catálogo em cache da conexão (ver pipeline/schema_catalog.py) e
+    perguntas repetidas são respondidas pelo cache de geração, sem chamar o LLM.
+    A query gerada é conferida contra esse mesmo catálogo (ver pipeline/sql_validator.py):
+    se referenciar tabelas, colunas ou funções inexistentes, o erro volta ao LLM numa única
+    nova tentativa e, persistindo, levanta SQLValidationError sem que a query chegue ao banco.
+    `llm` permite usar outro chat model do LangChain no lugar do ChatOpenAI.
+    """
+    request = _prepare_generation(
+        db_uri, openai_api_key, model_name, question, custom_metadata, chat_history, connection_id, use_cache, llm
+    )
+    if request.cached:
+        return request.cached
+
+    prompt, parser = _get_chain_parts(layout=get_prompt_layout())
+
+    def invoke(inputs: Dict[str, Any]) -> SQLQuery:
+        # Equivale à cadeia LCEL prompt | llm | parser, com cada etapa medida separadamente
+        with span("prompt_build"):
+            prompt_value = prompt.invoke(inputs)
+        with llm_request_slot(), span("llm", model=request.model_name) as llm_span:
+            response = request.llm.invoke(prompt_value)
+            llm_span.set(**_usage_attributes(response))
+        with span("parse"):
+            return parser.invoke(response)
 
     try:
-        result = chain.invoke({
-            "dialect": dialect,
-            "schema": schema_info,
-            "custom_metadata": custom_metadata if custom_metadata else "Nenhum.",
-            "chat_history": history_str if history_str else "Nenhum.",
-            "question": question
-        })
+        result = invoke(request.chain_inputs)
+        error = _validation_error(request.catalog, result.query)
+        if error is not None:
+            retry_inputs = _retry_inputs(request, error)
+            if retry_inputs is None:
+                raise error
+            result = invoke(retry_inputs)
+            error = _validation_error(request.catalog, result.query)
+            if error is not None:
+                raise error
+        _store_result(request, result)
         return result
     except Exception as e:
-        if "Failed to parse" in str(e):
-            raise RuntimeError(f"A IA não conseguiu gerar uma query válida. Por favor, tente reformular sua pergunta. Detalhes: {e}")
-        raise e
\ No newline at end of file
+        _raise_friendly(e)
+
+# --- Geração em Lote (métricas de dashboard salvas sem SQL) ---
+def generate_sql_queries_batch(
+    db_uri: str,
+    openai_api_key: str,
+    model_name: str,
+    questions: List[str],
+    custom_metadata: str = "",
+    connection_id: str = None,
+    use_cache: bool = True,
+    llm: Any = None
+) -> Dict[str, SQLQuery]:
+    """
+    Gera o SQL de várias perguntas independentes com poucas chamadas ao LLM: as perguntas são
+    agrupadas em lotes de BATCH_GENERATION_SIZE, que compartilham um único prompt com o schema
+    relevante para todas elas. Os lotes rodam em paralelo (até BATCH_GENERATION_CONCURRENCY).
+
+    Retorna {pergunta: SQLQuery}. Perguntas já presentes no cache de geração não vão ao LLM;
+    perguntas sem resposta (lote com erro ou id ausente) ficam de fora do resultado, para que
+    quem chamou use generate_sql_query nelas individualmente.
+    """
+    pending = list(dict.fromkeys(question for question in questions if question and question.strip()))
+    if not pending:
+        return {}
+
+    with span("schema") as schema_span:
+        catalog = get_schema_catalog(db_uri, connection_id=connection_id)
+        schema_span.set(tables=len(catalog.table_names))
+
+    results: Dict[str, SQLQuery] = {}
+    requests = {question: _GenerationRequest(question=question, model_name=model_name) for question in pending}
+
+    # Mesma chave do caminho individual (sem histórico): as gerações valem para os dois caminhos.
+    if use_cache and generation_cache.is_generation_cache_enabled():
+        cache_connection_id = connection_id or generation_cache.hash_text(db_uri)
+        metadata_hash = generation_cache.hash_text(custom_metadata)
+        with span("generation_cache", questions=len(pending)) as cache_span:
+            for question in pending:
+                cache_key = generation_cache.build_cache_key(
+                    cache_connection_id, question, catalog.fingerprint, metadata_hash, model_name, []
+                )
+                requests[question].cache_info = {
+                    "cache_key": cache_key,
+                    "connection_id": cache_connection_id,
+                    "schema_fingerprint": catalog.fingerprint,
+                    "metadata_hash": metadata_hash,
+                }
+                cached = generation_cache.get_cached_generation(cache_key)
+                if cached:
+                    results[question] = SQLQuery(**cached)
+            cache_span.set(hits=len(results))
+        pending = [question for question in pending if question not in results]
+        if not pending:
+            return results
+
+    llm = llm or get_openai_llm(api_key=openai_api_key, model_name=model_name)
+    prompt, parser = _get_chain_parts(batch=True)
+    batch_size = max(1, get_int_config("BATCH_GENERATION_SIZE", 10))
+    batches = [pending[start:start + batch_size] for start in range(0, len(pending), batch_size)]
+
+    def generate_batch(batch: List[str]) -> Dict[str, SQLQuery]:
+        with span("schema_pruning") as pruning_span:
+            schema_info, pruning_stats = select_schema_for_questions(
+                catalog, batch, custom_metadata=custom_metadata, cache_key=connection_id or db_uri
+            )
+            pruning_span.set(tables_sent=pruning_stats["tables_sent"], tokens_saved=pruning_stats["tokens_saved"])
+        with span("prompt_build"):
+            prompt_value = prompt.invoke({
+                "dialect": catalog.dialect,
+                "schema": schema_info,
+                "custom_metadata": custom_metadata if custom_metadata else "Nenhum.",
+                "questions": "\n".join(f"{number}. {question}" for number, question in enumerate(batch, start=1)),
+            })
+        with llm_request_slot(), span("llm", model=model_name, batch_size=len(batch)) as llm_span:
+            response = llm.invoke(prompt_value)
+            llm_span.set(**_usage_attributes(response))
+        with span("parse"):
+            parsed = parser.invoke(response)
+        answers = {}
+        for item in parsed.queries:
+            if not (1 <= item.id <= len(batch) and item.query.strip()):
+                continue
+            # Query rejeitada pela validação do schema: fica sem resposta e passa pela geração individual
+            if _validation_error(catalog, item.query) is None:
+                answers[batch[item.id - 1]] = SQLQuery(query=item.query, explanation=item.explanation)
+        return answers
+
+    max_workers = min(len(batches), max(1, get_int_config("BATCH_GENERATION_CONCURRENCY", 3)))
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="batch-sql") as pool:
+        # copy_context mantém os spans de cada lote no trace de quem chamou
+        futures = [pool.submit(contextvars.copy_context().run, generate_batch, batch) for batch in batches]
+        for batch, future in zip(batches, futures):
+            try:
+                answers = future.result()
+            except Exception as e:
+                logger.warning("Falha ao gerar o SQL de um lote de %s pergunta(s): %s", len(batch), e)
+                continue
+            for question, result in answers.items():
+                results[question] = result
+                _store_result(requests[question], result)
+            missing = len(batch) - len(answers)
+            if missing:
+                logger.warning("O lote ficou sem resposta para %s de %s pergunta(s).", missing, len(batch))
+    return results
+
+# --- Geração Assíncrona com Streaming ---
+_QUERY_FIELD_START = re.compile(r'"query"\s*:\s*"')
+
+def extract_streamed_query(partial_output: str) -> Optional[str]:
+    """
+    Extrai o valor do campo "query" de um JSON ainda incompleto, assim que a string
+    do campo estiver fechada. Retorna None enquanto o valor não estiver completo.
+    """
+    match = _QUERY_FIELD_START.search(partial_output)
+    if not match:
+        return None
+    escaped = False
+    for position in range(match.end(), len(partial_output)):
+        char = partial_output[position]
+        if escaped:
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif char == '"':
+            return json.loads(partial_output[match.end() - 1:position + 1])
+    return None
+
+async def agenerate_sql_query(
+    db_uri: str,
+    openai_api_key: str,
+    model_name: str,
+    question: str,
+    custom_metadata: str = "",
+    chat_history: List[tuple] = None,
+    connection_id: str = None,
+    use_cache: bool = True,
+    llm: Any = None,
+    on_query: Optional[Callable[[str], None]] = None,
+    on_token: Optional[Callable[[str], None]] = None,
+) -> SQLQuery:
+    """
+    Versão assíncrona de generate_sql_query que consome a resposta do LLM em streaming.
+
+    `on_token` recebe cada trecho de texto gerado e `on_query` é chamado uma única vez,
+    assim que o campo "query" do JSON estiver completo e validado contra o schema, antes
+    da explicação terminar de ser gerada. Isso permite começar a executar a query em paralelo.
+    """
+    # A preparação faz I/O bloqueante (reflexão/consulta ao cache), então roda numa thread.
+    request = await asyncio.to_thread(
+        _prepare_generation,
+        db_uri, openai_api_key, model_name, question, custom_metadata, chat_history, connection_id, use_cache, llm
+    )
+    if request.cached:
+        if on_query:
+            on_query(request.cached.query)
+        return request.cached
+
+    prompt, parser = _get_chain_parts(layout=get_prompt_layout())
+
+    try:
+        result, error = await _astream_generation(request, prompt, parser, request.chain_inputs, on_query, on_token)
+        if error is not None:
+            retry_inputs = await asyncio.to_thread(_retry_inputs, request, error)
+            if retry_inputs is None:
+                raise error
+            result, error = await _astream_generation(request, prompt, parser, retry_inputs, on_query, on_token)
+            if error is not None:
+                raise error
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        _raise_friendly(e)
+
+    _store_result(request, result)
+    return result
+
+async def _astream_generation(
+    request: _GenerationRequest,
+    prompt: ChatPromptTemplate,
+    parser: PydanticOutputParser,
+    inputs: Dict[str, Any],
+    on_query: Optional[Callable[[str], None]],
+    on_token: Optional[Callable[[str], None]],
+) -> Tuple[Optional[SQLQuery], Optional[SQLValidationError]]:
+    """
+    Uma chamada ao LLM em streaming. A query é validada contra o schema assim que o campo "query"
+    do JSON fica completo: se for rejeitada, o streaming é interrompido sem esperar a explicação
+    e o erro é retornado; caso contrário, `on_query` recebe a query.
+    """
+    output = ""
+    query_sent = False
+    with span("prompt_build"):
+        prompt_value = await prompt.ainvoke(inputs)
+    async with allm_request_slot():
+        with span("llm", model=request.model_name, streaming=True) as llm_span:
+            started_at = time.perf_counter()
+            aggregated = None
+            stream = request.llm.astream(prompt_value)
+            try:
+                async for chunk in stream:
+                    # Os blocos são somados para obter o usage_metadata total da resposta
+                    aggregated = chunk if aggregated is None else aggregated + chunk
+                    text = chunk.content if isinstance(chunk.content, str) else ""
+                    if not text:
+                        continue
+                    if not output:
+                        llm_span.set(first_token_seconds=time.perf_counter() - started_at)
+                    output += text
+                    if on_token:
+                        on_token(text)
+                    if not query_sent:
+                        query = extract_streamed_query(output)
+                        if query is not None:
+                            llm_span.set(query_ready_seconds=time.perf_counter() - started_at)
+                            error = _validation_error(request.catalog, query)
+                            if error is not None:
+                                return None, error
+                            query_sent = True
+                            if on_query:
+                                on_query(query)
+            finally:
+                await stream.aclose()
+                llm_span.set(**_usage_attributes(aggregated))
+    with span("parse"):
+        result = parser.parse(output)
+
+    if not query_sent:
+        error = _validation_error(request.catalog, result.query)
+        if error is not None:
+            return None, error
+        if on_query:
+            on_query(result.query)
+    return result, None
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+def _get_background_loop() -> asyncio.AbstractEventLoop:
+    """Event loop compartilhado, numa thread daemon, para atender várias sessões sem bloquear threads."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="llm-event-loop", daemon=True).start()
+        return _loop
+
+class SQLGenerationHandle:
+    """
+    Controle de uma geração em andamento: permite esperar pela query (antes da
+    explicação terminar), acompanhar o texto parcial e cancelar a chamada ao LLM.
+    """
+
+    def __init__(self):
+        self.partial_output = ""
+        self.query: Optional[str] = None
+        self._query_ready = threading.Event()
+        self._future: Optional[Future] = None
+
+    def _on_token(self, text: str):
+        self.partial_output += text
+
+    def _on_query(self, query: str):
+        self.query = query
+        self._query_ready.set()
+
+    def wait_for_query(self, timeout: Optional[float] = None) -> str:
+        """Bloqueia até a query estar disponível. Propaga o erro se a geração falhar antes."""
+        self._future.add_done_callback(lambda _: self._query_ready.set())
+        if not self._query_ready.wait(timeout):
+            raise TimeoutError("A geração da query excedeu o tempo limite.")
+        if self.query is None:
+            return self.result().query
+        return self.query
+
+    def result(self, timeout: Optional[float] = None) -> SQLQuery:
+        """Retorna o SQLQuery completo (query + explicação)."""
+        return self._future.result(timeout)
+
+    def done(self) -> bool:
+        return self._future.done()
+
+    def cancel(self) -> bool:
+        """Cancela a geração; a requisição em streaming ao LLM é interrompida."""
+        return self._future.cancel()
+
+def start_sql_generation(**kwargs) -> SQLGenerationHandle:
+    """
+    Inicia agenerate_sql_query no event loop de fundo e retorna um SQLGenerationHandle.
+    Aceita os mesmos argumentos nomeados de generate_sql_query.
+    """
+    handle = SQLGenerationHandle()
+    coroutine = agenerate_sql_query(**kwargs, on_query=handle._on_query, on_token=handle._on_token)
+    # O event loop roda em outra thread: os spans da geração continuam no trace de quem chamou
+    coroutine = run_in_trace(current_trace(), coroutine)
+    handle._future = asyncio.run_coroutine_threadsafe(coroutine, _get_background_loop())
+    return handle
@@ -0,0 +1,325 @@
+# pipeline/cost_guard.py
+import json
+import logging
+import re
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import text
+
+from config import get_bool_config, get_config_value, get_float_config
+from utils.security import tokenize_sql_spans
+
+logger = logging.getLogger(__name__)
+
+# --- Guardrail de Custo ---
+# Antes de executar, a query gerada passa por um EXPLAIN do próprio banco (sem executá-la).
+# Estimativas acima de COST_GUARD_MAX_ROWS linhas ou COST_GUARD_MAX_COST (na unidade de custo
+# do dialeto: Postgres e SQL Server) geram um aviso (COST_GUARD=warn) ou bloqueiam a query
+# (COST_GUARD=reject). O EXPLAIN é uma ida extra ao banco em toda query, por isso vem desligado
+# (COST_GUARD=off) e deve ser ativado onde o risco de consultas caras compensa a latência.
+# Independentemente do modo, SELECTs sem limite e sem agregação recebem um LIMIT automático
+# (QUERY_AUTO_LIMIT), para que o banco pare de produzir linhas que nunca seriam lidas.
+
+AGGREGATE_FUNCTIONS = {
+    "COUNT", "SUM", "AVG", "MIN", "MAX", "TOTAL", "GROUP_CONCAT", "STRING_AGG", "ARRAY_AGG",
+    "JSON_AGG", "LISTAGG", "STDDEV", "VARIANCE", "MEDIAN",
+}
+# Palavras que, no nível principal da query, indicam que o resultado já é limitado
+_BOUNDING_WORDS = {"LIMIT", "TOP", "FETCH", "OFFSET"}
+_SET_OPERATIONS = {"UNION", "INTERSECT", "EXCEPT"}
+_LIMIT_DIALECTS = {"sqlite", "postgresql", "mysql", "mariadb"}
+_BACKSLASH_DIALECTS = {"mysql", "mariadb"}
+# Palavras que podem vir logo após o nome de uma tabela e não são um apelido
+_NOT_ALIASES = {
+    "WHERE", "JOIN", "INNER", "LEFT", "RIGHT", "FULL", "CROSS", "OUTER", "NATURAL", "ON", "USING",
+    "GROUP", "ORDER", "HAVING", "LIMIT", "OFFSET", "UNION", "INTERSECT", "EXCEPT", "WINDOW", "AS",
+}
+
+@dataclass
+class QueryPlan:
+    """Plano estimado pelo EXPLAIN, já resumido para o guardrail e para a UI."""
+    text: str
+    estimated_rows: Optional[float] = None
+    estimated_cost: Optional[float] = None
+    full_scans: List[str] = field(default_factory=list)
+
+@dataclass
+class CostVerdict:
+    """Veredito do guardrail de custo, levado até a UI junto com o resultado (attrs["cost_verdict"])."""
+    action: str = "ok"  # "ok", "warn" ou "reject"
+    query: str = ""  # Query efetivamente executada (com o LIMIT, se injetado)
+    reasons: List[str] = field(default_factory=list)
+    plan: str = ""
+    estimated_rows: Optional[float] = None
+    estimated_cost: Optional[float] = None
+    limit_injected: Optional[int] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+class QueryCostError(ValueError):
+    """Query bloqueada pelo guardrail de custo (COST_GUARD=reject)."""
+
+    def __init__(self, verdict: CostVerdict):
+        self.verdict = verdict
+        super().__init__("Consulta bloqueada por ser potencialmente cara demais para o banco: " + "; ".join(verdict.reasons))
+
+# --- Injeção de LIMIT ---
+@dataclass
+class QueryShape:
+    """Estrutura do nível principal da query, usada pela injeção de LIMIT e pela paginação."""
+    first_word: Optional[str] = None
+    single_statement: bool = True
+    bounded: bool = False  # LIMIT/TOP/FETCH/OFFSET, GROUP BY ou agregação no nível principal
+    has_limit: bool = False  # Apenas LIMIT/TOP/FETCH/OFFSET
+    has_order_by: bool = False
+    has_set_operation: bool = False
+    has_join: bool = False  # JOIN ou mais de uma tabela no FROM principal
+    tables: List[Optional[str]] = field(default_factory=list)  # Tabelas do FROM/JOIN (None = subquery)
+    select_end: Optional[int] = None  # Fim do primeiro SELECT [DISTINCT|ALL] do nível principal
+    end: int = 0  # Fim do último token relevante (antes de ';' e comentários finais)
+
+# Palavras que encerram a lista de tabelas do FROM principal
+_FROM_TERMINATORS = {"WHERE", "GROUP", "ORDER", "HAVING", "WINDOW", "LIMIT", "OFFSET", "FETCH"} | _SET_OPERATIONS
+
+def analyze_query(query: str, backslash_escapes: bool = False) -> QueryShape:
+    shape = QueryShape()
+    depth = 0
+    previous, previous_end = None, 0
+    after_semicolon = False
+    in_from = False
+    table_parts: Optional[List[str]] = None  # Partes (schema.tabela) do nome sendo lido após FROM/JOIN
+    for kind, token, start in tokenize_sql_spans(query, backslash_escapes):
+        if kind == "comment":
+            continue
+        if kind == "semicolon":
+            after_semicolon = True
+            continue
+        if after_semicolon:
+            shape.single_statement = False
+            break
+        shape.end = start + len(token)
+        word = token.upper() if kind == "word" else None
+        if shape.first_word is None:
+            shape.first_word = word
+        if table_parts is not None:
+            if kind in ("word", "quoted") and (not table_parts or previous == "."):
+                table_parts.append(token.strip('"`[]'))
+                previous, previous_end = None, shape.end
+                continue
+            if token == "." and table_parts:
+                previous, previous_end = ".", shape.end
+                continue
+            shape.tables.append(".".join(table_parts) if table_parts else None)
+            table_parts = None
+        if token == "(":
+            if depth == 0 and previous in AGGREGATE_FUNCTIONS:
+                shape.bounded = True
+            depth += 1
+        elif token == ")":
+            depth -= 1
+        elif depth == 0 and token == "," and in_from:
+            shape.has_join = True
+            table_parts = []
+        elif depth == 0 and word:
+            if word in ("FROM", "JOIN"):
+                shape.has_join = shape.has_join or word == "JOIN"
+                in_from = True
+                table_parts = []
+            elif word in _FROM_TERMINATORS:
+                in_from = False
+            if word in _BOUNDING_WORDS:
+                shape.bounded = shape.has_limit = True
+            elif word == "BY" and previous == "GROUP":
+                shape.bounded = True
+            elif word == "BY" and previous == "ORDER":
+                shape.has_order_by = True
+            elif word in _SET_OPERATIONS:
+                shape.has_set_operation = True
+            elif word == "SELECT" and shape.select_end is None:
+                shape.select_end = shape.end
+            elif word in ("DISTINCT", "ALL") and previous == "SELECT" and shape.select_end == previous_end:
+                shape.select_end = shape.end
+        previous, previous_end = word, shape.end
+    if table_parts is not None:
+        shape.tables.append(".".join(table_parts) if table_parts else None)
+    return shape
+
+def inject_limit(query: str, dialect: str, limit: int) -> Optional[str]:
+    """
+    Acrescenta um limite de `limit` linhas a um SELECT sem limite e sem agregação, na sintaxe
+    do dialeto (LIMIT, ou TOP/FETCH no SQL Server). Retorna None se a query não se qualificar.
+    """
+    shape = analyze_query(query, dialect in _BACKSLASH_DIALECTS)
+    if not shape.single_statement or shape.first_word not in ("SELECT", "WITH") or shape.bounded:
+        return None
+    end = shape.end
+    if dialect in _LIMIT_DIALECTS:
+        return f"{query[:end]} LIMIT {limit}{query[end:]}"
+    if dialect == "mssql" and not shape.has_set_operation:
+        if shape.has_order_by:
+            return f"{query[:end]} OFFSET 0 ROWS FETCH NEXT {limit} ROWS ONLY{query[end:]}"
+        if shape.select_end is not None:
+            return f"{query[:shape.select_end]} TOP ({limit}){query[shape.select_end:]}"
+    return None
+
+# --- EXPLAIN por Dialeto ---
+def _table_aliases(query: str, tables: List[str]) -> Dict[str, str]:
+    """Mapeia apelidos (e os próprios nomes) para as tabelas, como aparecem no plano do SQLite."""
+    known = {table.lower(): table for table in tables}
+    aliases = dict(known)
+    tokens = [(kind, token) for kind, token, _ in tokenize_sql_spans(query) if kind != "comment"]
+    for index, (kind, token) in enumerate(tokens):
+        table = known.get(token.strip('"`[]').lower()) if kind in ("word", "quoted") else None
+        if table is None:
+            continue
+        following = tokens[index + 1:index + 3]
+        if following and following[0][1].upper() == "AS":
+            following = following[1:]
+        if following and following[0][0] == "word" and following[0][1].upper() not in _NOT_ALIASES:
+            aliases[following[0][1].lower()] = table
+    return aliases
+
+def _sqlite_table_rows(connection, table: str) -> Optional[float]:
+    """Linhas da tabela segundo o ANALYZE (sqlite_stat1) ou, sem ele, pelo maior rowid (busca O(log n))."""
+    try:
+        stat = connection.execute(text("SELECT stat FROM sqlite_stat1 WHERE tbl = :table LIMIT 1"), {"table": table}).scalar()
+        if stat:
+            return float(stat.split()[0])
+    except Exception:
+        pass  # Banco sem ANALYZE: a tabela sqlite_stat1 não existe
+    try:
+        return float(connection.execute(text(f'SELECT MAX(rowid) FROM "{table}"')).scalar() or 0)
+    except Exception:
+        return None  # Tabela WITHOUT ROWID ou visão
+
+def _explain_sqlite(connection, query: str) -> QueryPlan:
+    rows = connection.execute(text("EXPLAIN QUERY PLAN " + query)).fetchall()
+    tables = [row[0] for row in connection.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'"))]
+    aliases = _table_aliases(query, tables)
+    depths: Dict[int, int] = {}
+    lines = []
+    # Laços aninhados do mesmo nível multiplicam as linhas lidas (ex: produto cartesiano)
+    loops: Dict[int, float] = {}
+    full_scans = []
+    for node_id, parent, _, detail in rows:
+        depths[node_id] = depths.get(parent, -1) + 1
+        lines.append("  " * depths[node_id] + detail)
+        match = re.match(r"(SCAN|SEARCH) (\S+)", detail)
+        if not match:
+            continue
+        factor = 1.0
+        table = aliases.get(match.group(2).lower())
+        if match.group(1) == "SCAN" and table:
+            factor = _sqlite_table_rows(connection, table) or 1.0
+            full_scans.append(table)
+        loops[parent] = loops.get(parent, 1.0) * max(factor, 1.0)
+    return QueryPlan(text="\n".join(lines), estimated_rows=sum(loops.values()) if loops else None,
+                     full_scans=full_scans)
+
+def _explain_postgresql(connection, query: str) -> QueryPlan:
+    raw = connection.execute(text("EXPLAIN (FORMAT JSON) " + query)).scalar()
+    root = (json.loads(raw) if isinstance(raw, str) else raw)[0]["Plan"]
+    lines, full_scans = [], []
+
+    def walk(node: Dict[str, Any], depth: int):
+        relation = f" em {node['Relation Name']}" if "Relation Name" in node else ""
+        lines.append(f"{'  ' * depth}{node['Node Type']}{relation} (custo={node.get('Total Cost')}, linhas={node.get('Plan Rows')})")
+        if node["Node Type"] == "Seq Scan":
+            full_scans.append(node.get("Relation Name", "?"))
+        for child in node.get("Plans", []):
+            walk(child, depth + 1)
+
+    walk(root, 0)
+    return QueryPlan(text="\n".join(lines), estimated_rows=root.get("Plan Rows"),
+                     estimated_cost=root.get("Total Cost"), full_scans=full_scans)
+
+def _explain_mysql(connection, query: str) -> QueryPlan:
+    result = connection.execute(text("EXPLAIN " + query))
+    columns = list(result.keys())
+    lines, full_scans = [], []
+    loops: Dict[Any, float] = {}
+    for row in result:
+        item = dict(zip(columns, row))
+        lines.append(f"{item.get('select_type')} {item.get('table')}: tipo={item.get('type')}, "
+                     f"índice={item.get('key')}, linhas={item.get('rows')}")
+        if item.get("type") == "ALL":
+            full_scans.append(str(item.get("table")))
+        rows = float(item.get("rows") or 1) * float(item.get("filtered") or 100) / 100
+        loops[item.get("id")] = loops.get(item.get("id"), 1.0) * max(rows, 1.0)
+    return QueryPlan(text="\n".join(lines), estimated_rows=sum(loops.values()) if loops else None,
+                     full_scans=full_scans)
+
+def _explain_mssql(connection, query: str) -> QueryPlan:
+    connection.exec_driver_sql("SET SHOWPLAN_XML ON")
+    try:
+        xml = connection.exec_driver_sql(query).scalar() or ""
+    finally:
+        connection.exec_driver_sql("SET SHOWPLAN_XML OFF")
+    statement = dict(re.findall(r'(\w+)="([^"]*)"', (re.search(r"<StmtSimple\b([^>]*)>", xml) or [None, ""])[1]))
+    lines, full_scans = [], []
+    for attributes in re.findall(r"<RelOp\b([^>]*)>", xml):
+        operator = dict(re.findall(r'(\w+)="([^"]*)"', attributes))
+        lines.append(f"{operator.get('PhysicalOp')} (custo={operator.get('EstimatedTotalSubtreeCost')}, "
+                     f"linhas={operator.get('EstimateRows')})")
+        if operator.get("PhysicalOp") in ("Table Scan", "Clustered Index Scan", "Index Scan"):
+            full_scans.append(operator.get("PhysicalOp"))
+    cost = statement.get("StatementSubTreeCost")
+    rows = statement.get("StatementEstRows")
+    return QueryPlan(text="\n".join(lines), estimated_rows=float(rows) if rows else None,
+                     estimated_cost=float(cost) if cost else None, full_scans=full_scans)
+
+_EXPLAINERS: Dict[str, Callable[[Any, str], QueryPlan]] = {
+    "sqlite": _explain_sqlite,
+    "postgresql": _explain_postgresql,
+    "mysql": _explain_mysql,
+    "mariadb": _explain_mysql,
+    "mssql": _explain_mssql,
+}
+
+def get_cost_guard_mode() -> str:
+    """"off" (padrão), "warn" ou "reject"."""
+    mode = str(get_config_value("COST_GUARD", "off")).lower()
+    return mode if mode in ("warn", "reject") else "off"
+
+def check_query_cost(connection, query: str, max_rows: Optional[int] = None) -> CostVerdict:
+    """
+    Injeta o LIMIT (se couber) e avalia o plano estimado da query na conexão informada.
+    Falhas do EXPLAIN (ex: falta de permissão de SHOWPLAN) não bloqueiam a execução.
+    """
+    dialect = connection.dialect.name
+    verdict = CostVerdict(query=query)
+    if max_rows and get_bool_config("QUERY_AUTO_LIMIT", True):
+        # Uma linha a mais que o limite de leitura, para que o truncamento continue sendo detectado
+        limited = inject_limit(query, dialect, max_rows + 1)
+        if limited:
+            verdict.query = limited
+            verdict.limit_injected = max_rows
+
+    mode = get_cost_guard_mode()
+    explain = _EXPLAINERS.get(dialect)
+    if mode == "off" or explain is None:
+        return verdict
+    try:
+        plan = explain(connection, verdict.query)
+    except Exception as e:
+        logger.info("EXPLAIN indisponível (%s): %s", dialect, e)
+        connection.rollback()  # No Postgres, o erro invalidaria a transação da execução
+        verdict.plan = f"Plano indisponível: {e}"
+        return verdict
+
+    verdict.plan = plan.text
+    verdict.estimated_rows = plan.estimated_rows
+    verdict.estimated_cost = plan.estimated_cost
+    max_estimated_rows = get_float_config("COST_GUARD_MAX_ROWS", 10_000_000)
+    max_cost = get_float_config("COST_GUARD_MAX_COST", 1_000_000)
+    if max_estimated_rows and plan.estimated_rows is not None and plan.estimated_rows > max_estimated_rows:
+        verdict.reasons.append(f"~{plan.estimated_rows:,.0f} linhas estimadas (limite: {max_estimated_rows:,.0f})")
+    if max_cost and plan.estimated_cost is not None and plan.estimated_cost > max_cost:
+        verdict.reasons.append(f"custo estimado {plan.estimated_cost:,.0f} (limite: {max_cost:,.0f})")
+    if verdict.reasons and plan.full_scans:
+        verdict.reasons.append(f"leitura completa de: {', '.join(dict.fromkeys(plan.full_scans))}")
+    if verdict.reasons:
+        verdict.action = mode
+    return verdict
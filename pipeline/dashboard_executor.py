@@ -0,0 +1,92 @@
+# pipeline/dashboard_executor.py
+import contextvars
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, Optional, Union
+
+import pandas as pd
+
+from config import get_int_config
+from pipeline.db_executor import QueryResultStream
+
+# --- Execução Concorrente das Métricas de um Dashboard ---
+# Um único pool de threads por processo limita o total de queries simultâneas, e um
+# semáforo por conexão evita que um dashboard grande sobrecarregue um mesmo banco.
+
+@dataclass
+class MetricResult:
+    metric_name: str
+    result_df: Optional[pd.DataFrame] = None
+    error: Optional[str] = None
+    elapsed: float = 0.0   # Tempo de execução da métrica (s)
+    waited: float = 0.0    # Tempo aguardando vaga no limite da conexão (s)
+    partial: bool = False  # True quando result_df é apenas o primeiro bloco do resultado
+
+_executor: Optional[ThreadPoolExecutor] = None
+_semaphores: Dict[str, threading.BoundedSemaphore] = {}
+_lock = threading.Lock()
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=get_int_config("DASHBOARD_MAX_WORKERS", 8),
+                thread_name_prefix="dashboard",
+            )
+        return _executor
+
+def get_connection_semaphore(connection_key: str) -> threading.BoundedSemaphore:
+    """Retorna o semáforo que limita as queries simultâneas de uma conexão."""
+    with _lock:
+        if connection_key not in _semaphores:
+            _semaphores[connection_key] = threading.BoundedSemaphore(
+                get_int_config("DASHBOARD_CONNECTION_CONCURRENCY", 4)
+            )
+        return _semaphores[connection_key]
+
+MetricJob = Callable[[], Union[pd.DataFrame, QueryResultStream]]
+
+def _run_job(connection_key: str, metric_name: str, job: MetricJob, report: Callable[[MetricResult], None]):
+    semaphore = get_connection_semaphore(connection_key)
+    queued_at = time.perf_counter()
+    with semaphore:
+        started_at = time.perf_counter()
+        waited = started_at - queued_at
+        try:
+            result = job()
+            if isinstance(result, QueryResultStream):
+                # Entrega o primeiro bloco para o card ser exibido antes do restante chegar.
+                with result:
+                    report(MetricResult(metric_name, result_df=result.first_page, partial=True,
+                                        elapsed=time.perf_counter() - started_at, waited=waited))
+                    result = result.collect()
+            report(MetricResult(metric_name, result_df=result,
+                                elapsed=time.perf_counter() - started_at, waited=waited))
+        except Exception as e:
+            report(MetricResult(metric_name, error=str(e),
+                                elapsed=time.perf_counter() - started_at, waited=waited))
+
+def run_metrics_concurrently(connection_key: str, jobs: Dict[str, MetricJob]) -> Iterator[MetricResult]:
+    """
+    Executa todas as métricas em paralelo e entrega cada resultado assim que fica pronto.
+    Cada job é uma função sem argumentos que retorna o DataFrame da métrica ou um
+    QueryResultStream; no segundo caso, o primeiro bloco é entregue antes (partial=True)
+    e o resultado completo depois. Erros são capturados e devolvidos no campo `error`
+    em vez de interromper as demais.
+    """
+    executor = _get_executor()
+    events: "queue.Queue[MetricResult]" = queue.Queue()
+    for name, job in jobs.items():
+        # Copia o contexto para que os spans das threads entrem no trace de quem chamou
+        executor.submit(contextvars.copy_context().run, _run_job, connection_key, name, job, events.put)
+
+    completed = 0
+    while completed < len(jobs):
+        metric_result = events.get()
+        if not metric_result.partial:
+            completed += 1
+        yield metric_result
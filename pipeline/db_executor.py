@@ -1,22 +1,189 @@
+from contextlib import ExitStack
+from typing import Iterator, List, Optional
+
 import pandas as pd
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
+from config import get_int_config
+from pipeline.cost_guard import CostVerdict, QueryCostError, check_query_cost
+from pipeline.engine_registry import pooled_connection
+from pipeline.query_control import QueryCancelledError, QueryTimeoutError, StatementHandle, translate_error
 from utils.security import is_query_safe
+from utils.tracing import span
 
-def execute_sql_query(db_uri: str, query: str) -> pd.DataFrame:
+class QueryResultStream:
     """
-    Conecta-se ao banco de dados, executa uma query SQL de LEITURA e retorna
-    o resultado como um DataFrame do Pandas.
+    Resultado de uma query lido em blocos a partir de um cursor no servidor.
+
+    O primeiro bloco (`first_page`) é buscado na abertura, para que a UI possa exibi-lo
+    imediatamente; os demais são lidos sob demanda ao iterar ou chamar `collect()`.
+    A leitura para ao atingir `max_rows` linhas ou `max_bytes` bytes, marcando `truncated`.
+    Antes da execução, a query passa pelo guardrail de custo (ver pipeline/cost_guard.py);
+    o veredito fica em `cost_verdict` e em `attrs["cost_verdict"]` dos DataFrames.
+    Com uma `handle`, a query pode ser cancelada de outra thread enquanto o stream está aberto.
+    """
+
+    def __init__(self, db_uri: str, query: str, chunk_size: int, max_rows: int, max_bytes: int,
+                 handle: Optional[StatementHandle] = None):
+        self.chunk_size = chunk_size
+        self.handle = handle
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.rows_fetched = 0
+        self.bytes_fetched = 0
+        self.truncated = False
+        self._chunks: List[pd.DataFrame] = []
+        self._exhausted = False
+        self._stack = ExitStack()
+        self.cost_verdict: Optional[CostVerdict] = None
+        try:
+            connection = self._stack.enter_context(pooled_connection(db_uri))
+            if handle is not None:
+                self._stack.enter_context(handle.bound(connection))
+            with span("cost_guard") as guard_span:
+                self.cost_verdict = check_query_cost(connection, query, max_rows)
+                guard_span.set(action=self.cost_verdict.action, estimated_rows=self.cost_verdict.estimated_rows,
+                               limit_injected=self.cost_verdict.limit_injected)
+            if self.cost_verdict.action == "reject":
+                raise QueryCostError(self.cost_verdict)
+            # stream_results usa cursor no servidor (Postgres/MySQL); nos demais dialetos,
+            # o fetchmany ainda evita materializar o resultado inteiro de uma vez.
+            self._result = connection.execution_options(
+                stream_results=True, max_row_buffer=chunk_size
+            ).execute(text(self.cost_verdict.query))
+            self.columns = list(self._result.keys())
+            self.first_page = self._fetch_chunk()
+            if self.first_page is None:
+                self.first_page = pd.DataFrame(columns=self.columns)
+            self.first_page.attrs["cost_verdict"] = self.cost_verdict.to_dict()
+        except Exception:
+            self.close()
+            raise
+
+    def _fetch_chunk(self) -> Optional[pd.DataFrame]:
+        if self._exhausted:
+            return None
+        remaining = self.max_rows - self.rows_fetched
+        rows = self._result.fetchmany(min(self.chunk_size, remaining)) if remaining > 0 else []
+        if not rows:
+            # Atingiu o limite de linhas: verifica se ainda havia dados para marcar o truncamento.
+            if remaining <= 0 and self._result.fetchone() is not None:
+                self.truncated = True
+            self._finish()
+            return None
+
+        chunk = pd.DataFrame.from_records(rows, columns=self.columns, coerce_float=True)
+        self.rows_fetched += len(chunk)
+        self.bytes_fetched += int(chunk.memory_usage(deep=True).sum())
+        self._chunks.append(chunk)
+        if self.bytes_fetched >= self.max_bytes:
+            self.truncated = self._result.fetchone() is not None
+            self._finish()
+        return chunk
+
+    def _finish(self):
+        self._exhausted = True
+        self.close()
+
+    def __iter__(self) -> Iterator[pd.DataFrame]:
+        """Percorre todos os blocos, começando pelo primeiro já carregado."""
+        index = 0
+        while True:
+            if index < len(self._chunks):
+                yield self._chunks[index]
+                index += 1
+            elif self._fetch_chunk() is None:
+                return
+
+    def collect(self) -> pd.DataFrame:
+        """Lê o restante do resultado (respeitando os limites) e retorna um único DataFrame."""
+        with span("fetch") as fetch_span:
+            try:
+                for _ in self:
+                    pass
+            except Exception as e:
+                translated = translate_error(e, self.handle)
+                if translated is None:
+                    raise
+                raise translated from e
+            fetch_span.set(rows=self.rows_fetched, bytes=self.bytes_fetched, truncated=self.truncated)
+        if not self._chunks:
+            result_df = self.first_page
+        elif len(self._chunks) == 1:
+            result_df = self._chunks[0]
+        else:
+            result_df = pd.concat(self._chunks, ignore_index=True)
+        result_df.attrs["truncated"] = self.truncated
+        result_df.attrs["rows_fetched"] = self.rows_fetched
+        if self.cost_verdict is not None:
+            result_df.attrs["cost_verdict"] = self.cost_verdict.to_dict()
+        return result_df
+
+    def close(self):
+        """Libera o cursor e devolve a conexão ao pool."""
+        self._stack.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def stream_sql_query(
+    db_uri: str,
+    query: str,
+    chunk_size: Optional[int] = None,
+    max_rows: Optional[int] = None,
+    max_bytes: Optional[int] = None,
+    handle: Optional[StatementHandle] = None,
+) -> QueryResultStream:
+    """
+    Executa uma query SQL de LEITURA em modo streaming e retorna um QueryResultStream
+    com o primeiro bloco já disponível. Os limites padrão vêm de QUERY_CHUNK_SIZE,
+    QUERY_MAX_ROWS e QUERY_MAX_BYTES; o tempo limite, de QUERY_TIMEOUT (aplicado pelo banco).
     """
     # Validação de segurança básica (redundante com o prompt, mas essencial)
-    if not is_query_safe(query):
+    with span("guardrail") as guardrail_span:
+        is_safe = is_query_safe(query)
+        guardrail_span.set(safe=is_safe, query_chars=len(query))
+    if not is_safe:
         # Levanta um erro específico que a UI pode capturar e exibir de forma amigável.
         raise ValueError("Operação não permitida. Apenas queries de consulta que não modificam dados são autorizadas.")
-        
+
     try:
-        engine = create_engine(db_uri)
-        with engine.connect() as connection:
-            result_df = pd.read_sql_query(sql=text(query), con=connection)
-        return result_df
+        # Reutiliza a engine (e o pool de conexões) compartilhada do processo.
+        # O span "execute" cobre o envio da query até a chegada do primeiro bloco.
+        with span("execute") as execute_span:
+            stream = QueryResultStream(
+                db_uri,
+                query,
+                chunk_size=chunk_size or get_int_config("QUERY_CHUNK_SIZE", 1000),
+                max_rows=max_rows or get_int_config("QUERY_MAX_ROWS", 100_000),
+                max_bytes=max_bytes or get_int_config("QUERY_MAX_BYTES", 200 * 1024 * 1024),
+                handle=handle,
+            )
+            execute_span.set(first_page_rows=len(stream.first_page))
+        return stream
+    except QueryCostError:
+        # Bloqueio do guardrail de custo: a mensagem já é adequada para a UI
+        raise
     except Exception as e:
-        # Retorna o erro de forma que a UI possa exibi-lo
-        raise RuntimeError(f"Erro ao executar a query: {e}") from e
\ No newline at end of file
+        # Tempo limite e cancelamento também têm mensagens próprias
+        raise translate_error(e, handle) or RuntimeError(f"Erro ao executar a query: {e}") from e
+
+def execute_sql_query(db_uri: str, query: str, max_rows: Optional[int] = None) -> pd.DataFrame:
+    """
+    Conecta-se ao banco de dados, executa uma query SQL de LEITURA e retorna
+    o resultado como um DataFrame do Pandas.
+    O resultado é limitado por QUERY_MAX_ROWS/QUERY_MAX_BYTES; quando cortado,
+    `result_df.attrs["truncated"]` é True.
+    """
+    # A validação de segurança (ValueError) e os erros de abertura (RuntimeError)
+    # acontecem dentro do stream_sql_query.
+    with stream_sql_query(db_uri, query, max_rows=max_rows) as stream:
+        try:
+            return stream.collect()
+        except (QueryCancelledError, QueryTimeoutError):
+            raise
+        except Exception as e:
+            # Retorna o erro de forma que a UI possa exibi-lo
+            raise RuntimeError(f"Erro ao executar a query: {e}") from e
@@ -0,0 +1,160 @@
+# pipeline/engine_registry.py
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+
+from config import get_bool_config, get_config_value, get_float_config, get_int_config
+from pipeline.query_control import install_statement_controls
+
+# --- Registro de Engines Compartilhado ---
+# O módulo é importado uma única vez por processo, então este dicionário sobrevive
+# aos reruns do Streamlit e é compartilhado entre todas as sessões (e pelo agendador).
+_engines: Dict[str, Engine] = {}
+_stats: Dict[str, Dict[str, float]] = {}
+_lock = threading.Lock()
+
+# Argumentos de conexão padrão por dialeto. Podem ser sobrescritos pela configuração
+# DB_CONNECT_ARGS (JSON no formato {"postgresql": {"connect_timeout": 5}}).
+def _default_connect_args(dialect: str) -> Dict[str, Any]:
+    connect_timeout = get_int_config("DB_CONNECT_TIMEOUT", 10)
+    defaults = {
+        # O pool entrega a mesma conexão para threads diferentes ao longo do tempo.
+        "sqlite": {"check_same_thread": False},
+        "postgresql": {"connect_timeout": connect_timeout},
+        "mysql": {"connection_timeout": connect_timeout},
+        "mssql": {"timeout": connect_timeout},
+    }
+    return dict(defaults.get(dialect, {}))
+
+def _connect_args_for(dialect: str) -> Dict[str, Any]:
+    connect_args = _default_connect_args(dialect)
+    overrides = get_config_value("DB_CONNECT_ARGS")
+    if overrides:
+        if isinstance(overrides, str):
+            overrides = json.loads(overrides)
+        connect_args.update(overrides.get(dialect, {}))
+    return connect_args
+
+def _engine_kwargs(db_uri: str) -> Dict[str, Any]:
+    """Monta os argumentos do create_engine a partir da configuração do pool."""
+    url = make_url(db_uri)
+    dialect = url.get_backend_name()
+    kwargs: Dict[str, Any] = {
+        "pool_pre_ping": get_bool_config("DB_POOL_PRE_PING", True),
+        "connect_args": _connect_args_for(dialect),
+    }
+
+    # SQLite em memória usa um pool de conexão única por thread, que não aceita
+    # parâmetros de dimensionamento.
+    is_memory_sqlite = dialect == "sqlite" and url.database in (None, "", ":memory:")
+    if not is_memory_sqlite:
+        kwargs.update({
+            "pool_size": get_int_config("DB_POOL_SIZE", 5),
+            "max_overflow": get_int_config("DB_MAX_OVERFLOW", 10),
+            "pool_timeout": get_float_config("DB_POOL_TIMEOUT", 30),
+            "pool_recycle": get_int_config("DB_POOL_RECYCLE", 1800),
+        })
+    return kwargs
+
+def _new_stats() -> Dict[str, float]:
+    return {
+        "engine_hits": 0,
+        "engine_misses": 0,
+        "checkouts": 0,
+        "new_connections": 0,
+        "wait_seconds_total": 0.0,
+        "wait_seconds_max": 0.0,
+    }
+
+def _attach_pool_listeners(engine: Engine, stats: Dict[str, float]):
+    """Conta conexões físicas novas (miss do pool) e checkouts totais."""
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        with _lock:
+            stats["new_connections"] += 1
+
+    @event.listens_for(engine, "checkout")
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        with _lock:
+            stats["checkouts"] += 1
+
+def _masked(db_uri: str) -> str:
+    return make_url(db_uri).render_as_string(hide_password=True)
+
+def get_engine(db_uri: str) -> Engine:
+    """
+    Retorna a engine compartilhada para a URI informada, criando-a (com pool)
+    apenas na primeira chamada do processo.
+    """
+    engine = _engines.get(db_uri)
+    if engine is not None:
+        with _lock:
+            _stats[db_uri]["engine_hits"] += 1
+        return engine
+
+    with _lock:
+        engine = _engines.get(db_uri)
+        if engine is None:
+            engine = create_engine(db_uri, **_engine_kwargs(db_uri))
+            stats = _new_stats()
+            _attach_pool_listeners(engine, stats)
+            install_statement_controls(engine)
+            _engines[db_uri] = engine
+            _stats[db_uri] = stats
+            stats["engine_misses"] += 1
+        else:
+            _stats[db_uri]["engine_hits"] += 1
+    return engine
+
+@contextmanager
+def pooled_connection(db_uri: str):
+    """
+    Abre uma conexão a partir do pool compartilhado, registrando o tempo de espera
+    pelo checkout (inclui o handshake quando o pool precisa abrir uma conexão nova).
+    """
+    engine = get_engine(db_uri)
+    start = time.perf_counter()
+    connection = engine.connect()
+    waited = time.perf_counter() - start
+    with _lock:
+        stats = _stats[db_uri]
+        stats["wait_seconds_total"] += waited
+        stats["wait_seconds_max"] = max(stats["wait_seconds_max"], waited)
+    try:
+        yield connection
+    finally:
+        connection.close()
+
+def dispose_engine(db_uri: str):
+    """Fecha todas as conexões do pool de uma URI e a remove do registro."""
+    with _lock:
+        engine = _engines.pop(db_uri, None)
+        _stats.pop(db_uri, None)
+    if engine is not None:
+        engine.dispose()
+
+def get_pool_stats() -> Dict[str, Dict[str, float]]:
+    """
+    Retorna as estatísticas de uso por URI (com a senha mascarada): reuso de engine,
+    hits/misses do pool de conexões e tempo de espera por checkout.
+    """
+    report = {}
+    with _lock:
+        for db_uri, stats in _stats.items():
+            engine = _engines[db_uri]
+            checkouts = stats["checkouts"]
+            pool_misses = stats["new_connections"]
+            report[_masked(db_uri)] = {
+                **stats,
+                "pool_hits": max(checkouts - pool_misses, 0),
+                "pool_misses": pool_misses,
+                "pool_hit_rate": (checkouts - pool_misses) / checkouts if checkouts else 0.0,
+                "wait_seconds_avg": stats["wait_seconds_total"] / checkouts if checkouts else 0.0,
+                "pool_status": engine.pool.status(),
+            }
+    return report
@@ -0,0 +1,173 @@
+# pipeline/generation_cache.py
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from config import get_bool_config, get_config_value, get_float_config, get_int_config
+
+# --- Cache Persistente de Geração NL→SQL ---
+# Guarda a query gerada pelo LLM para cada combinação de conexão, pergunta normalizada,
+# impressão digital do schema, contexto de negócio, modelo e histórico recente.
+# Um hit dispensa completamente a chamada ao LLM.
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS generation_cache (
+    cache_key TEXT PRIMARY KEY,
+    connection_id TEXT NOT NULL,
+    schema_fingerprint TEXT NOT NULL,
+    metadata_hash TEXT NOT NULL,
+    model_name TEXT NOT NULL,
+    question TEXT NOT NULL,
+    query TEXT NOT NULL,
+    explanation TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_used_at REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_generation_cache_connection ON generation_cache (connection_id);
+CREATE INDEX IF NOT EXISTS idx_generation_cache_lru ON generation_cache (last_used_at);
+"""
+
+_lock = threading.Lock()
+_initialized_paths = set()
+_stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "invalidations": 0}
+
+def _cache_path() -> str:
+    return get_config_value("GENERATION_CACHE_PATH", "data/generation_cache.db")
+
+@contextmanager
+def _connect():
+    """Abre uma conexão curta com o arquivo do cache (criando o schema na primeira vez)."""
+    path = _cache_path()
+    connection = sqlite3.connect(path, timeout=5)
+    try:
+        if path not in _initialized_paths:
+            with _lock:
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.executescript(_SCHEMA)
+                _initialized_paths.add(path)
+        with connection:
+            yield connection
+    finally:
+        connection.close()
+
+def _bump(counter: str, amount: int = 1):
+    with _lock:
+        _stats[counter] += amount
+
+def is_generation_cache_enabled() -> bool:
+    return get_bool_config("GENERATION_CACHE", True)
+
+def normalize_question(question: str) -> str:
+    """Minúsculas, sem acentos, sem pontuação nas bordas e com espaços colapsados."""
+    normalized = unicodedata.normalize("NFKD", question.lower())
+    normalized = "".join(ch for ch in normalized if not unicodedata.combining(ch))
+    normalized = re.sub(r"\s+", " ", normalized)
+    return normalized.strip(" ?!.;,")
+
+def hash_text(text: str) -> str:
+    return hashlib.sha256((text or "").encode()).hexdigest()
+
+def build_cache_key(
+    connection_id: str,
+    question: str,
+    schema_fingerprint: str,
+    metadata_hash: str,
+    model_name: str,
+    history_context: List[str],
+) -> str:
+    """Combina todos os componentes que influenciam a resposta do LLM numa chave única."""
+    payload = json.dumps([
+        connection_id,
+        normalize_question(question),
+        schema_fingerprint,
+        metadata_hash,
+        model_name,
+        [normalize_question(item) for item in history_context],
+    ])
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def get_cached_generation(cache_key: str) -> Optional[Dict[str, str]]:
+    """Retorna {'query', 'explanation'} se houver uma entrada válida (dentro do TTL)."""
+    ttl = get_float_config("GENERATION_CACHE_TTL", 7 * 24 * 60 * 60)
+    now = time.time()
+    with _connect() as connection:
+        row = connection.execute(
+            "SELECT query, explanation, created_at FROM generation_cache WHERE cache_key = ?",
+            (cache_key,),
+        ).fetchone()
+        if row and now - row[2] > ttl:
+            connection.execute("DELETE FROM generation_cache WHERE cache_key = ?", (cache_key,))
+            _bump("evictions")
+            row = None
+        if row is None:
+            _bump("misses")
+            return None
+        connection.execute(
+            "UPDATE generation_cache SET last_used_at = ?, hits = hits + 1 WHERE cache_key = ?",
+            (now, cache_key),
+        )
+    _bump("hits")
+    return {"query": row[0], "explanation": row[1]}
+
+def store_generation(
+    cache_key: str,
+    connection_id: str,
+    schema_fingerprint: str,
+    metadata_hash: str,
+    model_name: str,
+    question: str,
+    query: str,
+    explanation: str,
+):
+    """
+    Salva uma geração e aplica a política de evicção: remove entradas da mesma conexão
+    com schema/contexto diferentes e, acima de GENERATION_CACHE_MAX_ENTRIES, as menos
+    usadas recentemente (LRU).
+    """
+    max_entries = get_int_config("GENERATION_CACHE_MAX_ENTRIES", 5000)
+    now = time.time()
+    with _connect() as connection:
+        stale = connection.execute(
+            "DELETE FROM generation_cache WHERE connection_id = ? AND (schema_fingerprint != ? OR metadata_hash != ?)",
+            (connection_id, schema_fingerprint, metadata_hash),
+        ).rowcount
+        connection.execute(
+            "INSERT OR REPLACE INTO generation_cache "
+            "(cache_key, connection_id, schema_fingerprint, metadata_hash, model_name, question, query, explanation, created_at, last_used_at, hits) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0)",
+            (cache_key, connection_id, schema_fingerprint, metadata_hash, model_name,
+             normalize_question(question), query, explanation, now, now),
+        )
+        evicted = connection.execute(
+            "DELETE FROM generation_cache WHERE cache_key IN ("
+            "SELECT cache_key FROM generation_cache ORDER BY last_used_at DESC LIMIT -1 OFFSET ?)",
+            (max_entries,),
+        ).rowcount
+    _bump("stores")
+    _bump("invalidations", stale)
+    _bump("evictions", evicted)
+
+def invalidate_generation_cache(connection_id: Optional[str] = None):
+    """Remove as gerações de uma conexão (ou de todas, se connection_id for None)."""
+    with _connect() as connection:
+        if connection_id is None:
+            removed = connection.execute("DELETE FROM generation_cache").rowcount
+        else:
+            removed = connection.execute(
+                "DELETE FROM generation_cache WHERE connection_id = ?", (connection_id,)
+            ).rowcount
+    _bump("invalidations", removed)
+
+def get_generation_cache_stats() -> Dict[str, float]:
+    """Retorna hits, misses, taxa de acerto, evicções e o tamanho atual do cache."""
+    with _connect() as connection:
+        entries = connection.execute("SELECT COUNT(*) FROM generation_cache").fetchone()[0]
+    lookups = _stats["hits"] + _stats["misses"]
+    return dict(_stats, entries=entries, hit_rate=_stats["hits"] / lookups if lookups else 0.0)
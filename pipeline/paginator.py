@@ -0,0 +1,317 @@
+# pipeline/paginator.py
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+from sqlalchemy import inspect, text
+
+from config import get_int_config
+from pipeline.cost_guard import QueryCostError, QueryShape, analyze_query, check_query_cost
+from pipeline.engine_registry import get_engine, pooled_connection
+from pipeline.query_control import StatementHandle, translate_error
+from utils.security import is_query_safe
+from utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+# --- Paginação de Resultados ---
+# Em vez de ler o resultado inteiro para a sessão, a query gerada é envolvida numa query
+# de página, buscada sob demanda (uma conexão do pool por página, sem cursor aberto entre
+# os reruns do Streamlit). Quando a query lê uma única tabela, sem ordenação nem limite,
+# a paginação é por chave (keyset: WHERE pk > último valor ORDER BY pk), que custa o mesmo
+# em qualquer página; nos demais casos, usa LIMIT/OFFSET (OFFSET/FETCH no SQL Server),
+# preservando a ordenação da query. A página seguinte é pré-carregada em segundo plano.
+
+_KEYSET_DIALECTS = {"sqlite", "postgresql", "mysql", "mariadb", "mssql"}
+_BACKSLASH_DIALECTS = {"mysql", "mariadb"}
+# Dialetos cujo EXPLAIN estima as linhas devolvidas pela query (e não as linhas lidas)
+_OUTPUT_ESTIMATE_DIALECTS = {"postgresql", "mssql"}
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+def _get_executor() -> ThreadPoolExecutor:
+    """Pool compartilhado (entre sessões) para o pré-carregamento e a contagem em segundo plano."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=get_int_config("RESULT_PREFETCH_WORKERS", 4), thread_name_prefix="result-prefetch"
+            )
+        return _executor
+
+@dataclass
+class ResultPage:
+    index: int
+    rows: pd.DataFrame
+    has_more: bool
+
+@dataclass
+class RowCount:
+    rows: int
+    kind: str  # "exact", "estimate" (EXPLAIN) ou "at_least" (contagem interrompida no teto)
+
+    def label(self) -> str:
+        if self.kind == "exact":
+            return f"{self.rows:,} linha(s)".replace(",", ".")
+        if self.kind == "at_least":
+            return f"mais de {self.rows:,} linhas".replace(",", ".")
+        return f"~{self.rows:,} linhas (estimativa)".replace(",", ".")
+
+def _is_paginable(shape: QueryShape, dialect: str) -> bool:
+    if not shape.single_statement or shape.first_word not in ("SELECT", "WITH"):
+        return False
+    if dialect == "mssql":
+        # TOP/OFFSET não podem ser combinados com um novo OFFSET, e CTEs não podem virar subquery
+        return not shape.has_limit or shape.first_word == "SELECT"
+    return dialect in _KEYSET_DIALECTS
+
+def _primary_key(db_uri: str, shape: QueryShape) -> List[str]:
+    """Chave primária da única tabela lida pela query, se a paginação por chave se aplicar."""
+    if shape.first_word != "SELECT" or shape.bounded or shape.has_order_by or shape.has_set_operation:
+        return []
+    if shape.has_join or len(shape.tables) != 1 or shape.tables[0] is None:
+        return []
+    schema, _, table = shape.tables[0].rpartition(".")
+    try:
+        constraint = inspect(get_engine(db_uri)).get_pk_constraint(table, schema=schema or None)
+    except Exception:
+        return []  # Visão, CTE ou tabela não encontrada
+    return list(constraint.get("constrained_columns") or [])
+
+class ResultPaginator:
+    """
+    Navegação paginada sobre o resultado de uma query, sem guardar o resultado inteiro.
+
+    As páginas visitadas ficam num LRU pequeno (RESULT_PAGES_CACHED); ao buscar a página N,
+    a N+1 é pré-carregada em segundo plano. O total de linhas (`row_count()`) é aproximado:
+    vem do EXPLAIN quando o banco estima as linhas devolvidas (PostgreSQL e SQL Server) ou de
+    uma contagem com teto (RESULT_COUNT_CAP), calculada em segundo plano.
+    """
+
+    def __init__(self, db_uri: str, query: str, page_size: Optional[int] = None,
+                 handle: Optional[StatementHandle] = None):
+        self.db_uri = db_uri
+        self.handle = handle  # Usada apenas na abertura (validação e primeira página)
+        self.page_size = page_size or get_int_config("RESULT_PAGE_SIZE", 100)
+        engine = get_engine(db_uri)
+        self.dialect = engine.dialect.name
+        self._quote = engine.dialect.identifier_preparer.quote
+        self.shape = analyze_query(query, self.dialect in _BACKSLASH_DIALECTS)
+        if not _is_paginable(self.shape, self.dialect):
+            raise ValueError(f"Paginação não suportada para esta query no dialeto '{self.dialect}'.")
+        self.query = query[:self.shape.end]  # Sem ';' e comentários finais, para virar subquery
+        self.key_columns = _primary_key(db_uri, self.shape)
+        self.mode = "keyset" if self.key_columns else "offset"
+        self._pages: "OrderedDict[int, ResultPage]" = OrderedDict()
+        self._max_pages = max(get_int_config("RESULT_PAGES_CACHED", 5), 2)
+        self._prefetch_enabled = True
+        self._after: Dict[int, Tuple[Any, ...]] = {}  # Última chave da página anterior a cada página
+        self._inflight: Dict[int, Future] = {}
+        self._count: Optional[RowCount] = None
+        self._count_future: Optional[Future] = None
+        self._lock = threading.Lock()
+
+        with pooled_connection(db_uri) as connection, self._bound(connection), span("cost_guard") as guard_span:
+            self.cost_verdict = check_query_cost(connection, self.query)
+            guard_span.set(action=self.cost_verdict.action, estimated_rows=self.cost_verdict.estimated_rows)
+        if self.cost_verdict.action == "reject":
+            raise QueryCostError(self.cost_verdict)
+
+    # --- Montagem das queries de página ---
+    def _keyset_query(self, after: Optional[Tuple[Any, ...]]) -> Tuple[str, Dict[str, Any]]:
+        keys = [self._quote(column) for column in self.key_columns]
+        where, params = "", {}
+        if after is not None:
+            # (a > :k0) OR (a = :k0 AND b > :k1): o SQL Server não compara tuplas
+            clauses = []
+            for position, key in enumerate(keys):
+                terms = [f"{keys[previous]} = :k{previous}" for previous in range(position)]
+                clauses.append("(" + " AND ".join(terms + [f"{key} > :k{position}"]) + ")")
+            where = " WHERE " + " OR ".join(clauses)
+            params = {f"k{position}": value for position, value in enumerate(after)}
+        order = ", ".join(keys)
+        fetch = self.page_size + 1  # Uma linha a mais indica que existe a próxima página
+        if self.dialect == "mssql":
+            return f"SELECT TOP ({fetch}) * FROM ({self.query}) AS _page{where} ORDER BY {order}", params
+        return f"SELECT * FROM ({self.query}) AS _page{where} ORDER BY {order} LIMIT {fetch}", params
+
+    def _offset_query(self, index: int) -> str:
+        offset, fetch = index * self.page_size, self.page_size + 1
+        if self.dialect == "mssql":
+            page = f"OFFSET {offset} ROWS FETCH NEXT {fetch} ROWS ONLY"
+            if not self.shape.has_limit:
+                # Mantém o ORDER BY da query; sem ele, o OFFSET exige uma ordenação qualquer
+                return f"{self.query}{'' if self.shape.has_order_by else ' ORDER BY (SELECT NULL)'} {page}"
+            return f"SELECT * FROM ({self.query}) AS _page ORDER BY (SELECT NULL) {page}"
+        if not self.shape.has_limit:
+            return f"{self.query} LIMIT {fetch} OFFSET {offset}"
+        return f"SELECT * FROM ({self.query}) AS _page LIMIT {fetch} OFFSET {offset}"
+
+    @property
+    def wraps_query(self) -> bool:
+        """Se as páginas envolvem a query numa subquery (`... FROM (<query>) AS _page`)."""
+        return self.mode == "keyset" or self.shape.has_limit
+
+    # --- Busca das páginas ---
+    def _bound(self, connection):
+        return self.handle.bound(connection) if self.handle is not None else nullcontext()
+
+    def _execute(self, sql: str, params: Dict[str, Any]) -> Tuple[List[str], List[Any]]:
+        with pooled_connection(self.db_uri) as connection, self._bound(connection):
+            result = connection.execute(text(sql), params)
+            return list(result.keys()), result.fetchmany(self.page_size + 1)
+
+    def _load(self, index: int) -> ResultPage:
+        if self.mode == "keyset" and index > 0 and index not in self._after:
+            # Página ainda não alcançada: percorre as anteriores para obter a chave de início
+            self.page(index - 1, prefetch=False)
+        with span("page", index=index, mode=self.mode) as page_span:
+            if self.mode == "keyset":
+                try:
+                    columns, rows = self._execute(*self._keyset_query(self._after.get(index)))
+                    positions = [[column.lower() for column in columns].index(key.lower()) for key in self.key_columns]
+                except Exception as e:
+                    if index > 0:
+                        raise
+                    # A chave não faz parte das colunas do resultado: volta para LIMIT/OFFSET
+                    logger.info("Paginação por chave indisponível (%s); usando OFFSET.", e)
+                    self.mode = "offset"
+                    page_span.set(mode=self.mode)
+            if self.mode == "offset":
+                columns, rows = self._execute(self._offset_query(index), {})
+            has_more = len(rows) > self.page_size
+            rows = rows[:self.page_size]
+            if self.mode == "keyset" and rows:
+                self._after[index + 1] = tuple(rows[-1][position] for position in positions)
+            page = ResultPage(index, pd.DataFrame.from_records(rows, columns=columns, coerce_float=True), has_more)
+            page_span.set(rows=len(rows))
+        with self._lock:
+            self._pages[index] = page
+            self._pages.move_to_end(index)
+            while len(self._pages) > self._max_pages:
+                self._pages.popitem(last=False)
+        return page
+
+    def _load_in_background(self, index: int) -> ResultPage:
+        try:
+            return self._load(index)
+        finally:
+            with self._lock:
+                self._inflight.pop(index, None)
+
+    def _prefetch(self, index: int):
+        with self._lock:
+            if index in self._pages or index in self._inflight:
+                return
+            self._inflight[index] = _get_executor().submit(self._load_in_background, index)
+
+    def page(self, index: int, prefetch: bool = True) -> ResultPage:
+        """Retorna a página `index` (a partir de 0), buscando-a se não estiver em memória."""
+        with self._lock:
+            page = self._pages.get(index)
+            if page is not None:
+                self._pages.move_to_end(index)
+            future = self._inflight.get(index)
+        if page is None and future is not None:
+            try:
+                page = future.result()
+            except Exception as e:
+                logger.info("Falha no pré-carregamento da página %s (%s); buscando novamente.", index, e)
+        if page is None:
+            page = self._load(index)
+        if not page.has_more and (len(page.rows) or index == 0):
+            # Chegou ao fim do resultado: o total passa a ser exato
+            self._count = RowCount(index * self.page_size + len(page.rows), "exact")
+        if prefetch and self._prefetch_enabled and page.has_more:
+            self._prefetch(index + 1)
+        return page
+
+    def release_pages(self, keep: int = 1):
+        """
+        Descarta as páginas em cache, menos as `keep` usadas por último (ex: a exibida no histórico),
+        e desliga o pré-carregamento, que voltaria a encher o cache a cada exibição.
+        """
+        with self._lock:
+            self._prefetch_enabled = False
+            while len(self._pages) > keep:
+                self._pages.popitem(last=False)
+
+    # --- Total de linhas ---
+    def _count_rows(self) -> Optional[RowCount]:
+        cap = get_int_config("RESULT_COUNT_CAP", 100_000)
+        if self.dialect == "mssql":
+            sql = f"SELECT COUNT(*) FROM (SELECT TOP ({cap + 1}) 1 AS _row FROM ({self.query}) AS _src) AS _count"
+        else:
+            sql = f"SELECT COUNT(*) FROM (SELECT 1 AS _row FROM ({self.query}) AS _src LIMIT {cap + 1}) AS _count"
+        try:
+            with span("count"), pooled_connection(self.db_uri) as connection:
+                rows = int(connection.execute(text(sql)).scalar() or 0)
+        except Exception as e:
+            logger.info("Contagem de linhas indisponível: %s", e)
+            return None
+        return RowCount(cap, "at_least") if rows > cap else RowCount(rows, "exact")
+
+    def start_count(self):
+        """Inicia o cálculo do total de linhas (estimativa do EXPLAIN ou contagem com teto em segundo plano)."""
+        if self._count is not None or self._count_future is not None:
+            return
+        estimated = self.cost_verdict.estimated_rows
+        if self.dialect in _OUTPUT_ESTIMATE_DIALECTS and estimated is not None:
+            self._count = RowCount(int(estimated), "estimate")
+        else:
+            self._count_future = _get_executor().submit(self._count_rows)
+
+    def row_count(self) -> Optional[RowCount]:
+        """Total de linhas, ou None enquanto a contagem não terminou (ou se ela falhou)."""
+        if self._count is None and self._count_future is not None and self._count_future.done():
+            self._count = self._count_future.result()
+        return self._count
+
+def _execution_error(error: Exception, handle: Optional[StatementHandle]) -> Exception:
+    return translate_error(error, handle) or RuntimeError(f"Erro ao executar a query: {error}")
+
+def open_result_paginator(db_uri: str, query: str, page_size: Optional[int] = None,
+                          handle: Optional[StatementHandle] = None) -> Optional[ResultPaginator]:
+    """
+    Valida a query (guardrail de segurança e de custo), busca a primeira página e inicia a
+    contagem de linhas. Retorna None se a query não puder ser paginada no dialeto (ex: CTE
+    com TOP no SQL Server) ou se ela só falhar por virar subquery (ex: colunas com nomes
+    repetidos ou sem nome no SQL Server/MySQL); nesse caso, use stream_sql_query.
+    A `handle` permite cancelar a abertura a partir de outra thread.
+    """
+    with span("guardrail") as guardrail_span:
+        is_safe = is_query_safe(query)
+        guardrail_span.set(safe=is_safe, query_chars=len(query))
+    if not is_safe:
+        raise ValueError("Operação não permitida. Apenas queries de consulta que não modificam dados são autorizadas.")
+    with span("execute") as execute_span:
+        try:
+            paginator = ResultPaginator(db_uri, query, page_size, handle)
+        except QueryCostError:
+            raise
+        except ValueError:
+            return None  # Query não paginável neste dialeto
+        except Exception as e:
+            raise _execution_error(e, handle) from e
+        try:
+            first_page = paginator.page(0, prefetch=False)
+        except Exception as e:
+            if translate_error(e, handle) is None and paginator.wraps_query:
+                # A query pode ser válida sozinha: o stream a executa sem o envoltório
+                # (e, se o erro for dela, o exibe com a mensagem original)
+                logger.info("Query não paginável como subquery (%s); usando o streaming.", e)
+                return None
+            raise _execution_error(e, handle) from e
+        finally:
+            paginator.handle = None
+        execute_span.set(first_page_rows=len(first_page.rows), pagination=paginator.mode)
+    if first_page.has_more:
+        paginator._prefetch(1)
+    paginator.start_count()
+    return paginator
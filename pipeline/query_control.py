@@ -0,0 +1,231 @@
+# pipeline/query_control.py
+import contextvars
+import logging
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Connection, Engine
+
+from config import get_config_value, get_float_config, get_int_config
+
+logger = logging.getLogger(__name__)
+
+# --- Tempo Limite e Cancelamento de Queries ---
+# O tempo limite é aplicado pelo próprio banco, em cada conexão nova do pool:
+#   - SQLite: progress handler que interrompe o comando ao passar do prazo;
+#   - PostgreSQL: statement_timeout;
+#   - MySQL: MAX_EXECUTION_TIME (MariaDB: max_statement_time);
+#   - SQL Server: timeout de query do pyodbc.
+# O cancelamento (StatementHandle.cancel) encerra o comando no servidor: interrupt() no
+# SQLite, cancel() do driver no PostgreSQL e KILL QUERY / KILL por outra conexão no
+# MySQL e no SQL Server. Assim a thread que executava a query também é liberada.
+
+# Instruções da VM do SQLite entre duas verificações do prazo
+_SQLITE_PROGRESS_STEPS = 10_000
+# Mensagens dos drivers para comandos interrompidos por tempo limite
+_TIMEOUT_ERRORS = re.compile(
+    r"interrupted|statement timeout|maximum statement execution time exceeded"
+    r"|max_statement_time exceeded|query timeout expired|HYT00",
+    re.IGNORECASE,
+)
+
+class QueryTimeoutError(RuntimeError):
+    """O banco interrompeu a query por exceder o tempo limite."""
+
+class QueryCancelledError(RuntimeError):
+    """A query foi cancelada pelo usuário."""
+
+def get_statement_timeout(dialect: str) -> float:
+    """Tempo limite (s) de cada comando: QUERY_TIMEOUT_<DIALETO> ou QUERY_TIMEOUT. 0 = sem limite."""
+    override = get_config_value(f"QUERY_TIMEOUT_{dialect.upper()}")
+    if override not in (None, ""):
+        return float(override)
+    return get_float_config("QUERY_TIMEOUT", 120)
+
+# --- Aplicação por Dialeto (evento "connect" do pool) ---
+class _StatementClock:
+    """Prazo do comando em execução numa conexão SQLite, consultado pelo progress handler."""
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.deadline: Optional[float] = None
+
+    def start(self):
+        self.deadline = time.monotonic() + self.timeout
+
+    def expired(self) -> int:
+        return int(self.deadline is not None and time.monotonic() > self.deadline)
+
+def _server_id(dbapi_connection, sql: str) -> Optional[Any]:
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(sql)
+        return cursor.fetchone()[0]
+    finally:
+        cursor.close()
+
+def _setup_connection(dialect: str, timeout: float, dbapi_connection, connection_record):
+    info = connection_record.info
+    if dialect == "sqlite":
+        if timeout:
+            clock = info["statement_clock"] = _StatementClock(timeout)
+            dbapi_connection.set_progress_handler(clock.expired, _SQLITE_PROGRESS_STEPS)
+        return
+
+    cursor = dbapi_connection.cursor()
+    try:
+        if dialect == "postgresql":
+            if timeout:
+                cursor.execute(f"SET statement_timeout = {int(timeout * 1000)}")
+            cursor.execute("SELECT pg_backend_pid()")
+        elif dialect in ("mysql", "mariadb"):
+            if timeout:
+                try:
+                    cursor.execute(f"SET SESSION MAX_EXECUTION_TIME = {int(timeout * 1000)}")
+                except Exception:
+                    # MariaDB não tem MAX_EXECUTION_TIME; o equivalente é em segundos
+                    cursor.execute(f"SET SESSION max_statement_time = {timeout}")
+            cursor.execute("SELECT CONNECTION_ID()")
+        elif dialect == "mssql":
+            if timeout:
+                dbapi_connection.timeout = max(int(timeout), 1)
+            cursor.execute("SELECT @@SPID")
+        else:
+            return
+        info["server_id"] = cursor.fetchone()[0]
+    finally:
+        cursor.close()
+    if dialect == "postgresql":
+        dbapi_connection.commit()  # Encerra a transação aberta pelo SET (o valor vale para a sessão)
+
+def install_statement_controls(engine: Engine):
+    """Registra na engine a aplicação do tempo limite e a coleta do id da sessão no servidor."""
+    dialect = engine.dialect.name
+    timeout = get_statement_timeout(dialect)
+
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        try:
+            _setup_connection(dialect, timeout, dbapi_connection, connection_record)
+        except Exception as e:
+            # Sem permissão ou variável inexistente: a conexão continua utilizável, sem o limite
+            logger.warning("Tempo limite/cancelamento indisponível (%s): %s", dialect, e)
+
+    if dialect == "sqlite" and timeout:
+        @event.listens_for(engine, "before_cursor_execute")
+        def _on_execute(connection, cursor, statement, parameters, context, executemany):
+            clock = connection.info.get("statement_clock")
+            if clock is not None:
+                clock.start()
+
+# --- Cancelamento ---
+class StatementHandle:
+    """
+    Referência à query em execução, para cancelá-la a partir de outra thread (ex: UI).
+    Fica associada à conexão apenas enquanto a query usa a conexão (`bound`).
+    """
+
+    def __init__(self):
+        self.cancelled = False
+        self._cancel: Optional[Callable[[], None]] = None
+        self._cancelling = False
+        self._lock = threading.Condition()
+
+    @contextmanager
+    def bound(self, connection: Connection):
+        with self._lock:
+            if self.cancelled:
+                raise QueryCancelledError("A consulta foi cancelada.")
+            self._cancel = _cancel_function(connection)
+        try:
+            yield self
+        finally:
+            with self._lock:
+                # A conexão volta ao pool: um cancelamento tardio não pode atingir outra query,
+                # então espera o cancelamento em andamento terminar antes de liberá-la
+                self._cancel = None
+                self._lock.wait_for(lambda: not self._cancelling)
+
+    def cancel(self):
+        """Marca a query como cancelada e interrompe o comando no servidor, se houver um em execução."""
+        with self._lock:
+            self.cancelled = True
+            cancel = self._cancel
+            self._cancel = None
+            if cancel is None:
+                return
+            self._cancelling = True
+        # Chamado fora do lock: o cancelamento no servidor pode demorar (ida e volta na rede)
+        # e não deve bloquear outras chamadas a cancel() nem a verificação de `cancelled`
+        try:
+            cancel()
+        except Exception as e:
+            logger.warning("Falha ao cancelar a query no servidor: %s", e)
+        finally:
+            with self._lock:
+                self._cancelling = False
+                self._lock.notify_all()
+
+def _kill_from(engine: Engine, sql: str) -> Callable[[], None]:
+    def kill():
+        with engine.connect() as other:
+            other.exec_driver_sql(sql)
+    return kill
+
+def _cancel_function(connection: Connection) -> Optional[Callable[[], None]]:
+    dialect = connection.dialect.name
+    dbapi_connection = connection.connection.dbapi_connection
+    server_id = connection.info.get("server_id")
+    if dialect == "sqlite":
+        return dbapi_connection.interrupt
+    if dialect == "postgresql":
+        if hasattr(dbapi_connection, "cancel"):
+            return dbapi_connection.cancel  # psycopg2: envia o cancelamento pelo protocolo
+        return _kill_from(connection.engine, f"SELECT pg_cancel_backend({int(server_id)})") if server_id else None
+    if dialect in ("mysql", "mariadb") and server_id:
+        return _kill_from(connection.engine, f"KILL QUERY {int(server_id)}")
+    if dialect == "mssql" and server_id:
+        # Encerra a sessão inteira; o pool descarta a conexão no próximo checkout (pre-ping)
+        return _kill_from(connection.engine, f"KILL {int(server_id)}")
+    return None
+
+def translate_error(error: Exception, handle: Optional[StatementHandle] = None) -> Optional[Exception]:
+    """Converte o erro do driver em QueryCancelledError/QueryTimeoutError, quando for o caso."""
+    if isinstance(error, (QueryCancelledError, QueryTimeoutError)):
+        return error
+    if handle is not None and handle.cancelled:
+        return QueryCancelledError("A consulta foi cancelada.")
+    if _TIMEOUT_ERRORS.search(str(error)):
+        return QueryTimeoutError(
+            "A consulta excedeu o tempo limite de execução e foi interrompida pelo banco. "
+            "Tente uma pergunta mais específica (ex: com filtros ou agregações)."
+        )
+    return None
+
+# --- Execução em Segundo Plano ---
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+def submit_query(function: Callable[..., Any], *args, **kwargs) -> Future:
+    """
+    Executa a função numa thread do pool de queries, para que quem chamou possa aguardar
+    sem ficar preso no driver (e cancelar pela StatementHandle).
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=get_int_config("QUERY_WORKERS", 8), thread_name_prefix="query")
+    # Copia o contexto para que os spans da thread entrem no trace de quem chamou
+    return _executor.submit(contextvars.copy_context().run, function, *args, **kwargs)
+
+def discard_result(future: Future):
+    """Fecha o resultado de uma execução abandonada (ex: cursor de um stream aberto) quando ela terminar."""
+    def close(done: Future):
+        if not done.cancelled() and done.exception() is None and hasattr(done.result(), "close"):
+            done.result().close()
+    future.add_done_callback(close)
@@ -0,0 +1,271 @@
+# pipeline/result_cache.py
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from config import get_bool_config, get_config_value, get_float_config, get_int_config
+from utils.result_store import to_arrow
+from utils.security import tokenize_sql
+
+logger = logging.getLogger(__name__)
+
+# --- Cache Compartilhado de Resultados dos Dashboards ---
+# Um único cache por processo, compartilhado por todas as sessões: quando várias pessoas
+# abrem o mesmo dashboard, só a primeira executa as queries no banco. A chave é a
+# conexão + o SQL normalizado. A validade (TTL) é informada por quem lê, então cada
+# métrica pode ter a sua. Opcionalmente, os resultados também vão para disco (Parquet),
+# o que permite compartilhá-los entre processos (ex: o agendador em segundo plano).
+# Arquivos vencidos são apagados ao serem lidos, e uma varredura periódica mantém o
+# diretório abaixo de RESULT_CACHE_DISK_MAX_AGE e RESULT_CACHE_DISK_MB.
+
+@dataclass
+class CachedResult:
+    result_df: pd.DataFrame
+    computed_at: float  # Momento (epoch) em que a query foi executada no banco
+    source: str         # "memory" ou "disk"
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.computed_at
+
+_entries: "OrderedDict[str, tuple]" = OrderedDict()  # chave -> (pa.Table, computed_at, connection_id)
+_memory_bytes = 0
+_lock = threading.Lock()
+_last_sweep = 0.0
+_stats = {"hits": 0, "disk_hits": 0, "misses": 0, "expired": 0, "stores": 0, "evictions": 0, "bypasses": 0}
+
+def _bump(counter: str, amount: int = 1):
+    with _lock:
+        _stats[counter] += amount
+
+def default_ttl() -> float:
+    """TTL padrão (s) das métricas que não definem um próprio."""
+    return get_float_config("RESULT_CACHE_TTL", 15 * 60)
+
+def _memory_budget() -> int:
+    return get_int_config("RESULT_CACHE_MEMORY_MB", 512) * 1024 * 1024
+
+def _disk_dir() -> Optional[str]:
+    if not get_bool_config("RESULT_CACHE_DISK", True):
+        return None
+    return get_config_value("RESULT_CACHE_DIR", "data/result_cache")
+
+def normalize_sql(sql: str) -> str:
+    """
+    Remove comentários, espaços redundantes e ';' finais, mantendo o restante intacto
+    (literais e maiúsculas/minúsculas podem mudar o resultado, então não são alterados).
+    """
+    tokens = [text for kind, text in tokenize_sql(sql or "") if kind != "comment"]
+    while tokens and tokens[-1] == ";":
+        tokens.pop()
+    return " ".join(tokens)
+
+def build_result_key(connection_id: str, sql: str) -> str:
+    payload = f"{connection_id}\0{normalize_sql(sql)}"
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def _disk_path(connection_id: str, key: str) -> Optional[str]:
+    disk_dir = _disk_dir()
+    if not disk_dir:
+        return None
+    return os.path.join(disk_dir, connection_id, f"{key}.parquet")
+
+def _to_dataframe(table: pa.Table, computed_at: float, source: str) -> CachedResult:
+    result_df = table.to_pandas()
+    truncated = (table.schema.metadata or {}).get(b"truncated")
+    result_df.attrs["truncated"] = truncated == b"1"
+    result_df.attrs["computed_at"] = computed_at
+    result_df.attrs["from_cache"] = True
+    return CachedResult(result_df, computed_at, source)
+
+def _remember(key: str, table: pa.Table, computed_at: float, connection_id: str):
+    """Guarda a tabela na memória e descarta as menos usadas até caber no orçamento."""
+    global _memory_bytes
+    budget = _memory_budget()
+    if table.nbytes > budget:
+        return
+    with _lock:
+        previous = _entries.pop(key, None)
+        if previous is not None:
+            _memory_bytes -= previous[0].nbytes
+        _entries[key] = (table, computed_at, connection_id)
+        _memory_bytes += table.nbytes
+        while _memory_bytes > budget and len(_entries) > 1:
+            _, (evicted, _, _) = _entries.popitem(last=False)
+            _memory_bytes -= evicted.nbytes
+            _stats["evictions"] += 1
+
+def get_cached_result(connection_id: str, sql: str, ttl: Optional[float] = None) -> Optional[CachedResult]:
+    """
+    Retorna o resultado guardado para (conexão, SQL) se ele tiver menos de `ttl`
+    segundos; caso contrário, None. Procura primeiro na memória e depois no disco.
+    """
+    ttl = default_ttl() if ttl is None else ttl
+    key = build_result_key(connection_id, sql)
+    now = time.time()
+
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None:
+            _entries.move_to_end(key)
+    if entry is not None and now - entry[1] <= ttl:
+        _bump("hits")
+        return _to_dataframe(entry[0], entry[1], "memory")
+
+    path = _disk_path(connection_id, key)
+    if path and os.path.exists(path):
+        modified_at = None
+        try:
+            modified_at = os.path.getmtime(path)
+            table = pq.read_table(path)
+            computed_at = float((table.schema.metadata or {}).get(b"computed_at", b"0"))
+        except Exception:
+            table, computed_at = None, 0.0
+        if table is not None and now - computed_at <= ttl:
+            _remember(key, table, computed_at, connection_id)
+            _bump("disk_hits")
+            return _to_dataframe(table, computed_at, "disk")
+        if modified_at is not None:
+            _remove_expired_file(path, modified_at)
+
+    _bump("expired" if entry is not None else "misses")
+    return None
+
+def _remove_expired_file(path: str, modified_at: float):
+    """Apaga um arquivo vencido (ou ilegível), a menos que outro processo o tenha regravado nesse meio tempo."""
+    try:
+        if os.path.getmtime(path) == modified_at:
+            os.remove(path)
+    except OSError:
+        pass
+
+def sweep_disk_cache(force: bool = False):
+    """
+    Apaga do diretório do cache os arquivos mais antigos que RESULT_CACHE_DISK_MAX_AGE e,
+    se ainda passar de RESULT_CACHE_DISK_MB, os menos recentes até caber. Sem `force`,
+    roda no máximo uma vez a cada RESULT_CACHE_SWEEP_INTERVAL segundos por processo.
+    """
+    global _last_sweep
+    disk_dir = _disk_dir()
+    if not disk_dir or not os.path.isdir(disk_dir):
+        return
+    now = time.time()
+    with _lock:
+        if not force and now - _last_sweep < get_float_config("RESULT_CACHE_SWEEP_INTERVAL", 10 * 60):
+            return
+        _last_sweep = now
+
+    max_age = get_float_config("RESULT_CACHE_DISK_MAX_AGE", 7 * 24 * 60 * 60)
+    max_bytes = get_int_config("RESULT_CACHE_DISK_MB", 2048) * 1024 * 1024
+    files = []
+    for root, _, names in os.walk(disk_dir):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            # Temporários só sobram se a gravação foi interrompida; os recentes podem estar em uso
+            if name.endswith(".tmp") and now - stat.st_mtime < 60 * 60:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+
+    files.sort()
+    total = sum(size for _, size, _ in files)
+    removed = 0
+    for modified_at, size, path in files:
+        if now - modified_at <= max_age and total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    if removed:
+        logger.info("Cache de resultados em disco: %s arquivo(s) removido(s)", removed)
+
+def store_result(connection_id: str, sql: str, result_df: pd.DataFrame, computed_at: Optional[float] = None) -> float:
+    """
+    Guarda o resultado de uma query para as próximas sessões e retorna o `computed_at`
+    usado (também gravado em result_df.attrs, para a UI exibir "dados de ...").
+    Colunas com tipos misturados são guardadas como texto (ver utils.result_store.to_arrow);
+    resultados que ainda assim não podem ser gravados (ex: disco cheio) não são guardados
+    e contam como "bypass".
+    """
+    computed_at = computed_at or time.time()
+    result_df.attrs["computed_at"] = computed_at
+    key = build_result_key(connection_id, sql)
+    try:
+        table = to_arrow(result_df)
+        table = table.replace_schema_metadata({
+            **(table.schema.metadata or {}),
+            b"computed_at": str(computed_at).encode(),
+            b"truncated": b"1" if result_df.attrs.get("truncated") else b"0",
+        })
+        path = _disk_path(connection_id, key)
+        if path:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Grava num arquivo temporário e troca atomicamente: leitores nunca veem um Parquet pela metade.
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            try:
+                pq.write_table(table, tmp_path, compression="zstd")
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+    except Exception as e:
+        logger.warning("Resultado não guardado no cache compartilhado: %s", e)
+        _bump("bypasses")
+        return computed_at
+
+    _remember(key, table, computed_at, connection_id)
+    _bump("stores")
+    sweep_disk_cache()
+    return computed_at
+
+def record_bypass():
+    """Contabiliza uma execução que ignorou o cache de propósito (Atualizar/Recalcular)."""
+    _bump("bypasses")
+
+def invalidate_results(connection_id: Optional[str] = None, sql: Optional[str] = None):
+    """Remove um resultado específico, todos os de uma conexão ou (sem argumentos) todos."""
+    global _memory_bytes
+    if sql is not None and connection_id is not None:
+        key = build_result_key(connection_id, sql)
+        with _lock:
+            entry = _entries.pop(key, None)
+            if entry is not None:
+                _memory_bytes -= entry[0].nbytes
+        path = _disk_path(connection_id, key)
+        if path and os.path.exists(path):
+            os.remove(path)
+        return
+
+    with _lock:
+        for key in [key for key, entry in _entries.items() if connection_id in (None, entry[2])]:
+            _memory_bytes -= _entries.pop(key)[0].nbytes
+    disk_dir = _disk_dir()
+    if disk_dir:
+        shutil.rmtree(os.path.join(disk_dir, connection_id) if connection_id else disk_dir, ignore_errors=True)
+
+def get_result_cache_stats() -> Dict[str, float]:
+    with _lock:
+        stats = dict(_stats)
+        stats["entries"] = len(_entries)
+        stats["memory_bytes"] = _memory_bytes
+    lookups = stats["hits"] + stats["disk_hits"] + stats["misses"] + stats["expired"]
+    stats["hit_rate"] = (stats["hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+    stats["memory_budget_bytes"] = _memory_budget()
+    return stats
@@ -0,0 +1,184 @@
+# pipeline/scheduler.py
+"""
+Agendador que pré-calcula os dashboards salvos, fora de qualquer sessão do Streamlit.
+
+Cada dashboard agendado (ver utils.storage.save_dashboard_schedule) tem seu intervalo;
+quando vence, as queries salvas das métricas são executadas e os resultados gravados no
+cache compartilhado (pipeline.result_cache), de onde a UI os exibe instantaneamente.
+
+Uso:
+    python -m pipeline.scheduler            # roda continuamente
+    python -m pipeline.scheduler --once     # executa só os agendamentos vencidos e sai
+"""
+import argparse
+import hashlib
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from config import get_float_config
+from pipeline.dashboard_executor import run_metrics_concurrently
+from pipeline.db_executor import stream_sql_query
+from pipeline.result_cache import store_result
+from utils.storage import (
+    list_dashboard_schedules,
+    load_dashboard_metrics,
+    record_schedule_runs,
+    update_schedule_times,
+)
+
+logger = logging.getLogger(__name__)
+
+# Dashboards em execução, para não iniciar o mesmo duas vezes se uma rodada atrasar
+_running = set()
+_running_lock = threading.Lock()
+
+def initial_offset(connection_id: str, dashboard_name: str, interval_seconds: float) -> float:
+    """
+    Deslocamento determinístico (0 a SCHEDULER_MAX_JITTER s) da primeira execução, para
+    que dashboards agendados juntos não vençam todos no mesmo instante.
+    """
+    spread = min(interval_seconds, get_float_config("SCHEDULER_MAX_JITTER", 300))
+    digest = hashlib.sha256(f"{connection_id}\0{dashboard_name}".encode()).digest()
+    return int.from_bytes(digest[:4], "big") / 2**32 * spread
+
+def scheduled_result_ttl(interval_seconds: float) -> float:
+    """
+    Validade mínima dos resultados de um dashboard agendado: o intervalo até a próxima
+    execução, mais a espera da verificação (SCHEDULER_POLL_INTERVAL) e uma folga para o
+    tempo de execução das métricas (SCHEDULER_RESULT_GRACE).
+    """
+    return interval_seconds + get_float_config("SCHEDULER_POLL_INTERVAL", 30) + \
+        get_float_config("SCHEDULER_RESULT_GRACE", 600)
+
+def run_dashboard(schedule: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Executa todas as métricas com query salva de um dashboard, grava os resultados no
+    cache compartilhado e registra o histórico. Retorna os registros de execução.
+    """
+    connection_id = schedule["connection_id"]
+    dashboard_name = schedule["dashboard_name"]
+    db_uri = schedule["db_uri"]
+    metrics = load_dashboard_metrics(connection_id, dashboard_name)
+
+    runs, jobs = [], {}
+    started_at = time.time()
+    for metric_name, data in metrics.items():
+        sql_query = data.get("sql_query")
+        if not sql_query:
+            # Métricas antigas (só com a pergunta) dependem do LLM; ficam para a UI.
+            runs.append({"metric_name": metric_name, "started_at": started_at, "duration": 0.0,
+                         "status": "ignorada", "error": "métrica sem query SQL salva"})
+            continue
+        jobs[metric_name] = (lambda query=sql_query: stream_sql_query(db_uri, query))
+
+    # O semáforo por conexão do dashboard_executor limita a concorrência em cada banco,
+    # inclusive entre dashboards diferentes da mesma conexão rodando ao mesmo tempo.
+    for metric_run in run_metrics_concurrently(connection_id, jobs):
+        if metric_run.partial:
+            continue
+        run = {"metric_name": metric_run.metric_name, "started_at": started_at, "duration": metric_run.elapsed}
+        if metric_run.error is not None:
+            run.update(status="erro", error=metric_run.error)
+            logger.warning("Métrica '%s' do dashboard '%s' falhou: %s",
+                           metric_run.metric_name, dashboard_name, metric_run.error)
+        else:
+            store_result(connection_id, metrics[metric_run.metric_name]["sql_query"], metric_run.result_df)
+            run.update(status="ok", row_count=len(metric_run.result_df))
+        runs.append(run)
+
+    record_schedule_runs(connection_id, dashboard_name, runs)
+    logger.info("Dashboard '%s' atualizado: %d métrica(s) em %.2fs",
+                dashboard_name, len(jobs), time.time() - started_at)
+    return runs
+
+def _run_in_background(schedule: Dict[str, Any]):
+    key = (schedule["connection_id"], schedule["dashboard_name"])
+    try:
+        run_dashboard(schedule)
+    except Exception:
+        logger.exception("Falha ao executar o dashboard agendado '%s'", schedule["dashboard_name"])
+    finally:
+        with _running_lock:
+            _running.discard(key)
+
+def run_pending(now: Optional[float] = None, stop_event: Optional[threading.Event] = None,
+                wait: bool = False) -> List[threading.Thread]:
+    """
+    Inicia os dashboards cujo agendamento venceu, espaçando o início de cada um por
+    SCHEDULER_STAGGER segundos. Com `wait=True`, aguarda todos terminarem.
+    """
+    now = now or time.time()
+    stagger = get_float_config("SCHEDULER_STAGGER", 5)
+    stop_event = stop_event or threading.Event()
+    threads = []
+
+    for schedule in list_dashboard_schedules():
+        connection_id, dashboard_name = schedule["connection_id"], schedule["dashboard_name"]
+        interval = schedule["interval_seconds"]
+        next_run_at = schedule["next_run_at"]
+        if next_run_at is None:
+            # Agendamento novo: escolhe o primeiro horário com o deslocamento determinístico
+            next_run_at = now + initial_offset(connection_id, dashboard_name, interval)
+            update_schedule_times(connection_id, dashboard_name, None, next_run_at)
+        if next_run_at > now:
+            continue
+
+        key = (connection_id, dashboard_name)
+        with _running_lock:
+            if key in _running:
+                continue
+            _running.add(key)
+
+        if threads and stop_event.wait(stagger):
+            with _running_lock:
+                _running.discard(key)
+            break
+
+        started_at = time.time()
+        # Mantém a grade do agendamento (sem acumular atraso), mas nunca agenda no passado
+        following = next_run_at + interval
+        if following <= started_at:
+            following = started_at + interval
+        update_schedule_times(connection_id, dashboard_name, started_at, following)
+
+        thread = threading.Thread(target=_run_in_background, args=(schedule,),
+                                  name=f"scheduler-{dashboard_name}", daemon=True)
+        thread.start()
+        threads.append(thread)
+
+    if wait:
+        for thread in threads:
+            thread.join()
+    return threads
+
+def run_forever(stop_event: Optional[threading.Event] = None, poll_interval: Optional[float] = None):
+    """Verifica os agendamentos a cada SCHEDULER_POLL_INTERVAL segundos até `stop_event`."""
+    stop_event = stop_event or threading.Event()
+    poll_interval = poll_interval or get_float_config("SCHEDULER_POLL_INTERVAL", 30)
+    logger.info("Agendador iniciado (verificação a cada %.0fs)", poll_interval)
+    while not stop_event.is_set():
+        try:
+            run_pending(stop_event=stop_event)
+        except Exception:
+            logger.exception("Falha ao verificar os agendamentos")
+        stop_event.wait(poll_interval)
+
+def main():
+    parser = argparse.ArgumentParser(description="Pré-calcula os dashboards agendados do DataSpeak.")
+    parser.add_argument("--once", action="store_true", help="Executa os agendamentos vencidos e sai.")
+    parser.add_argument("--poll", type=float, default=None, help="Intervalo entre verificações (s).")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    if args.once:
+        run_pending(wait=True)
+        return
+    try:
+        run_forever(poll_interval=args.poll)
+    except KeyboardInterrupt:
+        logger.info("Agendador encerrado")
+
+if __name__ == "__main__":
+    main()
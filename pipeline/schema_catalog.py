@@ -0,0 +1,159 @@
+# pipeline/schema_catalog.py
+import hashlib
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from sqlalchemy import MetaData, inspect, text
+
+from config import get_float_config
+from pipeline.engine_registry import get_engine, pooled_connection
+
+# --- Catálogo de Schema em Cache ---
+@dataclass
+class SchemaCatalog:
+    """Snapshot do schema refletido de uma conexão, pronto para entrar no prompt."""
+    dialect: str
+    table_names: List[str]
+    table_info: str
+    table_infos: Dict[str, str] = field(default_factory=dict)
+    columns: Dict[str, List[str]] = field(default_factory=dict)
+    foreign_keys: Dict[str, List[str]] = field(default_factory=dict)
+    view_names: List[str] = field(default_factory=list)
+    # Tokens do schema completo, calculados uma vez por catálogo (ver schema_retriever.schema_tokens)
+    table_info_tokens: Optional[int] = None
+    fingerprint: str = ""
+    reflected_at: float = 0.0
+    checked_at: float = 0.0
+
+# Consultas baratas ao catálogo do banco usadas como "impressão digital" do schema.
+# Elas só leem metadados (sem amostras de linhas), então rodam em milissegundos
+# mesmo em bancos com centenas de tabelas.
+FINGERPRINT_QUERIES = {
+    "sqlite": (
+        "SELECT type, name, sql FROM sqlite_master "
+        "WHERE type IN ('table', 'view') ORDER BY name"
+    ),
+    "postgresql": (
+        "SELECT COUNT(*), md5(string_agg(table_name || '.' || column_name || ':' || data_type, ',' "
+        "ORDER BY table_name, ordinal_position)) "
+        "FROM information_schema.columns WHERE table_schema = current_schema()"
+    ),
+    "mysql": (
+        "SELECT COUNT(*), SUM(CRC32(CONCAT(table_name, '.', column_name, ':', data_type))) "
+        "FROM information_schema.columns WHERE table_schema = DATABASE()"
+    ),
+    "mssql": (
+        "SELECT COUNT(*), CHECKSUM_AGG(CHECKSUM(TABLE_NAME, COLUMN_NAME, DATA_TYPE)) "
+        "FROM INFORMATION_SCHEMA.COLUMNS WHERE TABLE_SCHEMA = SCHEMA_NAME()"
+    ),
+}
+
+_catalogs: Dict[str, SchemaCatalog] = {}
+_key_locks: Dict[str, threading.Lock] = {}
+_lock = threading.Lock()
+_stats = {"hits": 0, "fingerprint_checks": 0, "reflections": 0}
+
+def _key_lock(cache_key: str) -> threading.Lock:
+    with _lock:
+        return _key_locks.setdefault(cache_key, threading.Lock())
+
+def compute_schema_fingerprint(db_uri: str) -> str:
+    """Calcula a impressão digital do schema com uma única consulta ao catálogo do dialeto."""
+    engine = get_engine(db_uri)
+    query = FINGERPRINT_QUERIES.get(engine.dialect.name)
+    if query is None:
+        # Dialeto desconhecido: usa apenas os nomes das tabelas.
+        rows = [(name,) for name in sorted(inspect(engine).get_table_names())]
+    else:
+        with pooled_connection(db_uri) as connection:
+            rows = connection.execute(text(query)).fetchall()
+    payload = "|".join(repr(tuple(row)) for row in rows)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def _reflect(db_uri: str, fingerprint: str) -> SchemaCatalog:
+    """Reflete o schema completo (operação cara) e renderiza as informações por tabela."""
+    # Import tardio: o langchain_community é pesado e só é necessário quando há reflexão
+    from langchain_community.utilities import SQLDatabase
+
+    metadata = MetaData()
+    engine = get_engine(db_uri)
+    db = SQLDatabase(engine, metadata=metadata)
+    table_names = list(db.get_usable_table_names())
+    # As visões não entram no prompt, mas a validação da query gerada precisa reconhecê-las
+    try:
+        view_names = list(inspect(engine).get_view_names())
+    except NotImplementedError:
+        view_names = []
+
+    table_infos = {}
+    for table_name in table_names:
+        table_infos[table_name] = db.get_table_info(table_names=[table_name])
+
+    columns, foreign_keys = {}, {}
+    for table in metadata.sorted_tables:
+        if table.name not in table_infos:
+            continue
+        columns[table.name] = [column.name for column in table.columns]
+        foreign_keys[table.name] = sorted({fk.column.table.name for fk in table.foreign_keys})
+
+    # Mantém a mesma ordem (topológica) que o get_table_info() usaria.
+    ordered = [t.name for t in metadata.sorted_tables if t.name in table_infos]
+    ordered += [t for t in table_names if t not in ordered]
+    now = time.time()
+    return SchemaCatalog(
+        dialect=db.dialect,
+        table_names=table_names,
+        table_info="\n\n".join(table_infos[t] for t in ordered),
+        table_infos={t: table_infos[t] for t in ordered},
+        columns=columns,
+        foreign_keys=foreign_keys,
+        view_names=view_names,
+        fingerprint=fingerprint,
+        reflected_at=now,
+        checked_at=now,
+    )
+
+def get_schema_catalog(db_uri: str, connection_id: Optional[str] = None, force_refresh: bool = False) -> SchemaCatalog:
+    """
+    Retorna o catálogo de schema da conexão a partir do cache do processo.
+
+    A impressão digital é reconferida no máximo a cada SCHEMA_CHECK_INTERVAL segundos,
+    e o schema só é refletido novamente quando ela muda, quando o cache passa de
+    SCHEMA_CACHE_TTL segundos ou quando force_refresh=True.
+    """
+    cache_key = connection_id or db_uri
+    ttl = get_float_config("SCHEMA_CACHE_TTL", 3600)
+    check_interval = get_float_config("SCHEMA_CHECK_INTERVAL", 30)
+
+    with _key_lock(cache_key):
+        catalog = _catalogs.get(cache_key)
+        now = time.time()
+
+        if catalog and not force_refresh and now - catalog.reflected_at < ttl:
+            if now - catalog.checked_at < check_interval:
+                _stats["hits"] += 1
+                return catalog
+            _stats["fingerprint_checks"] += 1
+            fingerprint = compute_schema_fingerprint(db_uri)
+            if fingerprint == catalog.fingerprint:
+                catalog.checked_at = now
+                _stats["hits"] += 1
+                return catalog
+        else:
+            fingerprint = compute_schema_fingerprint(db_uri)
+
+        _stats["reflections"] += 1
+        catalog = _reflect(db_uri, fingerprint)
+        _catalogs[cache_key] = catalog
+        return catalog
+
+def refresh_schema_catalog(connection_id: str):
+    """Descarta o catálogo em cache, forçando uma nova reflexão no próximo uso."""
+    with _key_lock(connection_id):
+        _catalogs.pop(connection_id, None)
+
+def get_schema_cache_stats() -> Dict[str, int]:
+    """Retorna os contadores de hits, conferências de impressão digital e reflexões."""
+    return dict(_stats, cached_connections=len(_catalogs))
@@ -0,0 +1,256 @@
+# pipeline/schema_retriever.py
+import hashlib
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter, deque
+from typing import Dict, List, Optional, Tuple
+
+from config import get_bool_config, get_int_config
+from pipeline.schema_catalog import SchemaCatalog
+
+# Palavras muito comuns (PT/EN) que não ajudam a escolher tabelas.
+STOPWORDS = {
+    "a", "o", "as", "os", "um", "uma", "de", "da", "do", "das", "dos", "e", "em", "no", "na",
+    "nos", "nas", "por", "para", "com", "sem", "que", "qual", "quais", "quanto", "quantos",
+    "quantas", "como", "me", "mostre", "liste", "listar", "mostrar", "cada", "todos", "todas",
+    "the", "of", "and", "in", "by", "for", "to", "with", "what", "which", "how", "many", "show",
+    "list", "all", "each", "is", "are", "ao", "aos", "se", "mais", "menos", "sao", "foi", "tem",
+}
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+def tokenize(text: str) -> List[str]:
+    """
+    Normaliza o texto (minúsculas, sem acentos), quebra identificadores como
+    'tbl_cli_vendas' em partes e aplica um stemming leve de plural.
+    """
+    normalized = unicodedata.normalize("NFKD", text.lower())
+    normalized = "".join(ch for ch in normalized if not unicodedata.combining(ch))
+    tokens = []
+    for token in re.split(r"[^a-z0-9]+", normalized):
+        if not token or token in STOPWORDS:
+            continue
+        if len(token) > 3 and token.endswith("s"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+_encoding = None
+
+def estimate_tokens(text: str) -> int:
+    """Conta tokens com o tiktoken quando disponível; caso contrário, estima ~4 caracteres/token."""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            # Sem tiktoken (ou sem o arquivo BPE em cache): não tenta de novo.
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text))
+    return (len(text) + 3) // 4
+
+def schema_tokens(catalog: SchemaCatalog) -> int:
+    """Tokens do schema completo do catálogo; o catálogo é imutável, então a contagem fica guardada nele."""
+    if catalog.table_info_tokens is None:
+        catalog.table_info_tokens = estimate_tokens(catalog.table_info)
+    return catalog.table_info_tokens
+
+class SchemaIndex:
+    """Índice BM25 em memória com um documento por tabela do schema."""
+
+    def __init__(self):
+        self.doc_terms: Dict[str, Counter] = {}
+        self.doc_lengths: Dict[str, int] = {}
+        self.doc_signatures: Dict[str, str] = {}
+        self.document_frequency: Counter = Counter()
+        self.version = ""
+
+    def _remove(self, table_name: str):
+        for term in self.doc_terms.pop(table_name, {}):
+            self.document_frequency[term] -= 1
+            if self.document_frequency[term] <= 0:
+                del self.document_frequency[term]
+        self.doc_lengths.pop(table_name, None)
+        self.doc_signatures.pop(table_name, None)
+
+    def _add(self, table_name: str, text: str, signature: str):
+        terms = Counter(tokenize(text))
+        self.doc_terms[table_name] = terms
+        self.doc_lengths[table_name] = sum(terms.values())
+        self.doc_signatures[table_name] = signature
+        self.document_frequency.update(terms.keys())
+
+    def update(self, documents: Dict[str, str]) -> int:
+        """
+        Sincroniza o índice com os documentos informados, reindexando apenas as
+        tabelas novas ou alteradas. Retorna quantos documentos foram (re)indexados.
+        """
+        changed = 0
+        for table_name in list(self.doc_terms):
+            if table_name not in documents:
+                self._remove(table_name)
+        for table_name, text in documents.items():
+            signature = hashlib.sha1(text.encode()).hexdigest()
+            if self.doc_signatures.get(table_name) == signature:
+                continue
+            self._remove(table_name)
+            self._add(table_name, text, signature)
+            changed += 1
+        return changed
+
+    def search(self, query: str) -> List[Tuple[str, float]]:
+        """Retorna as tabelas com pontuação BM25 > 0, da mais relevante para a menos."""
+        total_docs = len(self.doc_terms)
+        if not total_docs:
+            return []
+        avg_length = sum(self.doc_lengths.values()) / total_docs or 1.0
+        query_terms = set(tokenize(query))
+
+        scores = []
+        for table_name, terms in self.doc_terms.items():
+            score = 0.0
+            length_norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[table_name] / avg_length)
+            for term in query_terms:
+                frequency = terms.get(term)
+                if not frequency:
+                    continue
+                df = self.document_frequency[term]
+                idf = math.log(1 + (total_docs - df + 0.5) / (df + 0.5))
+                score += idf * frequency * (BM25_K1 + 1) / (frequency + length_norm)
+            if score > 0:
+                scores.append((table_name, score))
+        scores.sort(key=lambda item: (-item[1], item[0]))
+        return scores
+
+def build_table_documents(catalog: SchemaCatalog, custom_metadata: str = "") -> Dict[str, str]:
+    """
+    Monta o texto indexado de cada tabela: nome (com peso dobrado), colunas,
+    linhas do dicionário de dados que citam a tabela e nomes das vizinhas por FK.
+    """
+    metadata_lines = [line for line in re.split(r"[\n.;]+", custom_metadata or "") if line.strip()]
+    neighbours: Dict[str, set] = {table: set(refs) for table, refs in catalog.foreign_keys.items()}
+    for table, refs in catalog.foreign_keys.items():
+        for ref in refs:
+            neighbours.setdefault(ref, set()).add(table)
+
+    documents = {}
+    for table_name in catalog.table_names:
+        table_tokens = set(tokenize(table_name))
+        mentions = [line for line in metadata_lines if table_name.lower() in line.lower()
+                    or (table_tokens and table_tokens <= set(tokenize(line)))]
+        parts = [table_name, table_name]
+        parts += catalog.columns.get(table_name, [])
+        parts += mentions
+        parts += sorted(neighbours.get(table_name, ()))
+        documents[table_name] = " ".join(parts)
+    return documents
+
+def close_over_foreign_keys(catalog: SchemaCatalog, tables: List[str]) -> List[str]:
+    """Inclui, transitivamente, as tabelas referenciadas por FK a partir das selecionadas."""
+    selected = list(tables)
+    pending = list(tables)
+    while pending:
+        table = pending.pop()
+        for ref in catalog.foreign_keys.get(table, []):
+            if ref not in selected:
+                selected.append(ref)
+                pending.append(ref)
+    return selected
+
+# --- Índices por Conexão e Métricas ---
+_indexes: Dict[str, SchemaIndex] = {}
+_lock = threading.RLock()
+_recent_requests = deque(maxlen=200)
+_totals = {"requests": 0, "pruned_requests": 0, "full_tokens": 0, "sent_tokens": 0}
+
+def get_schema_index(cache_key: str, catalog: SchemaCatalog, custom_metadata: str = "") -> SchemaIndex:
+    """Retorna o índice da conexão, atualizando-o de forma incremental se o schema ou o contexto mudou."""
+    version = f"{catalog.fingerprint}:{catalog.reflected_at}:{hashlib.sha1((custom_metadata or '').encode()).hexdigest()}"
+    with _lock:
+        index = _indexes.setdefault(cache_key, SchemaIndex())
+        if index.version != version:
+            index.update(build_table_documents(catalog, custom_metadata))
+            index.version = version
+        return index
+
+def _rank_tables(catalog: SchemaCatalog, question: str, custom_metadata: str, cache_key: Optional[str],
+                 top_k: int) -> List[str]:
+    """Tabelas relevantes para a pergunta (top-k fechadas sobre FKs); todas, se a poda não se aplicar."""
+    if get_bool_config("SCHEMA_PRUNING", True) and len(catalog.table_infos) > top_k:
+        with _lock:
+            index = get_schema_index(cache_key or catalog.fingerprint, catalog, custom_metadata)
+            ranked = [table for table, _ in index.search(question)[:top_k]]
+        if ranked:
+            return close_over_foreign_keys(catalog, ranked)
+    return list(catalog.table_infos)
+
+def _build_schema(catalog: SchemaCatalog, selected: List[str]) -> Tuple[str, Dict[str, object]]:
+    # Preserva a ordem original do catálogo para manter o prompt estável.
+    selected_set = set(selected)
+    schema_info = "\n\n".join(info for table, info in catalog.table_infos.items() if table in selected_set)
+
+    full_tokens = schema_tokens(catalog)
+    sent_tokens = estimate_tokens(schema_info) if len(selected_set) < len(catalog.table_infos) else full_tokens
+    stats = {
+        "tables_total": len(catalog.table_infos),
+        "tables_sent": len(selected_set),
+        "tables": [table for table in catalog.table_infos if table in selected_set],
+        "full_schema_tokens": full_tokens,
+        "sent_schema_tokens": sent_tokens,
+        "tokens_saved": full_tokens - sent_tokens,
+    }
+    with _lock:
+        _recent_requests.append(stats)
+        _totals["requests"] += 1
+        _totals["pruned_requests"] += int(stats["tokens_saved"] > 0)
+        _totals["full_tokens"] += full_tokens
+        _totals["sent_tokens"] += sent_tokens
+    return schema_info, stats
+
+def select_relevant_schema(
+    catalog: SchemaCatalog,
+    question: str,
+    custom_metadata: str = "",
+    cache_key: Optional[str] = None,
+    top_k: Optional[int] = None,
+) -> Tuple[str, Dict[str, object]]:
+    """
+    Escolhe as top-k tabelas relevantes para a pergunta (fechadas sobre FKs) e
+    retorna o schema reduzido junto com as métricas de economia de tokens.
+    Se a poda estiver desligada, o schema for pequeno ou nada casar, devolve o schema completo.
+    """
+    top_k = top_k or get_int_config("SCHEMA_TOP_K", 5)
+    return _build_schema(catalog, _rank_tables(catalog, question, custom_metadata, cache_key, top_k))
+
+def select_schema_for_questions(
+    catalog: SchemaCatalog,
+    questions: List[str],
+    custom_metadata: str = "",
+    cache_key: Optional[str] = None,
+    top_k: Optional[int] = None,
+) -> Tuple[str, Dict[str, object]]:
+    """
+    Versão de select_relevant_schema para um lote de perguntas: une as tabelas relevantes
+    de cada uma num único schema, compartilhado por todas no mesmo prompt.
+    """
+    top_k = top_k or get_int_config("SCHEMA_TOP_K", 5)
+    selected = []
+    for question in questions:
+        for table in _rank_tables(catalog, question, custom_metadata, cache_key, top_k):
+            if table not in selected:
+                selected.append(table)
+    return _build_schema(catalog, selected)
+
+def get_pruning_stats() -> Dict[str, object]:
+    """Retorna os totais de tokens economizados e as métricas das últimas requisições."""
+    with _lock:
+        totals = dict(_totals)
+        recent = list(_recent_requests)
+    totals["tokens_saved"] = totals["full_tokens"] - totals["sent_tokens"]
+    totals["recent"] = recent
+    return totals
@@ -0,0 +1,489 @@
+# pipeline/sql_validator.py
+import difflib
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+
+from config import get_config_value
+from pipeline.schema_catalog import SchemaCatalog
+from utils.security import tokenize_sql_spans
+
+logger = logging.getLogger(__name__)
+
+# --- Validação da Query Gerada Contra o Schema ---
+# Antes de chegar ao banco, a query gerada é conferida localmente contra o catálogo em cache
+# da conexão (o mesmo usado no prompt): tabelas, apelidos, colunas e funções que não existem
+# no dialeto. Uma alucinação do modelo é detectada em milissegundos, sem ida ao banco, e o
+# erro pode voltar ao LLM numa única nova tentativa (SQL_VALIDATION_RETRY).
+# A análise é conservadora: na dúvida (visões, funções de tabela, outros schemas, VALUES,
+# PIVOT), o identificador é aceito e a decisão fica com o banco.
+
+DIALECT_NAMES = {
+    "sqlite": "SQLite", "postgresql": "PostgreSQL", "mysql": "MySQL", "mariadb": "MariaDB", "mssql": "SQL Server",
+}
+_BACKSLASH_DIALECTS = {"mysql", "mariadb"}
+
+# Funções de outros dialetos que o modelo costuma usar por engano, com a alternativa do dialeto
+_MYSQL_MISSING_FUNCTIONS = {
+    "DATE_TRUNC": "DATE_FORMAT", "TO_CHAR": "DATE_FORMAT", "STRFTIME": "DATE_FORMAT", "JULIANDAY": "DATEDIFF",
+    "DATEADD": "DATE_ADD", "DATEPART": "EXTRACT", "DATENAME": "DATE_FORMAT ou MONTHNAME", "DATE_PART": "EXTRACT",
+    "GETDATE": "NOW()", "AGE": "TIMESTAMPDIFF", "LEN": "CHAR_LENGTH", "CHARINDEX": "LOCATE",
+    "STRING_AGG": "GROUP_CONCAT", "ARRAY_AGG": "GROUP_CONCAT", "NVL": "IFNULL", "IIF": "IF", "TOTAL": "SUM",
+    "EOMONTH": "LAST_DAY", "TRY_CAST": "CAST", "SPLIT_PART": "SUBSTRING_INDEX", "TO_DATE": "STR_TO_DATE",
+    "TO_TIMESTAMP": "STR_TO_DATE", "DATEFROMPARTS": "MAKEDATE", "GENERATE_SERIES": "", "MEDIAN": "",
+}
+MISSING_FUNCTIONS: Dict[str, Dict[str, str]] = {
+    "sqlite": {
+        "NOW": "DATETIME('now')", "GETDATE": "DATETIME('now')", "CURDATE": "DATE('now')", "SYSDATE": "DATETIME('now')",
+        "DATE_TRUNC": "STRFTIME", "DATE_FORMAT": "STRFTIME", "TO_CHAR": "STRFTIME ou PRINTF", "EXTRACT": "STRFTIME",
+        "DATE_PART": "STRFTIME", "DATEPART": "STRFTIME", "DATENAME": "STRFTIME", "YEAR": "STRFTIME('%Y', ...)",
+        "MONTH": "STRFTIME('%m', ...)", "DAY": "STRFTIME('%d', ...)", "MONTHNAME": "STRFTIME('%m', ...)",
+        "DAYNAME": "STRFTIME('%w', ...)", "DATEDIFF": "JULIANDAY(a) - JULIANDAY(b)",
+        "TIMESTAMPDIFF": "JULIANDAY(a) - JULIANDAY(b)", "AGE": "JULIANDAY(a) - JULIANDAY(b)",
+        "DATEADD": "DATE(x, '+N days')", "DATE_ADD": "DATE(x, '+N days')", "DATE_SUB": "DATE(x, '-N days')",
+        "ADD_MONTHS": "DATE(x, '+N months')", "EOMONTH": "DATE(x, 'start of month', '+1 month', '-1 day')",
+        "LAST_DAY": "DATE(x, 'start of month', '+1 month', '-1 day')", "DATEFROMPARTS": "DATE(PRINTF(...))",
+        "TO_DATE": "DATE", "TO_TIMESTAMP": "DATETIME", "STR_TO_DATE": "DATE", "UNIX_TIMESTAMP": "STRFTIME('%s', ...)",
+        "LEN": "LENGTH", "CHARINDEX": "INSTR", "LEFT": "SUBSTR(x, 1, n)", "RIGHT": "SUBSTR(x, -n)",
+        "ISNULL": "IFNULL ou COALESCE", "NVL": "IFNULL ou COALESCE", "GREATEST": "MAX(a, b)", "LEAST": "MIN(a, b)",
+        "ARRAY_AGG": "GROUP_CONCAT", "TRY_CAST": "CAST", "CONVERT": "CAST", "TRUNC": "CAST(x AS INTEGER)",
+        "MEDIAN": "", "STDDEV": "", "SPLIT_PART": "", "REGEXP_REPLACE": "",
+    },
+    "postgresql": {
+        "DATEDIFF": "a subtração de datas ou DATE_PART", "TIMESTAMPDIFF": "AGE ou DATE_PART",
+        "DATEADD": "x + INTERVAL '...'", "DATE_ADD": "x + INTERVAL '...'", "DATE_SUB": "x - INTERVAL '...'",
+        "DATEPART": "EXTRACT ou DATE_PART", "DATENAME": "TO_CHAR", "GETDATE": "NOW()", "CURDATE": "CURRENT_DATE",
+        "SYSDATE": "NOW()", "STRFTIME": "TO_CHAR", "DATE_FORMAT": "TO_CHAR", "JULIANDAY": "EXTRACT(EPOCH FROM ...)",
+        "YEAR": "EXTRACT(YEAR FROM ...)", "MONTH": "EXTRACT(MONTH FROM ...)", "DAY": "EXTRACT(DAY FROM ...)",
+        "MONTHNAME": "TO_CHAR(x, 'Month')", "DAYNAME": "TO_CHAR(x, 'Day')", "UNIX_TIMESTAMP": "EXTRACT(EPOCH FROM ...)",
+        "FROM_UNIXTIME": "TO_TIMESTAMP", "STR_TO_DATE": "TO_DATE", "EOMONTH": "DATE_TRUNC + INTERVAL",
+        "LAST_DAY": "DATE_TRUNC + INTERVAL", "DATEFROMPARTS": "MAKE_DATE", "IFNULL": "COALESCE",
+        "ISNULL": "COALESCE", "NVL": "COALESCE", "IIF": "CASE WHEN", "LEN": "LENGTH", "CHARINDEX": "STRPOS",
+        "INSTR": "STRPOS", "SUBSTRING_INDEX": "SPLIT_PART", "GROUP_CONCAT": "STRING_AGG", "TOTAL": "SUM",
+        "TRY_CAST": "CAST",
+    },
+    "mysql": _MYSQL_MISSING_FUNCTIONS,
+    "mariadb": {name: hint for name, hint in _MYSQL_MISSING_FUNCTIONS.items() if name != "MEDIAN"},
+    "mssql": {
+        "NOW": "GETDATE()", "CURDATE": "CAST(GETDATE() AS DATE)", "SYSDATE": "GETDATE()",
+        "DATE_TRUNC": "DATETRUNC (2022+) ou DATEFROMPARTS", "EXTRACT": "DATEPART", "DATE_PART": "DATEPART",
+        "TO_CHAR": "FORMAT", "STRFTIME": "FORMAT", "DATE_FORMAT": "FORMAT", "JULIANDAY": "DATEDIFF",
+        "DATE_ADD": "DATEADD", "DATE_SUB": "DATEADD", "TIMESTAMPDIFF": "DATEDIFF", "AGE": "DATEDIFF",
+        "MONTHNAME": "DATENAME(MONTH, x)", "DAYNAME": "DATENAME(WEEKDAY, x)", "LAST_DAY": "EOMONTH",
+        "UNIX_TIMESTAMP": "DATEDIFF(SECOND, '1970-01-01', x)", "TO_DATE": "CONVERT ou CAST",
+        "TO_TIMESTAMP": "CONVERT ou CAST", "STR_TO_DATE": "CONVERT ou CAST", "IFNULL": "ISNULL ou COALESCE",
+        "NVL": "ISNULL ou COALESCE", "LENGTH": "LEN", "SUBSTR": "SUBSTRING", "INSTR": "CHARINDEX",
+        "GROUP_CONCAT": "STRING_AGG", "ARRAY_AGG": "STRING_AGG", "TOTAL": "SUM",
+        "MEDIAN": "PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY ...)", "SPLIT_PART": "", "TRUNC": "",
+        "REGEXP_REPLACE": "",
+    },
+}
+
+# Palavras que não são nomes de colunas: palavras-chave, tipos, partes de datas e funções sem parênteses
+_KEYWORDS = {
+    "SELECT", "FROM", "WHERE", "AND", "OR", "NOT", "NULL", "IS", "IN", "LIKE", "ILIKE", "BETWEEN", "EXISTS",
+    "CASE", "WHEN", "THEN", "ELSE", "END", "AS", "ON", "USING", "JOIN", "INNER", "LEFT", "RIGHT", "FULL", "OUTER",
+    "CROSS", "NATURAL", "APPLY", "LATERAL", "ONLY", "GROUP", "BY", "ORDER", "ASC", "DESC", "HAVING", "LIMIT",
+    "OFFSET", "FETCH", "FIRST", "NEXT", "LAST", "ROW", "ROWS", "TOP", "PERCENT", "TIES", "DISTINCT", "ALL", "ANY",
+    "SOME", "UNION", "INTERSECT", "EXCEPT", "MINUS", "WITH", "RECURSIVE", "MATERIALIZED", "VALUES", "WINDOW",
+    "OVER", "PARTITION", "RANGE", "GROUPS", "UNBOUNDED", "PRECEDING", "FOLLOWING", "CURRENT", "EXCLUDE", "OTHERS",
+    "NO", "FILTER", "WITHIN", "NULLS", "COLLATE", "NOCASE", "RTRIM", "BINARY", "ESCAPE", "GLOB", "REGEXP", "RLIKE",
+    "MATCH", "SIMILAR", "TO", "DIV", "MOD", "XOR", "TRUE", "FALSE", "UNKNOWN", "AT", "TIME", "ZONE", "LOCAL",
+    "INTERVAL", "ROLLUP", "CUBE", "GROUPING", "SETS", "SEPARATOR", "FOR", "BOTH", "LEADING", "TRAILING",
+    "PIVOT", "UNPIVOT", "OPTION", "MAXRECURSION", "NOLOCK", "ARRAY", "DUAL", "STRAIGHT_JOIN", "QUALIFY",
+    "ROWID", "_ROWID_", "OID", "CTID",
+    # Funções e valores sem parênteses
+    "CURRENT_DATE", "CURRENT_TIME", "CURRENT_TIMESTAMP", "LOCALTIME", "LOCALTIMESTAMP", "CURRENT_USER",
+    "SESSION_USER", "SYSTEM_USER", "USER", "SYSDATE", "UTC_DATE", "UTC_TIME", "UTC_TIMESTAMP",
+    # Tipos (CAST, CONVERT, ::)
+    "INT", "INTEGER", "BIGINT", "SMALLINT", "TINYINT", "MEDIUMINT", "DECIMAL", "NUMERIC", "REAL", "FLOAT",
+    "DOUBLE", "PRECISION", "CHAR", "VARCHAR", "NCHAR", "NVARCHAR", "CHARACTER", "VARYING", "TEXT", "NTEXT",
+    "DATE", "DATETIME", "DATETIME2", "SMALLDATETIME", "DATETIMEOFFSET", "TIMESTAMP", "TIMESTAMPTZ", "BOOLEAN",
+    "BOOL", "BIT", "BLOB", "BYTEA", "MONEY", "SIGNED", "UNSIGNED", "JSON", "JSONB", "UUID", "UNIQUEIDENTIFIER",
+    "VARBINARY", "MAX",
+    # Partes de datas (EXTRACT, INTERVAL)
+    "YEAR", "YEARS", "QUARTER", "MONTH", "MONTHS", "WEEK", "WEEKS", "DAY", "DAYS", "HOUR", "HOURS", "MINUTE",
+    "MINUTES", "SECOND", "SECONDS", "MILLISECOND", "MICROSECOND", "EPOCH", "DOW", "DOY", "ISODOW", "ISOYEAR",
+    "CENTURY", "DECADE", "DAYOFWEEK", "DAYOFYEAR", "WEEKDAY", "YEAR_MONTH", "DAY_HOUR", "DAY_MINUTE",
+    "DAY_SECOND", "HOUR_MINUTE", "HOUR_SECOND", "MINUTE_SECOND",
+}
+# Palavras-chave que são valores: podem vir seguidas de um apelido sem AS (ex: SELECT NULL vazio)
+_VALUE_KEYWORDS = {
+    "NULL", "TRUE", "FALSE", "UNKNOWN", "CURRENT_DATE", "CURRENT_TIME", "CURRENT_TIMESTAMP", "LOCALTIME",
+    "LOCALTIMESTAMP", "CURRENT_USER", "SESSION_USER", "SYSTEM_USER", "USER", "SYSDATE", "UTC_DATE", "UTC_TIME",
+    "UTC_TIMESTAMP",
+}
+# Funções cujo primeiro argumento é uma parte de data sem aspas (ex: DATEADD(day, 1, x))
+_DATE_PART_FUNCTIONS = {
+    "DATEADD", "DATEDIFF", "DATEDIFF_BIG", "DATEPART", "DATENAME", "DATETRUNC", "EXTRACT", "TIMESTAMPDIFF",
+    "TIMESTAMPADD",
+}
+# Nomes de tabelas do próprio banco, que não aparecem no catálogo
+_SYSTEM_PREFIXES = ("sqlite_", "pg_", "information_schema", "sys", "dual")
+
+@dataclass
+class SQLValidation:
+    """Resultado da validação da query contra o catálogo de schema."""
+    problems: List[str] = field(default_factory=list)
+    tables: List[str] = field(default_factory=list)  # Tabelas do catálogo referenciadas pela query
+    suggested_tables: List[str] = field(default_factory=list)  # Tabelas úteis para corrigir a query
+
+    @property
+    def ok(self) -> bool:
+        return not self.problems
+
+class SQLValidationError(ValueError):
+    """Query gerada que referencia tabelas, colunas ou funções inexistentes (rejeitada sem ir ao banco)."""
+
+    def __init__(self, query: str, validation: SQLValidation):
+        self.query = query
+        self.validation = validation
+        super().__init__(
+            "A query gerada referencia itens que não existem no banco de dados: " + "; ".join(validation.problems)
+        )
+
+def get_sql_validation_mode() -> str:
+    """"reject" (padrão): bloqueia a query inválida; "warn": apenas registra no log; "off"."""
+    mode = str(get_config_value("SQL_VALIDATION", "reject")).lower()
+    return mode if mode in ("reject", "warn") else "off"
+
+def _hint(name: str, candidates: List[str]) -> str:
+    matches = difflib.get_close_matches(name, candidates, n=1, cutoff=0.75)
+    return f" (você quis dizer '{matches[0]}'?)" if matches else ""
+
+class _QueryScan:
+    """
+    Percorre os tokens da query em duas passadas: a primeira registra o que a query define
+    (tabelas e apelidos do FROM/JOIN, CTEs, apelidos de colunas); a segunda confere cada
+    referência (tabela.coluna, colunas sem qualificador e chamadas de função).
+    """
+
+    def __init__(self, query: str, catalog: SchemaCatalog):
+        self.dialect = catalog.dialect
+        self.tokens = [
+            (kind, text) for kind, text, _ in tokenize_sql_spans(query, self.dialect in _BACKSLASH_DIALECTS)
+            if kind != "comment"
+        ]
+        self.catalog_tables = {name.lower(): name for name in catalog.table_names}
+        self.catalog_columns = {
+            name.lower(): {column.lower(): column for column in columns} for name, columns in catalog.columns.items()
+        }
+        self.views = {name.lower() for name in catalog.view_names}
+        self.closing = self._match_parentheses()
+        # Nome ou apelido (minúsculas) → tabela do catálogo; None = colunas desconhecidas (CTE, subquery...)
+        self.relations: Dict[str, Optional[str]] = {}
+        self.ctes: Set[str] = set()
+        self.defined: Set[str] = set()  # Apelidos de colunas e colunas declaradas (CTEs, subqueries)
+        self.definitions: Set[int] = set()  # Posições dos tokens que definem nomes (não são referências)
+        self.used_tables: List[str] = []
+        # Há relações com colunas desconhecidas: colunas sem qualificador não são conferidas
+        self.open_columns = False
+        self.validation = SQLValidation()
+
+    # --- Acesso aos Tokens ---
+    def _text(self, index: int) -> str:
+        return self.tokens[index][1] if 0 <= index < len(self.tokens) else ""
+
+    def _word(self, index: int) -> Optional[str]:
+        if 0 <= index < len(self.tokens) and self.tokens[index][0] == "word":
+            return self.tokens[index][1].upper()
+        return None
+
+    def _is_identifier(self, index: int) -> bool:
+        if not 0 <= index < len(self.tokens):
+            return False
+        kind, text = self.tokens[index]
+        if kind == "word":
+            return True
+        if kind != "quoted":
+            return False
+        if text[0] == "[":
+            return self.dialect in ("mssql", "sqlite")  # Nos demais, [ ] é índice de array
+        if text[0] == '"':
+            return self.dialect not in _BACKSLASH_DIALECTS  # No MySQL, aspas duplas delimitam texto
+        return True
+
+    def _name(self, index: int) -> str:
+        text = self.tokens[index][1]
+        if self.tokens[index][0] == "quoted":
+            text = text[1:-1]
+        return text.lower()
+
+    def _match_parentheses(self) -> Dict[int, int]:
+        closing, stack = {}, []
+        for index, (_, text) in enumerate(self.tokens):
+            if text == "(":
+                stack.append(index)
+            elif text == ")" and stack:
+                closing[stack.pop()] = index
+        for index in stack:
+            closing[index] = len(self.tokens)
+        return closing
+
+    # --- Primeira Passada: Definições ---
+    def _define_columns(self, open_index: int):
+        """Colunas declaradas entre parênteses (ex: WITH t (a, b) AS ..., ou (subquery) AS t (a, b))."""
+        for index in range(open_index + 1, self.closing.get(open_index, open_index)):
+            if self._is_identifier(index):
+                self.definitions.add(index)
+                self.defined.add(self._name(index))
+
+    def _read_alias(self, index: int, table: Optional[str]):
+        explicit = self._word(index) == "AS"
+        index += explicit
+        if not self._is_identifier(index) or (not explicit and self._word(index) in _KEYWORDS):
+            return
+        self.definitions.add(index)
+        self.relations[self._name(index)] = table
+        if self._text(index + 1) == "(":
+            self._define_columns(index + 1)
+
+    def _resolve_table(self, parts: List[int]) -> Optional[str]:
+        name = self._name(parts[-1])
+        if len(parts) == 1 and name in self.ctes:
+            return None
+        table = self.catalog_tables.get(name)
+        if table is not None:
+            if table not in self.used_tables:
+                self.used_tables.append(table)
+            self.relations[name] = table
+            return table
+        self.relations[name] = None
+        self.open_columns = True
+        if name in self.views or len(parts) > 1 or name.startswith(_SYSTEM_PREFIXES):
+            return None  # Visão, tabela de outro schema ou do sistema: as colunas não estão no catálogo
+        self.validation.problems.append(
+            f"a tabela '{self.tokens[parts[-1]][1]}' não existe{_hint(name, list(self.catalog_tables))}"
+        )
+        self.validation.suggested_tables += difflib.get_close_matches(name, list(self.catalog_tables), n=2, cutoff=0.6)
+        return None
+
+    def _read_relation(self, index: int):
+        """Lê a tabela (ou subquery/função de tabela) que começa em `index`, após FROM, JOIN ou vírgula."""
+        while self._word(index) in ("LATERAL", "ONLY"):
+            index += 1
+        if self._text(index) == "(":
+            self._read_alias(self.closing[index] + 1, None)
+            return
+        if not self._is_identifier(index):
+            return
+        parts, index = [index], index + 1
+        while self._text(index) == "." and self._is_identifier(index + 1):
+            parts.append(index + 1)
+            index += 2
+        self.definitions.update(parts)
+        if self._text(index) == "(":
+            # Função de tabela (ex: generate_series, json_each): colunas desconhecidas
+            self.open_columns = True
+            self._read_alias(self.closing[index] + 1, None)
+            return
+        self._read_alias(index, self._resolve_table(parts))
+
+    def _is_cte_name(self, index: int, previous: Optional[str], clause: Optional[str]) -> bool:
+        if not (previous in ("WITH", "RECURSIVE", "WINDOW") or (self._text(index - 1) == "," and clause in ("WITH", "WINDOW"))):
+            return False
+        after = self.closing[index + 1] + 1 if self._text(index + 1) == "(" else index + 1
+        return self._word(after) == "AS"
+
+    def _is_select_alias(self, index: int) -> bool:
+        """Apelido sem AS no SELECT (ex: SELECT COUNT(*) total, ...)."""
+        following = self._text(index + 1)
+        if not (following in (",", ")", ";", "") or self._word(index + 1) in ("FROM", "INTO")):
+            # SQL Server: SELECT apelido = expressão
+            return self.dialect == "mssql" and following == "=" and \
+                (self._text(index - 1) == "," or self._word(index - 1) in ("SELECT", "DISTINCT"))
+        if self._word(index) in _KEYWORDS:
+            return False
+        previous_kind, previous = self.tokens[index - 1] if index else ("", "")
+        if previous_kind == "number":
+            return self._word(index - 2) != "TOP"
+        if previous_kind == "word":
+            return previous.upper() not in _KEYWORDS or previous.upper() in _VALUE_KEYWORDS \
+                or previous.upper() == "END" or self._follows_cast(index)
+        return previous_kind in ("quoted", "string", "dollar") or previous == ")"
+
+    def _follows_cast(self, index: int) -> bool:
+        """Se o token vem logo depois de um cast do Postgres (ex: x::date, x::double precision)."""
+        position = index - 1
+        while position >= 0 and self.tokens[position][0] == "word" and self._word(position) in _KEYWORDS:
+            position -= 1
+        return position < index - 1 and self._text(position) == ":" and self._text(position - 1) == ":"
+
+    def _collect_definitions(self):
+        # Pilha de níveis de parênteses: [é uma (sub)query?, cláusula atual]
+        levels: List[List] = [[True, None]]
+        for index, (kind, text) in enumerate(self.tokens):
+            level = levels[-1]
+            if text == "(":
+                levels.append([None, None])
+                continue
+            if text == ")":
+                if len(levels) > 1:
+                    levels.pop()
+                continue
+            if kind == "semicolon":
+                levels = [[True, None]]
+                continue
+            word = self._word(index)
+            if level[0] is None:
+                level[0] = word in ("SELECT", "WITH", "VALUES")
+            if word in ("VALUES", "PIVOT", "UNPIVOT"):
+                self.open_columns = True  # Colunas geradas pelo próprio comando
+            previous = self._word(index - 1)
+            if previous == "AS" and self._is_identifier(index) and self._text(index + 1) != "(":
+                self.definitions.add(index)
+                self.defined.add(self._name(index))
+            elif self._is_identifier(index) and self._is_cte_name(index, previous, level[1]):
+                self.definitions.add(index)
+                self.ctes.add(self._name(index))
+                self.relations[self._name(index)] = None
+                self.defined.add(self._name(index))
+                if self._text(index + 1) == "(":
+                    self._define_columns(index + 1)
+            elif level[0] and level[1] == "SELECT" and self._is_identifier(index) and self._is_select_alias(index):
+                self.definitions.add(index)
+                self.defined.add(self._name(index))
+            if not level[0]:
+                continue  # Dentro de chamadas de função (ex: EXTRACT(YEAR FROM x)) não há tabelas
+            if word in ("WITH", "SELECT", "WHERE", "GROUP", "HAVING", "ORDER", "WINDOW", "LIMIT", "OFFSET",
+                        "FETCH", "QUALIFY", "UNION", "INTERSECT", "EXCEPT"):
+                level[1] = word
+            if word in ("FROM", "JOIN", "APPLY"):
+                # IS [NOT] DISTINCT FROM é uma comparação, não uma lista de tabelas
+                if word == "FROM" and previous == "DISTINCT" and self._word(index - 2) in ("IS", "NOT"):
+                    continue
+                level[1] = "FROM"
+                self._read_relation(index + 1)
+            elif text == "," and level[1] == "FROM":
+                self._read_relation(index + 1)
+
+    # --- Segunda Passada: Referências ---
+    def _problem(self, message: str):
+        if message not in self.validation.problems:
+            self.validation.problems.append(message)
+
+    def _check_syntax(self, index: int, word: str):
+        """Palavras-chave de outros dialetos (ex: LIMIT no SQL Server, TOP no SQLite)."""
+        dialect_name = DIALECT_NAMES.get(self.dialect, self.dialect)
+        following = self.tokens[index + 1][0] if index + 1 < len(self.tokens) else ""
+        if word == "LIMIT" and self.dialect == "mssql" and following == "number":
+            self._problem("LIMIT não existe no SQL Server (use TOP ou OFFSET ... FETCH NEXT)")
+        elif word == "TOP" and self.dialect != "mssql" and self._word(index - 1) in ("SELECT", "DISTINCT") \
+                and (following == "number" or self._text(index + 1) == "("):
+            self._problem(f"TOP não existe no {dialect_name} (use LIMIT)")
+        elif word == "ILIKE" and self.dialect in ("sqlite", "mysql", "mariadb", "mssql"):
+            self._problem(f"ILIKE não existe no {dialect_name} (use LIKE)")
+
+    def _check_function(self, index: int):
+        word = self._word(index)
+        missing = MISSING_FUNCTIONS.get(self.dialect, {})
+        if word in missing:
+            hint = missing[word]
+            self._problem(
+                f"a função {word}() não existe no {DIALECT_NAMES.get(self.dialect, self.dialect)}"
+                + (f" (use {hint})" if hint else "")
+            )
+
+    def _check_qualified(self, index: int):
+        """Referência tabela.coluna (ou apelido.coluna)."""
+        column_index = index + 2
+        if self._text(column_index + 1) in (".", "("):
+            return  # schema.tabela.coluna ou schema.função(...)
+        qualifier = self._name(index)
+        if qualifier not in self.relations:
+            if qualifier not in self.defined:
+                self._problem(f"a tabela ou apelido '{self.tokens[index][1]}' não aparece no FROM/JOIN da query")
+            return
+        table = self.relations[qualifier]
+        columns = self.catalog_columns.get(table.lower()) if table else None
+        if columns is None or not self._is_identifier(column_index):
+            return
+        column = self._name(column_index)
+        if column not in columns:
+            self._problem(
+                f"a coluna '{self.tokens[column_index][1]}' não existe na tabela '{table}'"
+                f"{_hint(column, list(columns.values()))}"
+            )
+
+    def _check_column(self, index: int):
+        """Coluna sem qualificador: precisa existir em alguma tabela da query (ou ser um apelido definido nela)."""
+        kind, text = self.tokens[index]
+        word = self._word(index)
+        if word in _KEYWORDS or self._name(index) in self.defined:
+            return
+        if kind == "word" and len(text) == 1 and index + 1 < len(self.tokens) and self.tokens[index + 1][0] == "string":
+            return  # Prefixo de literal (ex: N'texto')
+        if self._text(index - 1) == "(" and self._word(index - 2) in _DATE_PART_FUNCTIONS:
+            return  # DATEADD(day, ...), EXTRACT(epoch FROM ...)
+        if kind == "quoted" and text[0] == '"' and self.dialect == "sqlite":
+            return  # O SQLite aceita aspas duplas como texto quando não há coluna com o nome
+        if self.open_columns:
+            return
+        column = self._name(index)
+        if any(column in self.catalog_columns.get(table.lower(), {}) for table in self.used_tables):
+            return
+        owners = [table for table in self.catalog_tables.values() if column in self.catalog_columns.get(table.lower(), {})]
+        if owners:
+            self.validation.suggested_tables += owners[:3]
+            tables = ", ".join(self.used_tables) or "nenhuma"
+            self._problem(f"a coluna '{text}' não pertence às tabelas da query ({tables}); ela existe em: {', '.join(owners[:3])}")
+            return
+        candidates = [name for table in self.used_tables for name in self.catalog_columns.get(table.lower(), {}).values()]
+        where = f"nas tabelas da query ({', '.join(self.used_tables)})" if self.used_tables else "no banco de dados"
+        self._problem(f"a coluna '{text}' não existe {where}{_hint(column, candidates)}")
+
+    def _check_references(self):
+        for index, (kind, text) in enumerate(self.tokens):
+            word = self._word(index)
+            if word:
+                self._check_syntax(index, word)
+            if index in self.definitions or not self._is_identifier(index):
+                continue
+            previous = self._text(index - 1)
+            if self._text(index + 1) == "(":
+                if previous != "." and word:
+                    self._check_function(index)
+            elif previous == ".":
+                continue  # Coluna qualificada, conferida junto com o qualificador
+            elif previous in (":", "@") or self._word(index - 1) == "OVER":
+                continue  # Tipo após '::', variáveis (@x, @@x) e nome de janela
+            elif self._text(index + 1) == ".":
+                self._check_qualified(index)
+            else:
+                self._check_column(index)
+
+    def run(self) -> SQLValidation:
+        self._collect_definitions()
+        self._check_references()
+        self.validation.tables = list(self.used_tables)
+        self.validation.suggested_tables = list(dict.fromkeys(
+            table for table in self.validation.suggested_tables if table not in self.used_tables
+        ))
+        return self.validation
+
+def validate_sql(query: str, catalog: SchemaCatalog) -> SQLValidation:
+    """
+    Confere a query contra o catálogo de schema, sem acessar o banco: tabelas inexistentes,
+    apelidos não definidos, colunas que não existem nas tabelas da query e funções ou
+    palavras-chave de outros dialetos. Retorna os problemas encontrados (lista vazia = plausível).
+    """
+    if not query or not query.strip():
+        return SQLValidation(problems=["a query está vazia"])
+    try:
+        return _QueryScan(query, catalog).run()
+    except Exception as e:
+        # Sintaxe que o analisador não entende: a decisão fica com o banco
+        logger.warning("Falha na validação local da query (ignorada): %s", e)
+        return SQLValidation()
+
+def check_generated_sql(query: str, catalog: SchemaCatalog) -> SQLValidation:
+    """Aplica validate_sql segundo SQL_VALIDATION: levanta SQLValidationError no modo "reject"."""
+    mode = get_sql_validation_mode()
+    if mode == "off":
+        return SQLValidation()
+    validation = validate_sql(query, catalog)
+    if validation.problems:
+        logger.warning("Query gerada com problemas de schema: %s. Query: \"%s...\"", "; ".join(validation.problems), query[:100])
+        if mode == "reject":
+            raise SQLValidationError(query, validation)
+    return validation
@@ -1,59 +1,357 @@
 # pipeline/tools/viz_tool.py
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
 from langchain.tools import tool
 from pydantic.v1 import BaseModel, Field # Usamos pydantic para definir o schema de entrada
 import streamlit as st
 
+from config import get_config_value, get_int_config
+
+# --- Preparação Vetorial dos Dados ---
+# O gráfico nunca recebe mais pontos do que consegue exibir: categorias além das N maiores
+# são somadas em "Outros" (barras e pizza), séries longas são reduzidas por LTTB (linha e
+# área), nuvens de pontos são amostradas e histogramas usam bins fixos. Assim o tempo de
+# renderização não depende do tamanho do resultado.
+
+CHART_TYPES = ("bar", "barh", "pie", "line", "area", "scatter", "hist")
+OTHERS_LABEL = "Outros"
+NULL_LABEL = "(vazio)"  # Categoria dos valores nulos, para que não sumam do gráfico
+
+def to_frame(data: Any, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Converte a entrada do gráfico em DataFrame sem copiar linha a linha: aceita DataFrame,
+    dicionário de colunas (listas ou arrays NumPy), array 2D ou lista de linhas.
+    """
+    if isinstance(data, pd.DataFrame):
+        df = data
+    elif isinstance(data, dict):
+        df = pd.DataFrame(data, copy=False)
+    elif isinstance(data, np.ndarray):
+        df = pd.DataFrame(data if data.ndim == 2 else data.reshape(-1, 1), copy=False)
+    else:
+        df = pd.DataFrame.from_records(data, columns=columns)
+    if columns:
+        if len(columns) != len(df.columns):
+            raise ValueError(f"Foram informadas {len(columns)} colunas, mas os dados têm {len(df.columns)}.")
+        df = df.set_axis(list(columns), axis=1)
+    return df
+
+def _numeric(series: pd.Series) -> pd.Series:
+    """Valores numéricos da coluna; texto que não é número vira NaN, mas a coluna precisa ter algum número."""
+    if pd.api.types.is_numeric_dtype(series):
+        return series
+    numeric = pd.to_numeric(series, errors="coerce")
+    if len(numeric) and not numeric.notna().any():
+        raise ValueError(f"A coluna '{series.name}' não tem valores numéricos.")
+    return numeric
+
+def top_n_with_others(labels: pd.Series, values: pd.Series, limit: int) -> Tuple[pd.Series, int]:
+    """
+    Soma os valores por rótulo e mantém as `limit - 1` maiores categorias, somando as demais
+    em "Outros". Retorna a série (rótulo -> valor) e quantas categorias foram agrupadas.
+    """
+    if labels.isna().any():
+        labels = labels.astype(object).where(labels.notna(), NULL_LABEL)
+    grouped = values.groupby(labels.to_numpy(), sort=False, dropna=False).sum()
+    if len(grouped) <= limit:
+        return grouped.set_axis(grouped.index.astype(str)), 0
+    top = grouped.nlargest(limit - 1)
+    others = grouped.sum() - top.sum()
+    # Apenas os rótulos que sobram viram texto
+    top = top.set_axis(top.index.astype(str))
+    return pd.concat([top, pd.Series({OTHERS_LABEL: others})]), len(grouped) - len(top)
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Índices dos pontos escolhidos pelo Largest-Triangle-Three-Buckets: preserva picos e
+    vales da série com `threshold` pontos. `x` deve estar ordenado.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    # threshold - 2 buckets entre o primeiro e o último ponto, que são sempre mantidos
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    anchor = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_end = edges[bucket + 2] if bucket + 2 < len(edges) else n
+        next_x, next_y = x[end:next_end].mean(), y[end:next_end].mean()
+        # Área do triângulo (âncora, candidato, média do próximo bucket), em lote
+        areas = np.abs((x[anchor] - next_x) * (y[start:end] - y[anchor])
+                       - (x[anchor] - x[start:end]) * (next_y - y[anchor]))
+        anchor = start + int(np.argmax(areas))
+        selected[bucket + 1] = anchor
+    return selected
+
+def _axis_values(series: pd.Series) -> Tuple[np.ndarray, bool]:
+    """Valores numéricos do eixo X (datas viram inteiros) e se a série é ordenável como eixo contínuo."""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series.to_numpy(dtype="datetime64[ns]").astype(np.int64).astype(float), True
+    if pd.api.types.is_numeric_dtype(series):
+        return series.to_numpy(dtype=float), True
+    return np.arange(len(series), dtype=float), False
+
+def prepare_chart_data(df: pd.DataFrame, chart_type: str) -> Tuple[pd.DataFrame, str]:
+    """
+    Agrega e reduz os dados para o tipo de gráfico. Retorna o DataFrame pronto para desenhar
+    (primeira coluna = eixo/rótulo, demais = valores) e uma observação sobre a redução feita.
+    Erros de formato levantam ValueError com a mensagem para o usuário.
+    """
+    max_points = get_int_config("CHART_MAX_POINTS", 2000)
+    rows = len(df)
+    if chart_type in ("bar", "barh", "pie"):
+        if len(df.columns) == 1:
+            # Uma coluna só: conta as ocorrências de cada valor
+            labels, values = df.iloc[:, 0], pd.Series(1, index=df.index, name="quantidade")
+        elif len(df.columns) == 2:
+            labels, values = df.iloc[:, 0], _numeric(df.iloc[:, 1])
+        else:
+            raise ValueError("Gráficos de barra e de pizza requerem 2 colunas (categoria e valor) ou 1 coluna (contagem).")
+        if chart_type == "pie" and (values < 0).any():
+            raise ValueError("Gráficos de pizza não aceitam valores negativos.")
+        limit = get_int_config("CHART_MAX_PIE_SLICES" if chart_type == "pie" else "CHART_MAX_CATEGORIES",
+                               8 if chart_type == "pie" else 20)
+        grouped, folded = top_n_with_others(labels, values, limit)
+        frame = pd.DataFrame({labels.name if labels.name is not None else "categoria": grouped.index,
+                              values.name if values.name is not None else "valor": grouped.to_numpy()})
+        note = f"{folded} categorias menores somadas em '{OTHERS_LABEL}'" if folded else ""
+        return frame, note
+
+    if chart_type in ("line", "area"):
+        if len(df.columns) < 2:
+            raise ValueError("Gráficos de linha requerem uma coluna para o eixo X e ao menos uma de valores.")
+        x_values, continuous = _axis_values(df.iloc[:, 0])
+        ys = {column: _numeric(df[column]).to_numpy(dtype=float) for column in df.columns[1:]}
+        order = np.argsort(x_values, kind="stable") if continuous else np.arange(rows)
+        if rows <= max_points:
+            return df.iloc[order], ""
+        # Cada série é reduzida separadamente; a união dos pontos escolhidos mantém os picos de todas
+        keep = np.zeros(rows, dtype=bool)
+        per_series = max(max_points // len(ys), 3)
+        for y in ys.values():
+            y_sorted = y[order]
+            valid = np.flatnonzero(~np.isnan(y_sorted))
+            keep[valid[lttb_indices(x_values[order][valid], y_sorted[valid], per_series)]] = True
+        return df.iloc[order[keep]], f"série reduzida de {rows:,} para {int(keep.sum()):,} pontos (LTTB)".replace(",", ".")
+
+    if chart_type == "scatter":
+        if len(df.columns) != 2:
+            raise ValueError("Gráficos de dispersão requerem exatamente 2 colunas numéricas (X e Y).")
+        if rows <= max_points:
+            return df, ""
+        sample = np.sort(np.random.default_rng(0).choice(rows, size=max_points, replace=False))
+        return df.iloc[sample], f"amostra de {max_points:,} de {rows:,} pontos".replace(",", ".")
+
+    if chart_type == "hist":
+        if len(df.columns) != 1:
+            raise ValueError("Histogramas requerem exatamente 1 coluna numérica.")
+        values = _numeric(df.iloc[:, 0]).dropna().to_numpy(dtype=float)
+        if not len(values):
+            raise ValueError("A coluna do histograma não tem valores numéricos.")
+        counts, edges = np.histogram(values, bins=get_int_config("CHART_HIST_BINS", 50))
+        return pd.DataFrame({"inicio": edges[:-1], "fim": edges[1:], "quantidade": counts}), ""
+
+    raise ValueError(f"Tipo de gráfico '{chart_type}' não suportado. Use um destes: {', '.join(CHART_TYPES)}.")
+
+def draw_chart(ax, frame: pd.DataFrame, chart_type: str):
+    """Desenha o DataFrame já preparado por `prepare_chart_data` no eixo do matplotlib."""
+    import matplotlib
+    from matplotlib.artist import setp
+
+    palette = matplotlib.colormaps["viridis"]
+    if chart_type in ("bar", "barh"):
+        labels, values = frame.iloc[:, 0].astype(str), frame.iloc[:, 1]
+        colors = palette(np.linspace(0, 0.9, len(frame)))
+        if chart_type == "bar":
+            ax.bar(labels, values, color=colors)
+            ax.set_xlabel(frame.columns[0])
+            ax.set_ylabel(frame.columns[1])
+            setp(ax.get_xticklabels(), rotation=45, ha="right")
+        else:
+            ax.barh(labels[::-1], values[::-1], color=colors[::-1])
+            ax.set_xlabel(frame.columns[1])
+    elif chart_type == "pie":
+        ax.pie(frame.iloc[:, 1], labels=frame.iloc[:, 0].astype(str), autopct="%1.1f%%", startangle=90,
+               colors=palette(np.linspace(0, 0.9, len(frame))))
+        ax.axis("equal")
+    elif chart_type in ("line", "area"):
+        x = frame.iloc[:, 0]
+        if not _axis_values(x)[1]:
+            # Eixo de texto (ex: 'AAAA-MM'): posições sequenciais, com no máximo ~20 rótulos
+            labels, x = x.astype(str).to_numpy(), np.arange(len(frame))
+            step = max(len(frame) // 20, 1)
+            ax.set_xticks(x[::step], labels[::step])
+        for position, column in enumerate(frame.columns[1:]):
+            color = palette(position / max(len(frame.columns) - 1, 1))
+            ax.plot(x, frame[column], label=column, color=color, linewidth=1.5)
+            if chart_type == "area":
+                ax.fill_between(x, frame[column], alpha=0.3, color=color)
+        ax.set_xlabel(frame.columns[0])
+        if len(frame.columns) > 2:
+            ax.legend()
+        setp(ax.get_xticklabels(), rotation=45, ha="right")
+    elif chart_type == "scatter":
+        ax.scatter(frame.iloc[:, 0], frame.iloc[:, 1], s=10, alpha=0.6, color=palette(0.3))
+        ax.set_xlabel(frame.columns[0])
+        ax.set_ylabel(frame.columns[1])
+    elif chart_type == "hist":
+        ax.stairs(frame["quantidade"], np.append(frame["inicio"].to_numpy(), frame["fim"].iloc[-1]),
+                  fill=True, color=palette(0.3))
+        ax.set_ylabel("quantidade")
+
+# --- Cache das Imagens Renderizadas ---
+# Os gráficos são desenhados numa Figure com canvas Agg, sem o pyplot: nada fica registrado
+# no gerenciador global de figuras (que vazaria uma figura por gráfico no processo do
+# Streamlit), e a figura é descartada logo após gerar os bytes. Os bytes (PNG ou SVG) ficam
+# num LRU limitado por tamanho (CHART_CACHE_MB), chaveado pelo hash dos dados, colunas,
+# tipo e título: nos reruns, o mesmo gráfico é servido sem renderizar de novo.
+
+class RenderedChartCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._items: "OrderedDict[str, Tuple[bytes, str]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, key: str) -> Optional[Tuple[bytes, str]]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.stats["misses"] += 1
+                return None
+            self._items.move_to_end(key)
+            self.stats["hits"] += 1
+            return item
+
+    def put(self, key: str, image: bytes, note: str):
+        if len(image) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._items.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous[0])
+            self._items[key] = (image, note)
+            self._bytes += len(image)
+            while self._bytes > self.max_bytes:
+                _, (evicted, _) = self._items.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.stats["evictions"] += 1
+
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.stats, "entries": len(self._items), "bytes": self._bytes}
+
+_chart_cache: Optional[RenderedChartCache] = None
+_chart_cache_lock = threading.Lock()
+
+def _get_chart_cache() -> RenderedChartCache:
+    global _chart_cache
+    with _chart_cache_lock:
+        if _chart_cache is None:
+            _chart_cache = RenderedChartCache(get_int_config("CHART_CACHE_MB", 64) * 1024 * 1024)
+        return _chart_cache
+
+def get_chart_cache_stats() -> Dict[str, Any]:
+    """Acertos, erros, remoções, entradas e bytes do cache de gráficos renderizados."""
+    return _get_chart_cache().info()
+
+def get_chart_format() -> str:
+    """"png" (padrão) ou "svg"."""
+    image_format = str(get_config_value("CHART_FORMAT", "png")).lower()
+    return image_format if image_format in ("png", "svg") else "png"
+
+def chart_cache_key(df: pd.DataFrame, chart_type: str, title: str, image_format: str) -> Optional[str]:
+    """Hash dos dados (vetorial, sem converter para texto) e dos parâmetros que mudam a imagem."""
+    digest = hashlib.blake2b(digest_size=16)
+    try:
+        digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    except TypeError:
+        return None  # Células não hasheáveis (ex: listas): o gráfico é renderizado sem cache
+    settings = [get_int_config(name, default) for name, default in (
+        ("CHART_MAX_CATEGORIES", 20), ("CHART_MAX_PIE_SLICES", 8), ("CHART_MAX_POINTS", 2000),
+        ("CHART_HIST_BINS", 50), ("CHART_DPI", 100))]
+    digest.update(repr((list(map(str, df.columns)), list(map(str, df.dtypes)), chart_type, title,
+                        image_format, settings)).encode())
+    return digest.hexdigest()
+
+def render_chart_image(data: Any, columns: Optional[List[str]], chart_type: str, title: str,
+                       image_format: Optional[str] = None) -> Tuple[bytes, str]:
+    """
+    Prepara os dados, desenha o gráfico e retorna (bytes da imagem, observação sobre a
+    redução dos dados), usando o cache quando o mesmo gráfico já foi renderizado.
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    image_format = image_format or get_chart_format()
+    chart_type = chart_type.lower()
+    df = to_frame(data, columns)
+    cache = _get_chart_cache()
+    key = chart_cache_key(df, chart_type, title, image_format)
+    cached = cache.get(key) if key else None
+    if cached is not None:
+        return cached
+
+    frame, note = prepare_chart_data(df, chart_type)
+    fig = Figure(figsize=(10, 6), dpi=get_int_config("CHART_DPI", 100))
+    FigureCanvasAgg(fig)
+    try:
+        ax = fig.add_subplot()
+        draw_chart(ax, frame, chart_type)
+        ax.set_title(title, fontsize=16)
+        fig.tight_layout()
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format=image_format)
+    finally:
+        fig.clear()  # Libera os artistas mesmo que algo ainda referencie a figura
+    image = buffer.getvalue()
+    if key:
+        cache.put(key, image, note)
+    return image, note
+
 # --- INÍCIO DA MODIFICAÇÃO ---
 
 # 1. Definimos um schema de entrada claro usando Pydantic
 class PlotInput(BaseModel):
-    data: list = Field(description="Lista de listas ou tuplas representando as linhas dos dados.")
-    columns: list[str] = Field(description="Lista de strings com os nomes das colunas.")
-    chart_type: str = Field(description="Tipo de gráfico a ser gerado. Valores válidos: 'bar', 'pie'.")
+    data: Any = Field(description="Dados do gráfico: lista de linhas (listas ou tuplas) ou objeto {coluna: lista de valores}.")
+    columns: Optional[list[str]] = Field(None, description="Nomes das colunas (obrigatório quando `data` é uma lista de linhas).")
+    chart_type: str = Field(description="Tipo de gráfico: 'bar', 'barh', 'pie', 'line', 'area', 'scatter' ou 'hist'.")
     title: str = Field(description="Um título descritivo para o gráfico.")
 
 # 2. Usamos o decorador @tool com o schema de entrada (args_schema)
 @tool(args_schema=PlotInput)
-def create_chart_from_data(data: list, columns: list, chart_type: str, title: str) -> str:
+def create_chart_from_data(data: Any, columns: Optional[list], chart_type: str, title: str) -> str:
     """
     Use esta ferramenta SEMPRE que o usuário pedir para gerar um GRÁFICO, PLOT, VISUALIZAÇÃO ou DIAGRAMA.
-    Não use para exibir dados em tabelas. Use-a para criar um gráfico de barras ('bar') ou de pizza ('pie').
+    Não use para exibir dados em tabelas. Tipos: barras ('bar' ou 'barh'), pizza ('pie'), linha ('line'),
+    área ('area'), dispersão ('scatter') e histograma ('hist'). Resultados grandes são agregados automaticamente.
     Você DEVE ter os dados de uma query SQL ANTES de chamar esta ferramenta.
     """
     try:
-        if not data:
+        if data is None or len(data) == 0:
             return "Erro: Não há dados para plotar."
 
-        df = pd.DataFrame(data, columns=columns)
-        fig, ax = plt.subplots(figsize=(10, 6))
-
-        if chart_type.lower() == 'bar':
-            if len(df.columns) != 2:
-                return "Erro: Gráficos de barra requerem exatamente 2 colunas (categoria e valor)."
-            sns.barplot(x=df.columns[0], y=df.columns[1], data=df, ax=ax, palette="viridis")
-            plt.xticks(rotation=45, ha='right')
-        
-        elif chart_type.lower() == 'pie':
-            if len(df.columns) != 2:
-                return "Erro: Gráficos de pizza requerem exatamente 2 colunas (rótulo e valor)."
-            ax.pie(df.iloc[:, 1], labels=df.iloc[:, 0], autopct='%1.1f%%', startangle=90, colors=sns.color_palette("viridis", len(df)))
-            ax.axis('equal')
+        try:
+            # matplotlib é pesado: só é importado quando um gráfico é de fato renderizado
+            image, note = render_chart_image(data, columns, chart_type, title)
+        except ValueError as e:
+            return f"Erro: {e}"
 
-        else:
-            return f"Erro: Tipo de gráfico '{chart_type}' não suportado. Use 'bar' ou 'pie'."
+        # O truque para exibir no Streamlit: os bytes já renderizados (ou vindos do cache)
+        st.image(image.decode() if image.startswith(b"<?xml") else image, width="stretch")
+        if note:
+            st.caption(f"Gráfico simplificado: {note}.")
+
+        return f"Sucesso! O gráfico '{title}' foi gerado e exibido na interface." + (f" Observação: {note}." if note else "")
 
-        ax.set_title(title, fontsize=16)
-        plt.tight_layout()
-        
-        # O truque para exibir no Streamlit
-        st.pyplot(fig)
-        
-        return f"Sucesso! O gráfico '{title}' foi gerado e exibido na interface."
-    
     except Exception as e:
-        # Limpa qualquer figura que possa ter ficado em memória
-        plt.close('all')
-        return f"Ocorreu um erro ao tentar gerar o gráfico: {e}"
\ No newline at end of file
+        return f"Ocorreu um erro ao tentar gerar o gráfico: {e}"
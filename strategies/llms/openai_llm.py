@@ -1,19 +1,145 @@
-from langchain_openai import ChatOpenAI
-from config import get_openai_temperature
+import asyncio
+import hashlib
+import threading
+from contextlib import asynccontextmanager, contextmanager
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, Iterator, Optional, Tuple
+
+from config import get_float_config, get_int_config, get_openai_temperature
+
+if TYPE_CHECKING:
+    # langchain_openai e httpx (~1s de import) só são carregados quando o primeiro modelo é criado
+    import httpx
+    from langchain_openai import ChatOpenAI
+
+# --- Registro de Clientes ---
+# Um ChatOpenAI por (hash da chave, modelo, temperatura), reaproveitado entre perguntas e sessões.
+# Todos compartilham o mesmo pool HTTP (keep-alive), então as conexões TLS com a API são
+# reutilizadas em vez de abertas a cada pergunta. Retentativas com backoff exponencial e jitter
+# ficam a cargo do SDK da OpenAI (OPENAI_MAX_RETRIES), que também respeita o Retry-After.
+
+_lock = threading.Lock()
+_clients: Dict[Tuple[str, str, float], "ChatOpenAI"] = {}
+_http_clients: Dict[str, Any] = {}
+_request_slots: Optional[threading.BoundedSemaphore] = None
+_stats = {"client_hits": 0, "client_misses": 0, "requests": 0, "new_connections": 0}
+
+def _count(name: str, amount: int = 1):
+    with _lock:
+        _stats[name] += amount
+
+def _on_connection_event(event_name: str, info: Dict[str, Any]):
+    # Evento do httpcore emitido apenas quando uma nova conexão TCP é aberta
+    if event_name == "connection.connect_tcp.complete":
+        _count("new_connections")
+
+async def _aon_connection_event(event_name: str, info: Dict[str, Any]):
+    _on_connection_event(event_name, info)
+
+def _on_request(request: "httpx.Request"):
+    _count("requests")
+    request.extensions["trace"] = _on_connection_event
+
+async def _aon_request(request: "httpx.Request"):
+    _count("requests")
+    request.extensions["trace"] = _aon_connection_event
+
+def _http_settings() -> Dict[str, Any]:
+    import httpx
+    max_connections = get_int_config("LLM_MAX_CONNECTIONS", 20)
+    return {
+        "timeout": httpx.Timeout(get_float_config("OPENAI_TIMEOUT", 60), connect=get_float_config("OPENAI_CONNECT_TIMEOUT", 10)),
+        "limits": httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections,
+                               keepalive_expiry=get_float_config("LLM_KEEPALIVE_EXPIRY", 60)),
+    }
+
+def _get_http_clients() -> Tuple["httpx.Client", "httpx.AsyncClient"]:
+    """Clientes HTTP (síncrono e assíncrono) compartilhados por todos os modelos. Chamar com _lock."""
+    import httpx
+    if not _http_clients:
+        settings = _http_settings()
+        _http_clients["sync"] = httpx.Client(event_hooks={"request": [_on_request]}, **settings)
+        _http_clients["async"] = httpx.AsyncClient(event_hooks={"request": [_aon_request]}, **settings)
+    return _http_clients["sync"], _http_clients["async"]
+
+def _hash_api_key(api_key: str) -> str:
+    # A chave nunca fica em claro no registro
+    return hashlib.sha256(api_key.encode()).hexdigest()[:16]
 
 def get_openai_llm(api_key: str, model_name: str):
     """
-    Inicializa e retorna o modelo de linguagem da OpenAI usando a chave de API fornecida.
+    Retorna o modelo de linguagem da OpenAI para a chave de API fornecida.
+    A instância é criada uma única vez por (chave, modelo, temperatura) e reutilizada.
     """
     if not api_key:
         raise ValueError("A chave da API da OpenAI é necessária para inicializar o modelo.")
-    
+
     if not model_name:
         raise ValueError("O nome do modelo da OpenAI é necessário.")
-        
-    llm = ChatOpenAI(
-        model=model_name,
-        temperature=get_openai_temperature(),
-        api_key=api_key # Usa a chave passada como argumento
-    )
-    return llm
\ No newline at end of file
+
+    temperature = get_openai_temperature()
+    key = (_hash_api_key(api_key), model_name, temperature)
+    with _lock:
+        llm = _clients.get(key)
+        if llm is not None:
+            _stats["client_hits"] += 1
+            return llm
+        _stats["client_misses"] += 1
+        from langchain_openai import ChatOpenAI
+        http_client, http_async_client = _get_http_clients()
+        llm = ChatOpenAI(
+            model=model_name,
+            temperature=temperature,
+            api_key=api_key, # Usa a chave passada como argumento
+            timeout=get_float_config("OPENAI_TIMEOUT", 60),
+            max_retries=get_int_config("OPENAI_MAX_RETRIES", 3),
+            # Inclui o uso de tokens (inclusive os do cache de prompt) também nas respostas em streaming
+            stream_usage=True,
+            http_client=http_client,
+            http_async_client=http_async_client,
+        )
+        _clients[key] = llm
+        return llm
+
+def _get_request_slots() -> threading.BoundedSemaphore:
+    global _request_slots
+    with _lock:
+        if _request_slots is None:
+            _request_slots = threading.BoundedSemaphore(max(1, get_int_config("LLM_MAX_CONCURRENCY", 8)))
+        return _request_slots
+
+@contextmanager
+def llm_request_slot() -> Iterator[None]:
+    """Limita as chamadas simultâneas ao LLM no processo (LLM_MAX_CONCURRENCY)."""
+    slots = _get_request_slots()
+    slots.acquire()
+    try:
+        yield
+    finally:
+        slots.release()
+
+@asynccontextmanager
+async def allm_request_slot() -> AsyncIterator[None]:
+    """Versão assíncrona de llm_request_slot: a espera pela vaga não bloqueia o event loop."""
+    slots = _get_request_slots()
+    if not slots.acquire(blocking=False):
+        waiter = asyncio.ensure_future(asyncio.to_thread(slots.acquire))
+        try:
+            await asyncio.shield(waiter)
+        except asyncio.CancelledError:
+            # A thread ainda vai obter a vaga: devolve-a assim que isso acontecer
+            waiter.add_done_callback(lambda _: slots.release())
+            raise
+    try:
+        yield
+    finally:
+        slots.release()
+
+def get_llm_client_stats() -> Dict[str, Any]:
+    """Reuso dos clientes (instâncias do registro) e das conexões HTTP com a API."""
+    with _lock:
+        stats = dict(_stats, clients=len(_clients))
+    lookups = stats["client_hits"] + stats["client_misses"]
+    stats["client_reuse_rate"] = stats["client_hits"] / lookups if lookups else 0.0
+    requests = stats["requests"]
+    stats["connection_reuse_rate"] = max(0, requests - stats["new_connections"]) / requests if requests else 0.0
+    return stats
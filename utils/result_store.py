@@ -0,0 +1,137 @@
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from config import get_config_value, get_float_config, get_int_config
+
+logger = logging.getLogger(__name__)
+
+# Diretórios de spill dos stores ainda vivos neste processo: sessões longas não podem perder
+# os arquivos para a limpeza disparada por uma sessão nova.
+_live_spill_dirs = set()
+_live_lock = threading.Lock()
+
+def _remove_dir(path: str):
+    shutil.rmtree(path, ignore_errors=True)
+
+def _release_spill_dir(path: str):
+    with _live_lock:
+        _live_spill_dirs.discard(os.path.abspath(path))
+    _remove_dir(path)
+
+def cleanup_stale_spill_dirs(spill_root: str, max_age_seconds: float):
+    """Remove diretórios de spill de sessões antigas (ex: após um restart do servidor)."""
+    if not os.path.isdir(spill_root):
+        return
+    now = time.time()
+    with _live_lock:
+        live = set(_live_spill_dirs)
+    for name in os.listdir(spill_root):
+        path = os.path.join(spill_root, name)
+        if os.path.abspath(path) in live:
+            continue
+        if os.path.isdir(path) and now - os.path.getmtime(path) > max_age_seconds:
+            _remove_dir(path)
+
+def to_arrow(result_df: pd.DataFrame) -> pa.Table:
+    """
+    Converte o DataFrame para Arrow. Colunas que o Arrow não converte (ex: inteiros e textos
+    misturados na mesma coluna) são guardadas como texto, preservando os nulos.
+    """
+    try:
+        return pa.Table.from_pandas(result_df, preserve_index=False)
+    except (pa.ArrowException, TypeError, ValueError) as e:
+        logger.info("Resultado com colunas não convertidas para Arrow (%s); gravando-as como texto.", e)
+    converted = result_df.copy()
+    for column in converted.columns[converted.dtypes == object]:
+        converted[column] = converted[column].map(lambda value: None if pd.isna(value) else str(value))
+    return pa.Table.from_pandas(converted, preserve_index=False)
+
+class SessionResultStore:
+    """
+    Guarda os resultados do chat de uma sessão em formato colunar (Arrow), com um
+    orçamento de memória. Ao passar do orçamento, os resultados menos usados são
+    gravados em Parquet no disco e recarregados apenas quando a mensagem for exibida.
+    """
+
+    def __init__(self, memory_budget_bytes: Optional[int] = None, spill_root: Optional[str] = None):
+        self.memory_budget_bytes = memory_budget_bytes or get_int_config("RESULT_MEMORY_BUDGET_MB", 256) * 1024 * 1024
+        spill_root = spill_root or get_config_value("RESULT_SPILL_DIR", "data/spill")
+        cleanup_stale_spill_dirs(spill_root, get_float_config("RESULT_SPILL_MAX_AGE", 24 * 60 * 60))
+        self.spill_dir = os.path.join(spill_root, uuid.uuid4().hex)
+        with _live_lock:
+            _live_spill_dirs.add(os.path.abspath(self.spill_dir))
+        self._in_memory: "OrderedDict[str, pa.Table]" = OrderedDict()
+        self._spilled: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        # Remove os arquivos da sessão quando o store for coletado (sessão encerrada).
+        self._finalizer = weakref.finalize(self, _release_spill_dir, self.spill_dir)
+
+    @property
+    def memory_bytes(self) -> int:
+        return sum(table.nbytes for table in self._in_memory.values())
+
+    def put(self, result_df: pd.DataFrame) -> str:
+        """Converte o DataFrame para Arrow, guarda e retorna o id do resultado."""
+        table = to_arrow(result_df)
+        result_id = uuid.uuid4().hex
+        with self._lock:
+            self._in_memory[result_id] = table
+            self._enforce_budget(keep=result_id if table.nbytes <= self.memory_budget_bytes else None)
+        return result_id
+
+    def get(self, result_id: str) -> Optional[pd.DataFrame]:
+        """Retorna o DataFrame do resultado, relendo do Parquet se ele foi descarregado."""
+        with self._lock:
+            table = self._in_memory.get(result_id)
+            if table is not None:
+                self._in_memory.move_to_end(result_id)
+            elif result_id in self._spilled:
+                table = pq.read_table(self._spilled[result_id])
+                if table.nbytes <= self.memory_budget_bytes:
+                    self._in_memory[result_id] = table
+                    self._enforce_budget(keep=result_id)
+            else:
+                return None
+        return table.to_pandas()
+
+    def _enforce_budget(self, keep: Optional[str] = None):
+        """Descarrega para disco os resultados menos usados até caber no orçamento."""
+        total = self.memory_bytes
+        for result_id in list(self._in_memory):
+            if total <= self.memory_budget_bytes:
+                break
+            if result_id == keep:
+                continue
+            table = self._in_memory.pop(result_id)
+            if result_id not in self._spilled:
+                os.makedirs(self.spill_dir, exist_ok=True)
+                path = os.path.join(self.spill_dir, f"{result_id}.parquet")
+                pq.write_table(table, path, compression="zstd")
+                self._spilled[result_id] = path
+            total -= table.nbytes
+
+    def clear(self):
+        """Descarta todos os resultados da sessão, inclusive os arquivos em disco."""
+        with self._lock:
+            self._in_memory.clear()
+            self._spilled.clear()
+            _remove_dir(self.spill_dir)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "results_in_memory": len(self._in_memory),
+            "results_spilled": len(self._spilled),
+            "memory_bytes": self.memory_bytes,
+            "memory_budget_bytes": self.memory_budget_bytes,
+        }
@@ -1,51 +1,191 @@
+import hashlib
+import logging
 import re
+import threading
+from collections import OrderedDict
+from typing import Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
 
 # 1. DENY LIST: Palavras-chave que são sempre proibidas.
 # Mantemos esta lista para bloquear operações de escrita/modificação.
-DANGEROUS_KEYWORDS = [
-    r'\bDROP\b',
-    r'\bDELETE\b',
-    r'\bTRUNCATE\b',
-    r'\bUPDATE\b',
-    r'\bGRANT\b',
-    r'\bREVOKE\b',
-    r'\bALTER\b',
-    r'\bINSERT\b'
-]
-DANGEROUS_SQL_PATTERN = re.compile('|'.join(DANGEROUS_KEYWORDS), re.IGNORECASE)
+# INTO cobre SELECT ... INTO (cria tabelas no SQL Server/Postgres) e MERGE é escrita.
+DANGEROUS_KEYWORDS = {
+    'DROP',
+    'DELETE',
+    'TRUNCATE',
+    'UPDATE',
+    'GRANT',
+    'REVOKE',
+    'ALTER',
+    'INSERT',
+    'INTO',
+    'MERGE',
+}
 
 # 2. ALLOW LIST: Palavras-chave com as quais uma query de leitura segura DEVE começar.
 # Adicionamos 'WITH' a esta lista para permitir CTEs.
-SAFE_START_KEYWORDS = ['SELECT', 'WITH']
+SAFE_START_KEYWORDS = {'SELECT', 'WITH'}
+
+# --- Tokenizador SQL de passada única ---
+# Uma única expressão regular percorre a query da esquerda para a direita. Literais,
+# comentários e identificadores entre aspas são consumidos inteiros (e ignorados),
+# então palavras dentro deles não geram falsos positivos. Trechos não terminados
+# consomem o resto da query, o que é seguro: nada escondido neles é executável.
+_SKIPPED_PATTERN = r"""
+    (?P<comment>--[^\n]*|/\*.*?(?:\*/|\Z))
+  | (?P<string>{string})
+  | (?P<dollar>\$(?P<tag>(?:[A-Za-z_]\w*)?)\$.*?(?:\$(?P=tag)\$|\Z))
+  | (?P<quoted>{double_quoted}|`[^`]*(?:`|\Z)|\[[^\]]*(?:\]|\Z))
+"""
+# Padrão ANSI: aspas escapadas duplicando o caractere ('' e "").
+_STANDARD_QUOTES = {
+    "string": r"'(?:[^']|'')*(?:'|\Z)",
+    "double_quoted": r'"(?:[^"]|"")*(?:"|\Z)',
+}
+# Padrão MySQL: também aceita barra invertida como escape dentro das aspas.
+_BACKSLASH_QUOTES = {
+    "string": r"'(?:[^'\\]|''|\\.)*(?:'|\Z)",
+    "double_quoted": r'"(?:[^"\\]|""|\\.)*(?:"|\Z)',
+}
+
+# Tokenizador completo: todas as palavras, números e pontuação fora dos trechos ignorados.
+_TOKEN_PATTERN = _SKIPPED_PATTERN + r"""
+  | (?P<word>[A-Za-z_][\w$]*)
+  | (?P<number>\d[\w.]*)
+  | (?P<semicolon>;)
+  | (?P<punct>[^\s\w])
+"""
+# Guardrail: só precisa enxergar separadores de comandos e as palavras da deny list.
+# O prefixo consome dentro do próprio motor de regex tudo o que não importa (palavras
+# comuns, números, pontuação), então o laço em Python só vê literais, comentários, ';'
+# e palavras proibidas, mesmo em queries de vários MB. As alternativas do prefixo não se
+# sobrepõem e o sufixo sempre casa onde o prefixo para (trechos não terminados vão até o
+# fim), então quantificadores comuns nunca voltam atrás: dispensam os possessivos do 3.11.
+_DENY_WORDS = "|".join(sorted(DANGEROUS_KEYWORDS))
+_GUARD_PATTERN = r"""
+    (?:
+        [^'"`\[$;/\-\w]+
+      | (?!(?:""" + _DENY_WORDS + r""")\b)\w[\w$]*
+      | \$(?!(?:[A-Za-z_]\w*)?\$)
+      | /(?!\*)
+      | -(?!-)
+    )*
+    (?:""" + _SKIPPED_PATTERN + r"""
+      | (?P<semicolon>;)
+      | (?P<keyword>""" + _DENY_WORDS + r""")
+      | (?P<end>\Z)
+    )
+"""
+# Primeira palavra de um comando, pulando espaços, parênteses e comentários.
+_FIRST_WORD = re.compile(r"(?:\s|\(|--[^\n]*|/\*.*?\*/)*(?P<word>[A-Za-z_][\w$]*)?", re.DOTALL)
+
+_FLAGS = re.VERBOSE | re.DOTALL | re.IGNORECASE
+_TOKENS = {
+    False: re.compile(_TOKEN_PATTERN.format(**_STANDARD_QUOTES), _FLAGS),
+    True: re.compile(_TOKEN_PATTERN.format(**_BACKSLASH_QUOTES), _FLAGS),
+}
+_GUARDS = {
+    False: re.compile(_GUARD_PATTERN.format(**_STANDARD_QUOTES), _FLAGS),
+    True: re.compile(_GUARD_PATTERN.format(**_BACKSLASH_QUOTES), _FLAGS),
+}
+
+def tokenize_sql(query: str, backslash_escapes: bool = False) -> Iterator[Tuple[str, str]]:
+    """
+    Gera os tokens (tipo, texto) da query: 'word', 'number', 'semicolon', 'punct',
+    'string', 'quoted', 'dollar' e 'comment'. Espaços em branco não são emitidos.
+    """
+    for match in _TOKENS[backslash_escapes].finditer(query):
+        yield match.lastgroup, match.group()
+
+def tokenize_sql_spans(query: str, backslash_escapes: bool = False) -> Iterator[Tuple[str, str, int]]:
+    """Como tokenize_sql, mas inclui a posição inicial de cada token: (tipo, texto, início)."""
+    for match in _TOKENS[backslash_escapes].finditer(query):
+        yield match.lastgroup, match.group(), match.start()
+
+def _classify_start(query: str, start: int, end: int) -> Tuple[Optional[bool], str]:
+    """Confere a primeira palavra do comando em query[start:end]. None = comando vazio."""
+    match = _FIRST_WORD.match(query, start, end)
+    word = match.group("word")
+    if word is None:
+        if query[match.end():end].strip():
+            return False, "o comando não começa com uma operação de leitura segura (ex: SELECT, WITH)"
+        return None, ""
+    if word.upper() not in SAFE_START_KEYWORDS:
+        return False, f"o comando começa com '{word.upper()}', e não com uma operação de leitura segura (ex: SELECT, WITH)"
+    return True, ""
+
+def _check_mode(query: str, backslash_escapes: bool) -> Tuple[bool, str]:
+    statements = 0
+    statement_start = 0
+    for match in _GUARDS[backslash_escapes].finditer(query):
+        kind = match.lastgroup
+        if kind == "keyword":
+            return False, f"palavra-chave perigosa encontrada: '{match.group(kind).upper()}'"
+        elif kind == "semicolon":
+            is_safe, reason = _classify_start(query, statement_start, match.start("semicolon"))
+            if is_safe is False:
+                return False, reason
+            statements += is_safe is True
+            statement_start = match.end()
+    is_safe, reason = _classify_start(query, statement_start, len(query))
+    if is_safe is False:
+        return False, reason
+    statements += is_safe is True
+    if not statements:
+        return False, "a query não contém nenhum comando"
+    return True, ""
+
+def check_query(query: str) -> Tuple[bool, str]:
+    """
+    Analisa a query em uma única passada e retorna (seguro, motivo). Cada comando
+    separado por ';' precisa começar com SELECT/WITH e nenhum pode conter palavras
+    da deny list fora de literais, comentários ou identificadores entre aspas.
+    """
+    if not query or not query.strip():
+        return False, "query vazia"
+
+    # Se houver barra invertida, a query é analisada nas duas convenções de escape:
+    # ela só passa se for segura em ambas (evita esconder comandos dentro de um literal).
+    modes = (False, True) if "\\" in query else (False,)
+    for backslash_escapes in modes:
+        is_safe, reason = _check_mode(query, backslash_escapes)
+        if not is_safe:
+            return False, reason
+    return True, ""
+
+# --- Cache de veredictos ---
+# A chave é um hash da query, para não manter queries de vários MB em memória.
+_VERDICT_CACHE_SIZE = 4096
+_verdict_cache: "OrderedDict[bytes, Tuple[bool, str]]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+def _cached_check(query: str) -> Tuple[bool, str]:
+    key = hashlib.blake2b(query.encode(), digest_size=16).digest()
+    with _cache_lock:
+        verdict = _verdict_cache.get(key)
+        if verdict is not None:
+            _verdict_cache.move_to_end(key)
+            return verdict
+    verdict = check_query(query)
+    with _cache_lock:
+        _verdict_cache[key] = verdict
+        if len(_verdict_cache) > _VERDICT_CACHE_SIZE:
+            _verdict_cache.popitem(last=False)
+    return verdict
 
 def is_query_safe(query: str) -> bool:
     """
     Verifica se uma query SQL é segura através de uma abordagem de duas camadas:
-    1. Garante que a query não contém palavras-chave destrutivas (Deny List).
-    2. Garante que a query começa com uma palavra-chave de leitura conhecida (Allow List).
+    1. Garante que nenhum comando contém palavras-chave destrutivas (Deny List).
+    2. Garante que cada comando começa com uma palavra-chave de leitura conhecida (Allow List).
+    Literais, comentários e identificadores entre aspas não são considerados.
     Retorna True se a query for segura, False caso contrário.
     """
     if not query:
         return False
-        
-    stripped_query = query.strip().upper()
-
-    # --- Teste 1: Verificar a presença de palavras-chave perigosas ---
-    dangerous_match = DANGEROUS_SQL_PATTERN.search(stripped_query)
-    if dangerous_match:
-        print(f"⚠️ ALERTA DE SEGURANÇA: Query bloqueada! Palavra-chave perigosa encontrada: '{dangerous_match.group()}'")
-        return False
-
-    # --- Teste 2: Verificar se a query começa com uma palavra-chave segura ---
-    is_safe_start = False
-    for keyword in SAFE_START_KEYWORDS:
-        if stripped_query.startswith(keyword):
-            is_safe_start = True
-            break
-    
-    if not is_safe_start:
-        print(f"⚠️ ALERTA DE SEGURANÇA: Query bloqueada! A query não começa com uma operação de leitura segura (ex: SELECT, WITH). Query: \"{query[:100]}...\"")
-        return False
 
-    # Se passou em ambos os testes, a query é considerada segura.
-    return True
\ No newline at end of file
+    is_safe, reason = _cached_check(query)
+    if not is_safe:
+        logger.warning("Query bloqueada pelo guardrail de segurança: %s. Query: \"%s...\"", reason, query[:100])
+    return is_safe
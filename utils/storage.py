@@ -1,7 +1,9 @@
 import json
+import os
+import sqlite3
+import threading
 import time
-from typing import Dict, Any, List
-from cryptography.fernet import Fernet, InvalidToken
+from typing import Dict, Any, List, Optional
 from config import get_config_value
 
 # --- Configuração de Criptografia ---
@@ -10,122 +12,395 @@ encryption_key_str = get_config_value("ENCRYPTION_KEY")
 if not encryption_key_str:
     raise ValueError("ENCRYPTION_KEY não encontrada nas configurações. Por favor, gere uma e adicione ao seu .env ou st.secrets.")
 
-# Converte a chave para bytes e inicializa o cifrador
+# Converte a chave para bytes; o cifrador só é criado no primeiro uso (ver _get_cipher)
 ENCRYPTION_KEY = encryption_key_str.encode()
-cipher_suite = Fernet(ENCRYPTION_KEY)
+_cipher_suite = None
 
-# --- Funções de Armazenamento Genéricas ---
+def _get_cipher():
+    """Cifrador Fernet, importado e inicializado sob demanda para não pesar no início da aplicação."""
+    global _cipher_suite
+    if _cipher_suite is None:
+        from cryptography.fernet import Fernet
+        _cipher_suite = Fernet(ENCRYPTION_KEY)
+    return _cipher_suite
+
+def _encrypt(text: str) -> str:
+    return _get_cipher().encrypt(text.encode()).decode()
+
+def _decrypt(token: str) -> Optional[str]:
+    """Descriptografa o texto; retorna None se a chave de criptografia mudou ou o dado está corrompido."""
+    from cryptography.fernet import InvalidToken
+    try:
+        return _get_cipher().decrypt(token.encode()).decode()
+    except InvalidToken:
+        return None
+
+# --- Armazenamento em SQLite ---
+# Cada operação lê/escreve apenas as linhas envolvidas, dentro de uma transação.
+# O modo WAL permite leituras concorrentes enquanto outra sessão/processo escreve.
+STORAGE_DB = get_config_value("STORAGE_DB_PATH", "data/storage.db")
+# Arquivo JSON legado, migrado automaticamente na primeira abertura do banco.
 STORAGE_FILE = "data/storage.json"
-def _load_storage() -> Dict[str, Any]:
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS dashboards (
+    connection_id TEXT NOT NULL,
+    dashboard_name TEXT NOT NULL,
+    PRIMARY KEY (connection_id, dashboard_name)
+);
+CREATE TABLE IF NOT EXISTS metrics (
+    connection_id TEXT NOT NULL,
+    dashboard_name TEXT NOT NULL,
+    metric_name TEXT NOT NULL,
+    question TEXT,
+    sql_query TEXT,
+    cache_ttl INTEGER,
+    PRIMARY KEY (connection_id, dashboard_name, metric_name)
+);
+CREATE TABLE IF NOT EXISTS metadata (
+    connection_id TEXT PRIMARY KEY,
+    content TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS api_key_storage (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    encrypted_key TEXT NOT NULL,
+    expires INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS connection_uris (
+    connection_id TEXT PRIMARY KEY,
+    encrypted_uri TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS dashboard_schedules (
+    connection_id TEXT NOT NULL,
+    dashboard_name TEXT NOT NULL,
+    interval_seconds INTEGER NOT NULL,
+    enabled INTEGER NOT NULL DEFAULT 1,
+    last_run_at REAL,
+    next_run_at REAL,
+    PRIMARY KEY (connection_id, dashboard_name)
+);
+CREATE TABLE IF NOT EXISTS schedule_runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    connection_id TEXT NOT NULL,
+    dashboard_name TEXT NOT NULL,
+    metric_name TEXT NOT NULL,
+    started_at REAL NOT NULL,
+    duration REAL NOT NULL,
+    row_count INTEGER,
+    status TEXT NOT NULL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_schedule_runs_dashboard ON schedule_runs (connection_id, dashboard_name, started_at);
+CREATE TABLE IF NOT EXISTS storage_info (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+_connection = None
+_lock = threading.RLock()
+# Cache de leitura em memória, descartado a cada escrita local ou quando o
+# PRAGMA data_version indica que outro processo alterou o banco.
+_read_cache: Dict[tuple, Any] = {}
+_data_version = None
+
+def _get_connection() -> sqlite3.Connection:
+    global _connection
+    if _connection is None:
+        connection = sqlite3.connect(STORAGE_DB, timeout=10, check_same_thread=False, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.executescript(_SCHEMA)
+        _add_missing_columns(connection)
+        _connection = connection
+        _migrate_from_json()
+    return _connection
+
+def _add_missing_columns(connection: sqlite3.Connection):
+    """Acrescenta colunas novas a bancos criados por versões anteriores."""
+    columns = {row[1] for row in connection.execute("PRAGMA table_info(metrics)")}
+    if "cache_ttl" not in columns:
+        connection.execute("ALTER TABLE metrics ADD COLUMN cache_ttl INTEGER")
+
+def _migrate_from_json():
+    """Importa o storage.json legado uma única vez (o arquivo original é mantido intacto)."""
+    connection = _connection
+    if connection.execute("SELECT 1 FROM storage_info WHERE key = 'json_migrated'").fetchone():
+        return
+    data = {}
+    if os.path.exists(STORAGE_FILE):
+        try:
+            with open(STORAGE_FILE, 'r') as f:
+                content = f.read()
+                data = json.loads(content) if content else {}
+        except json.JSONDecodeError:
+            data = {}
+
+    connection.execute("BEGIN IMMEDIATE")
     try:
-        with open(STORAGE_FILE, 'r') as f:
-            content = f.read()
-            if not content: return {"dashboards": {}, "api_key_storage": {}}
-            return json.loads(content)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return {"dashboards": {}, "api_key_storage": {}}
+        # Outro processo (ex: o agendador iniciado junto com o app) pode ter migrado entre a
+        # primeira verificação e o BEGIN IMMEDIATE: confere de novo já com o lock de escrita
+        if connection.execute("SELECT 1 FROM storage_info WHERE key = 'json_migrated'").fetchone():
+            connection.execute("COMMIT")
+            return
+        for connection_id, dashboards in data.get("dashboards", {}).items():
+            for dashboard_name, metrics in dashboards.items():
+                connection.execute(
+                    "INSERT OR IGNORE INTO dashboards (connection_id, dashboard_name) VALUES (?, ?)",
+                    (connection_id, dashboard_name))
+                for metric_name, metric in metrics.items():
+                    connection.execute(
+                        "INSERT OR IGNORE INTO metrics (connection_id, dashboard_name, metric_name, question, sql_query) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (connection_id, dashboard_name, metric_name, metric.get("question"), metric.get("sql_query")))
+        for connection_id, content in data.get("metadata", {}).items():
+            connection.execute(
+                "INSERT OR IGNORE INTO metadata (connection_id, content) VALUES (?, ?)", (connection_id, content))
+        key_storage = data.get("api_key_storage") or {}
+        if "encrypted_key" in key_storage:
+            connection.execute(
+                "INSERT OR IGNORE INTO api_key_storage (id, encrypted_key, expires) VALUES (1, ?, ?)",
+                (key_storage["encrypted_key"], key_storage.get("expires", 0)))
+        connection.execute("INSERT OR IGNORE INTO storage_info (key, value) VALUES ('json_migrated', ?)", (str(int(time.time())),))
+        connection.execute("COMMIT")
+    except Exception:
+        connection.execute("ROLLBACK")
+        raise
 
-def _save_storage(data: Dict[str, Any]):
-    with open(STORAGE_FILE, 'w') as f:
-        json.dump(data, f, indent=4)
+def _cached_read(cache_key: tuple, query: str, params: tuple = ()) -> List[tuple]:
+    """Executa uma leitura usando o cache em memória enquanto o banco não mudar."""
+    global _data_version
+    with _lock:
+        connection = _get_connection()
+        data_version = connection.execute("PRAGMA data_version").fetchone()[0]
+        if data_version != _data_version:
+            _read_cache.clear()
+            _data_version = data_version
+        if cache_key not in _read_cache:
+            _read_cache[cache_key] = connection.execute(query, params).fetchall()
+        return _read_cache[cache_key]
+
+def _write(*statements: tuple):
+    """Aplica os comandos (sql, params) numa única transação e invalida o cache de leitura."""
+    with _lock:
+        connection = _get_connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            for query, params in statements:
+                connection.execute(query, params)
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        finally:
+            _read_cache.clear()
 
 # --- Funções de Dashboard Contextualizadas ---
 def get_dashboard_names(connection_id: str) -> List[str]:
     """Retorna os nomes dos dashboards para uma conexão específica."""
-    storage = _load_storage()
-    return list(storage.get("dashboards", {}).get(connection_id, {}).keys())
+    rows = _cached_read(
+        ("dashboards", connection_id),
+        "SELECT dashboard_name FROM dashboards WHERE connection_id = ? ORDER BY rowid",
+        (connection_id,))
+    return [row[0] for row in rows]
 
 def load_dashboard_metrics(connection_id: str, dashboard_name: str) -> Dict[str, Any]:
     """Carrega as métricas de um dashboard específico para uma conexão."""
-    storage = _load_storage()
-    return storage.get("dashboards", {}).get(connection_id, {}).get(dashboard_name, {})
-
-def save_metric_to_dashboard(connection_id: str, dashboard_name: str, metric_name: str, question: str, sql_query: str):
-    """Salva ou atualiza uma métrica, incluindo a query SQL."""
-    storage = _load_storage()
-    storage.setdefault("dashboards", {}).setdefault(connection_id, {}).setdefault(dashboard_name, {})    
-    storage["dashboards"][connection_id][dashboard_name][metric_name] = {
-        "question": question,
-        "sql_query": sql_query
+    rows = _cached_read(
+        ("metrics", connection_id, dashboard_name),
+        "SELECT metric_name, question, sql_query, cache_ttl FROM metrics "
+        "WHERE connection_id = ? AND dashboard_name = ? ORDER BY rowid",
+        (connection_id, dashboard_name))
+    return {
+        name: {"question": question, "sql_query": sql_query, "cache_ttl": cache_ttl}
+        for name, question, sql_query, cache_ttl in rows
     }
-    _save_storage(storage)
+
+def save_metric_to_dashboard(
+    connection_id: str,
+    dashboard_name: str,
+    metric_name: str,
+    question: str,
+    sql_query: str,
+    cache_ttl: Optional[int] = None,
+):
+    """
+    Salva ou atualiza uma métrica, incluindo a query SQL.
+    `cache_ttl` é a validade (s) do resultado no cache compartilhado; None usa o padrão.
+    """
+    _write(
+        ("INSERT OR IGNORE INTO dashboards (connection_id, dashboard_name) VALUES (?, ?)",
+         (connection_id, dashboard_name)),
+        # O upsert preserva a posição (rowid) da métrica quando ela já existe.
+        ("INSERT INTO metrics (connection_id, dashboard_name, metric_name, question, sql_query, cache_ttl) "
+         "VALUES (?, ?, ?, ?, ?, ?) "
+         "ON CONFLICT (connection_id, dashboard_name, metric_name) "
+         "DO UPDATE SET question = excluded.question, sql_query = excluded.sql_query, cache_ttl = excluded.cache_ttl",
+         (connection_id, dashboard_name, metric_name, question, sql_query, cache_ttl)),
+    )
 
 def delete_metric_from_dashboard(connection_id: str, dashboard_name: str, metric_name: str):
     """Deleta uma métrica de um dashboard, dentro de uma conexão específica."""
-    storage = _load_storage()
-    metrics = storage.get("dashboards", {}).get(connection_id, {}).get(dashboard_name, {})
-    if metric_name in metrics:
-        del metrics[metric_name]
-        _save_storage(storage)
+    _write(("DELETE FROM metrics WHERE connection_id = ? AND dashboard_name = ? AND metric_name = ?",
+            (connection_id, dashboard_name, metric_name)))
 
 def delete_dashboard(connection_id: str, dashboard_name: str):
     """Deleta um dashboard inteiro de uma conexão específica."""
-    storage = _load_storage()
-    conn_dashboards = storage.get("dashboards", {}).get(connection_id, {})
-    if dashboard_name in conn_dashboards:
-        del conn_dashboards[dashboard_name]
-        _save_storage(storage)
+    _write(
+        ("DELETE FROM metrics WHERE connection_id = ? AND dashboard_name = ?", (connection_id, dashboard_name)),
+        ("DELETE FROM dashboards WHERE connection_id = ? AND dashboard_name = ?", (connection_id, dashboard_name)),
+        ("DELETE FROM dashboard_schedules WHERE connection_id = ? AND dashboard_name = ?", (connection_id, dashboard_name)),
+        # Um dashboard recriado com o mesmo nome não deve herdar o histórico do anterior
+        ("DELETE FROM schedule_runs WHERE connection_id = ? AND dashboard_name = ?", (connection_id, dashboard_name)),
+    )
+
+# --- Agendamento de Dashboards ---
+# O agendador roda fora do Streamlit, então a URI da conexão é guardada (criptografada)
+# junto com o agendamento.
+SCHEDULE_HISTORY_LIMIT = 500  # Execuções mantidas por dashboard
+
+def save_dashboard_schedule(connection_id: str, dashboard_name: str, interval_seconds: int, db_uri: str,
+                            next_run_at: Optional[float] = None):
+    """Cria ou atualiza o agendamento de um dashboard (intervalo em segundos)."""
+    encrypted_uri = _encrypt(db_uri)
+    _write(
+        ("INSERT INTO connection_uris (connection_id, encrypted_uri) VALUES (?, ?) "
+         "ON CONFLICT (connection_id) DO UPDATE SET encrypted_uri = excluded.encrypted_uri",
+         (connection_id, encrypted_uri)),
+        ("INSERT INTO dashboard_schedules (connection_id, dashboard_name, interval_seconds, enabled, next_run_at) "
+         "VALUES (?, ?, ?, 1, ?) "
+         "ON CONFLICT (connection_id, dashboard_name) DO UPDATE SET "
+         "interval_seconds = excluded.interval_seconds, enabled = 1, next_run_at = excluded.next_run_at",
+         (connection_id, dashboard_name, interval_seconds, next_run_at)),
+    )
+
+def delete_dashboard_schedule(connection_id: str, dashboard_name: str):
+    """Remove o agendamento de um dashboard."""
+    _write(("DELETE FROM dashboard_schedules WHERE connection_id = ? AND dashboard_name = ?",
+            (connection_id, dashboard_name)))
+
+def load_dashboard_schedule(connection_id: str, dashboard_name: str) -> Optional[Dict[str, Any]]:
+    """Retorna o agendamento de um dashboard (sem a URI), ou None se não houver."""
+    rows = _cached_read(
+        ("schedule", connection_id, dashboard_name),
+        "SELECT interval_seconds, enabled, last_run_at, next_run_at FROM dashboard_schedules "
+        "WHERE connection_id = ? AND dashboard_name = ?",
+        (connection_id, dashboard_name))
+    if not rows:
+        return None
+    interval_seconds, enabled, last_run_at, next_run_at = rows[0]
+    return {"interval_seconds": interval_seconds, "enabled": bool(enabled),
+            "last_run_at": last_run_at, "next_run_at": next_run_at}
+
+def list_dashboard_schedules() -> List[Dict[str, Any]]:
+    """Lista todos os agendamentos ativos, com a URI da conexão já descriptografada."""
+    rows = _cached_read(
+        ("schedules",),
+        "SELECT s.connection_id, s.dashboard_name, s.interval_seconds, s.last_run_at, s.next_run_at, u.encrypted_uri "
+        "FROM dashboard_schedules s JOIN connection_uris u ON u.connection_id = s.connection_id "
+        "WHERE s.enabled = 1 ORDER BY s.rowid")
+    schedules = []
+    for connection_id, dashboard_name, interval_seconds, last_run_at, next_run_at, encrypted_uri in rows:
+        db_uri = _decrypt(encrypted_uri)
+        if db_uri is None:
+            # A chave de criptografia mudou: o agendamento precisa ser salvo de novo pela UI
+            continue
+        schedules.append({
+            "connection_id": connection_id, "dashboard_name": dashboard_name, "interval_seconds": interval_seconds,
+            "last_run_at": last_run_at, "next_run_at": next_run_at, "db_uri": db_uri,
+        })
+    return schedules
+
+def update_schedule_times(connection_id: str, dashboard_name: str, last_run_at: Optional[float], next_run_at: float):
+    """Registra a última execução e a próxima prevista de um agendamento."""
+    _write(("UPDATE dashboard_schedules SET last_run_at = COALESCE(?, last_run_at), next_run_at = ? "
+            "WHERE connection_id = ? AND dashboard_name = ?",
+            (last_run_at, next_run_at, connection_id, dashboard_name)))
+
+def record_schedule_runs(connection_id: str, dashboard_name: str, runs: List[Dict[str, Any]]):
+    """
+    Grava o histórico das métricas executadas pelo agendador. Cada item tem metric_name,
+    started_at, duration, row_count, status ('ok', 'erro' ou 'ignorada') e error.
+    """
+    statements = [
+        ("INSERT INTO schedule_runs (connection_id, dashboard_name, metric_name, started_at, duration, row_count, status, error) "
+         "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+         (connection_id, dashboard_name, run["metric_name"], run["started_at"], run["duration"],
+          run.get("row_count"), run["status"], run.get("error")))
+        for run in runs
+    ]
+    statements.append((
+        "DELETE FROM schedule_runs WHERE connection_id = ? AND dashboard_name = ? AND id NOT IN ("
+        "SELECT id FROM schedule_runs WHERE connection_id = ? AND dashboard_name = ? ORDER BY id DESC LIMIT ?)",
+        (connection_id, dashboard_name, connection_id, dashboard_name, SCHEDULE_HISTORY_LIMIT)))
+    _write(*statements)
+
+def load_schedule_runs(connection_id: str, dashboard_name: str, limit: int = 20) -> List[Dict[str, Any]]:
+    """Retorna as execuções mais recentes do agendador para um dashboard."""
+    rows = _cached_read(
+        ("schedule_runs", connection_id, dashboard_name, limit),
+        "SELECT metric_name, started_at, duration, row_count, status, error FROM schedule_runs "
+        "WHERE connection_id = ? AND dashboard_name = ? ORDER BY id DESC LIMIT ?",
+        (connection_id, dashboard_name, limit))
+    return [
+        {"metric_name": metric_name, "started_at": started_at, "duration": duration,
+         "row_count": row_count, "status": status, "error": error}
+        for metric_name, started_at, duration, row_count, status, error in rows
+    ]
 
 # --- Funções de Contexto de Negócio Contextualizadas ---
 def load_custom_metadata(connection_id: str) -> str:
     """Carrega o contexto de negócio para uma conexão específica."""
-    storage = _load_storage()
-    return storage.get("metadata", {}).get(connection_id, "")
+    rows = _cached_read(
+        ("metadata", connection_id),
+        "SELECT content FROM metadata WHERE connection_id = ?",
+        (connection_id,))
+    return rows[0][0] if rows else ""
 
 def save_custom_metadata(connection_id: str, metadata: str):
     """Salva o contexto de negócio para uma conexão específica."""
-    storage = _load_storage()
-    storage.setdefault("metadata", {})[connection_id] = metadata
-    _save_storage(storage)
+    _write(("INSERT INTO metadata (connection_id, content) VALUES (?, ?) "
+            "ON CONFLICT (connection_id) DO UPDATE SET content = excluded.content",
+            (connection_id, metadata)))
 
 # --- Funções Seguras para Gerenciamento da Chave da API ---
 def save_api_key(api_key: str):
     """
     Criptografa e salva a chave da API com um timestamp de expiração (24h).
     """
-    storage = _load_storage()
     ttl_seconds = 24 * 60 * 60
     expiration_timestamp = int(time.time()) + ttl_seconds
-    
+
     # Criptografa a chave da API antes de salvar
-    encrypted_key = cipher_suite.encrypt(api_key.encode()).decode()
-    
-    storage["api_key_storage"] = {
-        "encrypted_key": encrypted_key,
-        "expires": expiration_timestamp
-    }
-    _save_storage(storage)
+    encrypted_key = _encrypt(api_key)
+
+    _write(("INSERT OR REPLACE INTO api_key_storage (id, encrypted_key, expires) VALUES (1, ?, ?)",
+            (encrypted_key, expiration_timestamp)))
 
 def load_api_key() -> str:
     """
     Carrega e descriptografa a chave da API, se existir e não estiver expirada.
     """
-    storage = _load_storage()
-    key_storage = storage.get("api_key_storage")
-    
-    if not key_storage or "encrypted_key" not in key_storage:
+    rows = _cached_read(("api_key",), "SELECT encrypted_key, expires FROM api_key_storage WHERE id = 1")
+
+    if not rows:
         return ""
-    
-    expiration_timestamp = key_storage.get("expires", 0)
-    
+
+    encrypted_key, expiration_timestamp = rows[0]
+
     if int(time.time()) < expiration_timestamp:
-        try:
-            # Descriptografa a chave antes de retornar
-            encrypted_key = key_storage["encrypted_key"].encode()
-            decrypted_key = cipher_suite.decrypt(encrypted_key).decode()
-            return decrypted_key
-        except InvalidToken:
+        # Descriptografa a chave antes de retornar
+        decrypted_key = _decrypt(encrypted_key)
+        if decrypted_key is None:
             # Se a chave de criptografia mudou ou o dado está corrompido
             delete_api_key()
             return ""
+        return decrypted_key
     else:
         # Se expirou, limpa a chave do armazenamento
         delete_api_key()
         return ""
 
 def delete_api_key():
-    """Remove a chave da API do arquivo de armazenamento."""
-    storage = _load_storage()
-    if "api_key_storage" in storage:
-        storage["api_key_storage"] = {}
-        _save_storage(storage)
\ No newline at end of file
+    """Remove a chave da API do armazenamento."""
+    _write(("DELETE FROM api_key_storage WHERE id = 1", ()))
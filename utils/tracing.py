@@ -0,0 +1,281 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Awaitable, Deque, Dict, Iterator, List, Optional, Tuple
+
+from config import get_bool_config, get_config_value, get_float_config, get_int_config
+
+logger = logging.getLogger(__name__)
+
+# --- Instrumentação das Etapas do Pipeline ---
+# Cada etapa (schema, prompt, LLM, parsing, guardrail, execução, renderização...) é medida
+# por um `span`. Os spans de uma mesma interação são agrupados num `trace`, registrado como
+# log estruturado (JSON). Todas as medições também alimentam métricas agregadas no formato
+# de texto do Prometheus, expostas em arquivo e/ou num endpoint HTTP.
+
+# Limites (s) dos buckets dos histogramas de duração
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Atributos numéricos dos spans acumulados como contadores (ex: dataspeak_rows_total{stage="fetch"})
+COUNTED_ATTRIBUTES = ("prompt_tokens", "completion_tokens", "cached_tokens", "rows", "bytes")
+
+@dataclass
+class Span:
+    name: str
+    started_at: float
+    duration: float = 0.0
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    def set(self, **attributes):
+        """Acrescenta atributos ao span (valores None são ignorados)."""
+        self.attributes.update({key: value for key, value in attributes.items() if value is not None})
+
+@dataclass
+class Trace:
+    name: str
+    trace_id: str
+    started_at: float
+    duration: float = 0.0
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    spans: List[Span] = field(default_factory=list)
+    error: Optional[str] = None
+
+    def set(self, **attributes):
+        self.attributes.update({key: value for key, value in attributes.items() if value is not None})
+
+class _Histogram:
+    def __init__(self):
+        self.bucket_counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        # Amostras recentes, para os percentis do painel da aplicação
+        self.recent: Deque[float] = deque(maxlen=1000)
+
+    def observe(self, value: float):
+        for index, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.bucket_counts[index] += 1
+        self.count += 1
+        self.total += value
+        self.recent.append(value)
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("dataspeak_trace", default=None)
+_lock = threading.Lock()
+_stage_histograms: Dict[str, _Histogram] = {}
+_trace_histograms: Dict[str, _Histogram] = {}
+_counters: Dict[Tuple[str, str], float] = {}
+_errors: Dict[str, int] = {}
+_recent_traces: Deque[Trace] = deque(maxlen=100)
+_last_file_export = 0.0
+_metrics_server: Optional[ThreadingHTTPServer] = None
+
+def is_tracing_enabled() -> bool:
+    return get_bool_config("TRACING", True)
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+def _format_error(error: BaseException) -> str:
+    return f"{type(error).__name__}: {str(error)[:300]}"
+
+def _record_span(span_obj: Span):
+    with _lock:
+        _stage_histograms.setdefault(span_obj.name, _Histogram()).observe(span_obj.duration)
+        for attribute in COUNTED_ATTRIBUTES:
+            value = span_obj.attributes.get(attribute)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                key = (attribute, span_obj.name)
+                _counters[key] = _counters.get(key, 0) + value
+        if span_obj.error:
+            _errors[span_obj.name] = _errors.get(span_obj.name, 0) + 1
+
+    trace_obj = _current_trace.get()
+    if trace_obj is not None:
+        trace_obj.spans.append(span_obj)
+    elif logger.isEnabledFor(logging.DEBUG):
+        logger.debug(json.dumps({"span": asdict(span_obj)}, default=str, ensure_ascii=False))
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Span]:
+    """
+    Mede a duração de uma etapa. Dentro de um `trace`, o span é anexado a ele; fora,
+    alimenta apenas as métricas agregadas. Exceções são registradas e propagadas.
+    """
+    span_obj = Span(name=name, started_at=time.time())
+    span_obj.set(**attributes)
+    if not is_tracing_enabled():
+        yield span_obj
+        return
+    started = time.perf_counter()
+    try:
+        yield span_obj
+    except BaseException as e:
+        span_obj.error = _format_error(e)
+        raise
+    finally:
+        span_obj.duration = time.perf_counter() - started
+        _record_span(span_obj)
+
+@contextmanager
+def trace(name: str, **attributes) -> Iterator[Trace]:
+    """Agrupa os spans de uma interação (ex: uma pergunta do chat) e registra o resultado ao final."""
+    trace_obj = Trace(name=name, trace_id=uuid.uuid4().hex[:16], started_at=time.time())
+    trace_obj.set(**attributes)
+    if not is_tracing_enabled():
+        yield trace_obj
+        return
+    token = _current_trace.set(trace_obj)
+    started = time.perf_counter()
+    try:
+        yield trace_obj
+    except BaseException as e:
+        trace_obj.error = _format_error(e)
+        raise
+    finally:
+        trace_obj.duration = time.perf_counter() - started
+        _current_trace.reset(token)
+        _finish_trace(trace_obj)
+
+@contextmanager
+def attach(trace_obj: Optional[Trace]) -> Iterator[None]:
+    """Continua um trace em outra thread (os spans criados dentro do bloco vão para ele)."""
+    token = _current_trace.set(trace_obj)
+    try:
+        yield
+    finally:
+        _current_trace.reset(token)
+
+async def run_in_trace(trace_obj: Optional[Trace], awaitable: Awaitable) -> Any:
+    """Executa uma corrotina dentro do trace informado (ex: em um event loop de outra thread)."""
+    _current_trace.set(trace_obj)
+    return await awaitable
+
+def _finish_trace(trace_obj: Trace):
+    with _lock:
+        _trace_histograms.setdefault(trace_obj.name, _Histogram()).observe(trace_obj.duration)
+        _recent_traces.append(trace_obj)
+    if get_bool_config("TRACING_LOG", True):
+        logger.info(json.dumps({"trace": asdict(trace_obj)}, default=str, ensure_ascii=False))
+    _export_file()
+
+# --- Exportação no Formato do Prometheus ---
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _render_histogram(lines: List[str], metric: str, label: str, histograms: Dict[str, _Histogram]):
+    lines.append(f"# TYPE {metric} histogram")
+    for name, histogram in sorted(histograms.items()):
+        labels = f'{label}="{_escape(name)}"'
+        for bound, count in zip(BUCKETS, histogram.bucket_counts):
+            lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {count}')
+        lines.append(f'{metric}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+        lines.append(f"{metric}_sum{{{labels}}} {histogram.total}")
+        lines.append(f"{metric}_count{{{labels}}} {histogram.count}")
+
+def render_prometheus() -> str:
+    """Métricas agregadas no formato de texto de exposição do Prometheus."""
+    lines: List[str] = []
+    with _lock:
+        _render_histogram(lines, "dataspeak_stage_duration_seconds", "stage", _stage_histograms)
+        _render_histogram(lines, "dataspeak_request_duration_seconds", "name", _trace_histograms)
+        for attribute in COUNTED_ATTRIBUTES:
+            metric = f"dataspeak_{attribute}_total"
+            values = sorted((stage, value) for (name, stage), value in _counters.items() if name == attribute)
+            if values:
+                lines.append(f"# TYPE {metric} counter")
+                lines.extend(f'{metric}{{stage="{_escape(stage)}"}} {value}' for stage, value in values)
+        if _errors:
+            lines.append("# TYPE dataspeak_stage_errors_total counter")
+            lines.extend(f'dataspeak_stage_errors_total{{stage="{_escape(stage)}"}} {count}'
+                         for stage, count in sorted(_errors.items()))
+    return "\n".join(lines) + "\n"
+
+def _export_file(force: bool = False):
+    """Grava as métricas em TRACING_PROMETHEUS_FILE (ex: para o textfile collector do node_exporter)."""
+    global _last_file_export
+    path = get_config_value("TRACING_PROMETHEUS_FILE")
+    if not path:
+        return
+    now = time.time()
+    if not force and now - _last_file_export < get_float_config("TRACING_EXPORT_INTERVAL", 5):
+        return
+    _last_file_export = now
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(render_prometheus())
+    os.replace(tmp_path, path)
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(port: Optional[int] = None) -> Optional[ThreadingHTTPServer]:
+    """
+    Inicia (uma única vez por processo) o endpoint GET /metrics na porta
+    TRACING_PROMETHEUS_PORT. Sem porta configurada, não faz nada.
+    """
+    global _metrics_server
+    port = port or get_int_config("TRACING_PROMETHEUS_PORT", 0)
+    if not port:
+        return None
+    with _lock:
+        if _metrics_server is None:
+            try:
+                _metrics_server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+            except OSError as e:
+                logger.warning("Não foi possível abrir o endpoint de métricas na porta %s: %s", port, e)
+                return None
+            threading.Thread(target=_metrics_server.serve_forever, name="metrics-server", daemon=True).start()
+        return _metrics_server
+
+# --- Consultas para o Painel da Aplicação ---
+def _percentile(samples: List[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def get_stage_summary() -> List[Dict[str, Any]]:
+    """Contagem, p50, p95 e máximo recentes (em ms) de cada etapa."""
+    with _lock:
+        samples = {name: list(histogram.recent) for name, histogram in _stage_histograms.items()}
+        errors = dict(_errors)
+    return [
+        {"etapa": name, "execuções": len(values), "p50 (ms)": _percentile(values, 0.5) * 1000,
+         "p95 (ms)": _percentile(values, 0.95) * 1000, "máx (ms)": max(values) * 1000,
+         "erros": errors.get(name, 0)}
+        for name, values in sorted(samples.items()) if values
+    ]
+
+def get_counter_totals() -> Dict[str, float]:
+    """Total de cada atributo contado (tokens do prompt, tokens em cache, linhas...), somando as etapas."""
+    totals: Dict[str, float] = {}
+    with _lock:
+        for (attribute, _), value in _counters.items():
+            totals[attribute] = totals.get(attribute, 0) + value
+    return totals
+
+def get_recent_traces(limit: int = 10) -> List[Trace]:
+    """Traces mais recentes primeiro."""
+    with _lock:
+        return list(_recent_traces)[-limit:][::-1]